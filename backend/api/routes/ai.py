@@ -1,51 +1,366 @@
 """
 AI相关API接口
 """
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+import asyncio
+import json
+import math
+from typing import Any, AsyncIterator, List, Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from core.llm_client import LLMClient
+from config import CACHE_CONFIG  # model 目录由 core.llm_client 加入 sys.path
+from prompts.task_generation import TASK_GENERATION_PROMPT
+from session_store import estimate_tokens
+from core.knowledge_base import knowledge_base
+from core.metrics import REGISTRY, counters_sample
+from core.rate_limiter import RateLimited, Reservation, create_limiter, usage_tokens
+from core.response_cache import ResponseCache
+from core.task_stream import TaskStreamParser
 
 router = APIRouter()
-llm_client = LLMClient()
+llm_client = LLMClient(cache=ResponseCache(**CACHE_CONFIG))
+limiter = create_limiter()
+
+
+@REGISTRY.collector
+def _collect_llm_counters():
+    """导出时读取缓存、请求合并与重试熔断各自维护的计数"""
+    yield counters_sample("lifeos_llm_cache_events_total", "任务生成缓存事件", llm_client.cache.counters)
+    yield counters_sample("lifeos_llm_single_flight_total", "并发相同请求的合并", llm_client.flight.counters)
+    yield counters_sample("lifeos_llm_resilience_total", "上游调用、重试与熔断拒绝", llm_client.resilience.counters)
+    breakers = llm_client.resilience.stats()["breakers"]
+    yield ("lifeos_llm_circuit_state", "gauge", "各模型熔断器当前状态（当前状态为 1）",
+           [({"model": model, "state": state}, 1) for model, state in breakers.items()])
+    yield counters_sample("lifeos_llm_router_total", "模型路由、回退与对冲请求", llm_client.router.counters)
+    models = [(kind, model, stats) for kind, spec in llm_client.router.snapshot()["classes"].items()
+              for model, stats in spec["models"].items()]
+    yield ("lifeos_llm_routed_total", "counter", "各类请求路由到各模型的次数",
+           [({"class": kind, "model": model}, stats["routed"]) for kind, model, stats in models])
+    yield ("lifeos_llm_route_p95_seconds", "gauge", "各模型在各类请求上估算的 p95 延迟（指数加权）",
+           [({"class": kind, "model": model}, stats["p95"]) for kind, model, stats in models
+            if stats["p95"] is not None])
 
 
 class TaskGenerationRequest(BaseModel):
-    """任务生成请求"""
+    """任务生成请求（提供 user_id 时检索该用户的历史任务与笔记作为参考）"""
+    goal: str
+    available_time: str = "30分钟"
+    user_id: Optional[str] = None
+
+
+class BatchGoal(BaseModel):
+    """批量生成中的单个目标"""
     goal: str
     available_time: str = "30分钟"
 
 
+class BatchTaskGenerationRequest(BaseModel):
+    """批量任务生成请求"""
+    goals: List[BatchGoal] = Field(..., min_length=1, max_length=20)
+    user_id: Optional[str] = None
+
+
+class NoteRequest(BaseModel):
+    """用户笔记"""
+    user_id: str = "default_user"
+    content: str
+
+
 class ChatRequest(BaseModel):
-    """聊天请求"""
+    """聊天请求（未提供 user_id 时按客户端 IP 限流）"""
     messages: list
     temperature: float = 0.7
+    max_tokens: int = Field(2000, ge=1, le=4000)
+    user_id: Optional[str] = None
+
+
+def _client_id(user_id: Optional[str], http: Request) -> str:
+    """限流与计费的主体：优先使用 user_id，否则按客户端 IP"""
+    return user_id or f"ip:{http.client.host if http.client else 'unknown'}"
+
+
+def _too_many(e: RateLimited) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+def _generation_cost(goal: str, context: str) -> int:
+    return limiter.estimate(TASK_GENERATION_PROMPT + goal + context, llm_client.max_tokens)
+
+
+def _chat_prompt(messages: list) -> str:
+    return "".join(str(m.get("content", "")) if isinstance(m, dict) else str(m) for m in messages)
 
 
 @router.post("/ai/generate-tasks")
-async def generate_tasks(request: TaskGenerationRequest):
+async def generate_tasks(request: TaskGenerationRequest, http: Request):
     """
     AI生成任务列表
     
     POST /api/v1/ai/generate-tasks
     Body: {"goal": "学习Python", "available_time": "每天1小时"}
+    额度不足且排队超时时返回 429（带 Retry-After）
     """
     try:
-        result = llm_client.generate_tasks(request.goal, request.available_time)
+        context = await _retrieve_context(request.user_id, request.goal)
+        cost = _generation_cost(request.goal, context)
+        async with limiter.limit(_client_id(request.user_id, http), cost) as reservation:
+            result = await llm_client.agenerate_tasks(request.goal, request.available_time, context=context)
+            reservation.used = usage_tokens(result)
         return result
+    except RateLimited as e:
+        raise _too_many(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/ai/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http: Request):
     """
     通用聊天接口
     
     POST /api/v1/ai/chat
-    Body: {"messages": [{"role": "user", "content": "你好"}]}
+    Body: {"messages": [{"role": "user", "content": "你好"}], "user_id": "user123"}
+    额度不足且排队超时时返回 429（带 Retry-After）
     """
     try:
-        result = llm_client.chat(request.messages, request.temperature)
+        cost = limiter.estimate(_chat_prompt(request.messages), request.max_tokens)
+        async with limiter.limit(_client_id(request.user_id, http), cost) as reservation:
+            result = await llm_client.achat(request.messages, request.temperature, request.max_tokens)
+            reservation.used = usage_tokens(result)
         return result
+    except RateLimited as e:
+        raise _too_many(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/ai/usage")
+async def usage(user_id: str):
+    """
+    用户的 AI 调用用量与 token 成本
+    
+    GET /api/v1/ai/usage?user_id=user123
+    """
+    return {"success": True, "usage": await limiter.usage(user_id)}
+
+
+@router.post("/ai/notes")
+async def add_note(request: NoteRequest):
+    """
+    写入用户笔记，供之后生成任务时检索
+    
+    POST /api/v1/ai/notes
+    Body: {"user_id": "user123", "content": "最近在看《流畅的Python》第3章"}
+    """
+    try:
+        chunks = await asyncio.to_thread(knowledge_base.add_text, request.user_id, request.content, {"type": "note"})
+        return {"success": True, "chunks": chunks}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _retrieve_context(user_id: Optional[str], goal: str) -> str:
+    """检索用户历史作为 Prompt 上下文；向量化可能较慢，放到线程中执行"""
+    if not user_id:
+        return ""
+    return await asyncio.to_thread(knowledge_base.build_context, user_id, goal)
+
+
+@router.get("/ai/cache/stats")
+async def cache_stats():
+    """
+    任务生成缓存的命中统计
+    
+    GET /api/v1/ai/cache/stats
+    """
+    return {"success": True, "stats": llm_client.cache.stats()}
+
+
+@router.get("/ai/single-flight/stats")
+async def single_flight_stats():
+    """
+    并发相同请求的合并统计
+    
+    GET /api/v1/ai/single-flight/stats
+    """
+    return {"success": True, "stats": llm_client.flight.stats()}
+
+
+@router.get("/ai/router/stats")
+async def router_stats():
+    """
+    模型路由统计：各类请求下各模型的估算延迟、错误率与路由次数，以及对冲请求的次数与胜出次数
+    
+    GET /api/v1/ai/router/stats
+    """
+    return {"success": True, "stats": llm_client.router.snapshot()}
+
+
+def _sse(event: str, data: Any) -> str:
+    """编码一条 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _EventStream(StreamingResponse):
+    """
+    结束时结算预占额度的 SSE 响应
+    
+    结算放在响应而不是生成器里：客户端在响应开始前断开时生成器从未运行，其 finally 也就不会执行。
+    响应结束（正常结束、断开或被取消）时先关闭生成器，让它在 finally 中写入 reservation.used，再结算；
+    生成器没有运行过时 used 为空，按没有消耗结算。
+    """
+    
+    def __init__(self, events: AsyncIterator[str], reservation: Reservation):
+        super().__init__(
+            events,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        self.reservation = reservation
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await asyncio.shield(self._settle())
+    
+    async def _settle(self):
+        try:
+            await self.body_iterator.aclose()
+        finally:
+            await limiter.settle(self.reservation, failed=True)
+
+
+def _event_stream(events: AsyncIterator[str], reservation: Reservation) -> StreamingResponse:
+    return _EventStream(events, reservation)
+
+
+@router.post("/ai/generate-tasks/stream")
+async def generate_tasks_stream(request: TaskGenerationRequest, http: Request):
+    """
+    AI生成任务列表（SSE 流式）
+    
+    POST /api/v1/ai/generate-tasks/stream
+    Body: 同 /ai/generate-tasks
+    
+    事件：
+        delta  {"content": "..."}   模型输出的文本片段
+        task   {...}                一个已完整生成并校验的任务对象（对象闭合即推送）
+        done   {"tasks": [...], "coerced": [...], "dropped": [...]}
+                                    生成结束，附全部任务、被纠正的字段与无法修复而丢弃的任务
+        error  {"detail": "..."}    生成失败
+        
+    额度不足且排队超时时直接返回 429，不开始推送
+    """
+    try:
+        context = await _retrieve_context(request.user_id, request.goal)
+        reservation = await limiter.acquire(_client_id(request.user_id, http),
+                                            _generation_cost(request.goal, context))
+    except RateLimited as e:
+        raise _too_many(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        parser = TaskStreamParser()
+        try:
+            async for delta in llm_client.astream_generate_tasks(request.goal, request.available_time,
+                                                                 context=context):
+                yield _sse("delta", {"content": delta})
+                for task in parser.feed(delta):
+                    yield _sse("task", task)
+            yield _sse("done", {"tasks": parser.tasks, "coerced": parser.coerced, "dropped": parser.dropped})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e) or type(e).__name__})
+        finally:
+            # 流式响应没有 usage，按 prompt 与已生成文本估算；结算见 _EventStream
+            reservation.used = estimate_tokens(TASK_GENERATION_PROMPT + request.goal + context) + \
+                estimate_tokens(parser.text)
+    
+    return _event_stream(events(), reservation)
+
+
+@router.post("/ai/generate-tasks/batch")
+async def generate_tasks_batch(request: BatchTaskGenerationRequest, http: Request):
+    """
+    批量生成多个目标的任务列表（SSE 流式，按完成先后推送）
+    
+    POST /api/v1/ai/generate-tasks/batch
+    Body: {"goals": [{"goal": "学习Python", "available_time": "每天1小时"}, {"goal": "锻炼身体"}]}
+    
+    事件：
+        result  {"index": 0, "goal": "...", "result": {...}}   单个目标生成成功
+        failed  {"index": 1, "goal": "...", "detail": "..."}   单个目标生成失败，其它目标照常进行
+        done    {"succeeded": 1, "failed": 1}
+        
+    整批按低优先级（batch）一次预占额度：可以排队更久，但不会动用为交互请求保留的全局额度
+    """
+    try:
+        contexts = await asyncio.gather(*(_retrieve_context(request.user_id, g.goal) for g in request.goals))
+        cost = sum(_generation_cost(g.goal, context) for g, context in zip(request.goals, contexts))
+        reservation = await limiter.acquire(_client_id(request.user_id, http), cost, priority="batch")
+    except RateLimited as e:
+        raise _too_many(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        goals = [(g.goal, g.available_time) for g in request.goals]
+        succeeded = failed = 0
+        used, unknown = 0, 0
+        try:
+            async for index, result in llm_client.agenerate_tasks_batch(goals, contexts=list(contexts)):
+                goal = request.goals[index].goal
+                tokens = usage_tokens(result)
+                if tokens is None:
+                    unknown += 1
+                else:
+                    used += tokens
+                if "error" in result:
+                    failed += 1
+                    yield _sse("failed", {"index": index, "goal": goal, "detail": result["error"]})
+                else:
+                    succeeded += 1
+                    yield _sse("result", {"index": index, "goal": goal, "result": result})
+            yield _sse("done", {"succeeded": succeeded, "failed": failed})
+        finally:
+            # 缺少 usage 的结果按平均预占额度计
+            reservation.used = used + unknown * reservation.cost // len(goals)
+    
+    return _event_stream(events(), reservation)
+
+
+@router.post("/ai/chat/stream")
+async def chat_stream(request: ChatRequest, http: Request):
+    """
+    通用聊天接口（SSE 流式）
+    
+    POST /api/v1/ai/chat/stream
+    Body: 同 /ai/chat
+    
+    事件：delta {"content": "..."}、done {}、error {"detail": "..."}
+    额度不足且排队超时时直接返回 429，不开始推送
+    """
+    try:
+        prompt = _chat_prompt(request.messages)
+        reservation = await limiter.acquire(_client_id(request.user_id, http),
+                                            limiter.estimate(prompt, request.max_tokens))
+    except RateLimited as e:
+        raise _too_many(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        generated = []
+        try:
+            async for delta in llm_client.astream_chat(request.messages, request.temperature, request.max_tokens):
+                generated.append(delta)
+                yield _sse("delta", {"content": delta})
+            yield _sse("done", {})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e) or type(e).__name__})
+        finally:
+            reservation.used = estimate_tokens(prompt) + estimate_tokens("".join(generated))
+    
+    return _event_stream(events(), reservation)
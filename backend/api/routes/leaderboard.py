@@ -0,0 +1,67 @@
+"""
+排行榜API接口
+"""
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from core.leaderboard import leaderboard
+from core.game_engine import GameEngine
+
+router = APIRouter()
+
+
+def _with_level(board: str, result: dict) -> dict:
+    # 经验榜附带等级，方便前端直接展示
+    if board == "total_exp":
+        for entry in result["entries"]:
+            entry["level"] = GameEngine.get_level_from_exp(entry["score"])
+    return result
+
+
+@router.get("/leaderboard/{board}")
+def get_leaderboard(board: str, limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0),
+                    period: Optional[str] = None):
+    """
+    排行榜分页
+    
+    GET /api/v1/leaderboard/total_exp?limit=10&offset=0
+    board: total_exp / int_total / vit_total / best_streak / daily / weekly
+    period: 周期榜的周期（如 2026-01-01、2026-W01），默认当前周期
+    """
+    try:
+        return {"success": True, "board": board, **_with_level(board, leaderboard.top(board, limit, offset, period))}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/leaderboard/{board}/rank")
+def get_rank(board: str, user_id: str = "default_user", period: Optional[str] = None):
+    """
+    用户名次
+    
+    GET /api/v1/leaderboard/weekly/rank?user_id=user123
+    """
+    try:
+        return {"success": True, "board": board, **leaderboard.rank(board, user_id, period)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/leaderboard/{board}/around")
+def get_around(board: str, user_id: str = "default_user", radius: int = Query(5, ge=0, le=50),
+               period: Optional[str] = None):
+    """
+    用户附近的名次
+    
+    GET /api/v1/leaderboard/total_exp/around?user_id=user123&radius=5
+    """
+    try:
+        result = leaderboard.around(board, user_id, radius, period)
+        return {"success": True, "board": board, **_with_level(board, result)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
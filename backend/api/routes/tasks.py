@@ -1,17 +1,33 @@
 """
 任务相关API接口
 """
-from fastapi import APIRouter, HTTPException
+import hashlib
+from datetime import date, timedelta
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from typing import Optional
 from core.task_manager import task_manager
+from core.knowledge_base import task_indexer
 from core.game_engine import GameEngine
-from api.schemas.task import TaskCreate, TaskComplete
+from core.leaderboard import leaderboard
+from api.schemas.task import (TaskBase, TaskCreate, TaskComplete, TaskBulkCreate, TaskBulkComplete,
+                              TaskTemplateCreate)
 
 router = APIRouter()
 
+# 以下接口使用普通 def，由 FastAPI 放到线程池执行：
+# 存储层的读写是阻塞调用，放在线程池中既不阻塞事件循环，也能让并发写入合并提交
+
+
+def _task_data(task: TaskBase) -> dict:
+    # 如果没指定经验值，根据难度自动计算
+    task_data = task.dict()
+    if task_data["reward_exp"] is None:
+        task_data["reward_exp"] = task.difficulty * 20
+    return task_data
+
 
 @router.post("/tasks")
-async def create_task(request: TaskCreate):
+def create_task(request: TaskCreate):
     """
     创建任务
     
@@ -19,33 +35,133 @@ async def create_task(request: TaskCreate):
     Body: {"user_id": "user123", "title": "学习Python", "difficulty": 3}
     """
     try:
-        # 如果没指定经验值，根据难度自动计算
-        task_data = request.dict()
-        if task_data["reward_exp"] is None:
-            task_data["reward_exp"] = request.difficulty * 20
-        
-        task = task_manager.create_task(request.user_id, task_data)
+        task = task_manager.create_task(request.user_id, _task_data(request))
+        task_indexer.submit(request.user_id, [task])
         return {"success": True, "task": task}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/tasks/bulk")
+def create_tasks(request: TaskBulkCreate):
+    """
+    批量创建任务（如 AI 生成的周期性任务），全部成功或全部失败
+    
+    POST /api/v1/tasks/bulk
+    Body: {"user_id": "user123", "tasks": [{"title": "背单词", "difficulty": 1}, ...]}
+    """
+    try:
+        tasks = task_manager.create_tasks(request.user_id, [_task_data(task) for task in request.tasks])
+        task_indexer.submit(request.user_id, tasks)
+        return {"success": True, "tasks": tasks}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/tasks/templates")
+def create_template(request: TaskTemplateCreate):
+    """
+    创建周期任务模板，实例在查询时按规则展开
+    
+    POST /api/v1/tasks/templates
+    Body: {"user_id": "user123", "title": "跑步", "recurrence": {"freq": "weekly", "start": "2026-01-05", "byweekday": [0, 3]}}
+    """
+    try:
+        task_data = _task_data(request)
+        task_data.pop("recurrence")
+        template = task_manager.create_template(request.user_id, task_data, request.recurrence.dict())
+        return {"success": True, "template": template}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/tasks/templates")
+def get_templates(user_id: str = "default_user"):
+    """
+    获取周期任务模板列表
+    
+    GET /api/v1/tasks/templates?user_id=user123
+    """
+    try:
+        return {"success": True, "templates": task_manager.get_templates(user_id)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/tasks/occurrences")
+def get_occurrences(user_id: str = "default_user", start: Optional[date] = None, end: Optional[date] = None):
+    """
+    获取日期范围内的周期任务实例（默认从今天起 7 天，不含 end）
+    
+    GET /api/v1/tasks/occurrences?user_id=user123&start=2026-01-01&end=2026-02-01
+    实例的 id（如 tmpl_1@2026-01-05）可直接传给 POST /tasks/complete
+    """
+    try:
+        start = start or date.today()
+        end = end or start + timedelta(days=7)
+        return {"success": True, "tasks": task_manager.get_occurrences(user_id, start, end)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# 可投影的任务字段
+TASK_FIELDS = {"id", "title", "description", "difficulty", "estimated_time", "reward_exp", "rewards",
+               "status", "created_at", "completed_at"}
+
+
 @router.get("/tasks")
-async def get_tasks(user_id: str = "default_user", status: Optional[str] = None):
+def get_tasks(response: Response, user_id: str = "default_user", status: Optional[str] = None,
+              limit: Optional[int] = Query(None, ge=1, le=500), cursor: Optional[str] = None,
+              created_from: Optional[str] = None, created_to: Optional[str] = None,
+              fields: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
     """
     获取任务列表
     
     GET /api/v1/tasks?user_id=user123&status=pending
+    GET /api/v1/tasks?user_id=user123&limit=50&cursor=...&fields=id,title,status
+    
+    - 不传 limit 时返回全部任务；传 limit 时按创建时间分页，用返回的 next_cursor 取下一页
+    - created_from / created_to：按创建时间筛选（ISO 格式，含下限不含上限）
+    - fields：只返回指定字段（逗号分隔，id 总会返回）
+    - 响应带 ETag，数据未变化时带 If-None-Match 请求返回 304
     """
     try:
-        tasks = task_manager.get_tasks(user_id, status)
-        return {"success": True, "tasks": tasks}
+        projection = None
+        if fields:
+            projection = {f.strip() for f in fields.split(",") if f.strip()} | {"id"}
+            unknown = projection - TASK_FIELDS
+            if unknown:
+                raise ValueError(f"未知字段: {', '.join(sorted(unknown))}")
+        
+        # ETag 由用户数据版本号与查询参数决定，数据未变时无需查询任务即可返回 304
+        version = task_manager.get_version(user_id)
+        query = f"{status}|{limit}|{cursor}|{created_from}|{created_to}|{fields}"
+        etag = f'W/"{version}-{hashlib.sha1(query.encode()).hexdigest()[:12]}"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        
+        if limit is None and not (cursor or created_from or created_to):
+            page = {"tasks": task_manager.get_tasks(user_id, status), "next_cursor": None}
+        else:
+            page = task_manager.get_tasks_page(user_id, status, cursor, limit or 50, created_from, created_to)
+        
+        tasks = page["tasks"]
+        if projection:
+            tasks = [{k: v for k, v in task.items() if k in projection} for task in tasks]
+        return {"success": True, "tasks": tasks, "next_cursor": page["next_cursor"]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/tasks/complete")
-async def complete_task(request: TaskComplete):
+def complete_task(request: TaskComplete):
     """
     完成任务
     
@@ -55,13 +171,17 @@ async def complete_task(request: TaskComplete):
     try:
         result = task_manager.complete_task(request.user_id, request.task_id)
         
+        # 更新知识库中该任务的状态，供之后生成任务时参考（后台进行，不计入请求耗时）
+        task_indexer.submit(request.user_id, [result["task"]])
+        leaderboard.record_completion(request.user_id, result["stats"], result["exp_gained"],
+                                      result["task"]["completed_at"])
+        
         # 检查升级
         old_exp = result["total_exp"] - result["exp_gained"]
         level_info = GameEngine.check_level_up(old_exp, result["total_exp"])
         
-        # 检查成就
-        user_stats = task_manager.get_user_stats(request.user_id)
-        achievements = GameEngine.check_achievement(user_stats)
+        # 检查成就：只检查本次发生变化的指标
+        achievements = GameEngine.check_achievement(result["changed"])
         
         return {
             "success": True,
@@ -77,8 +197,41 @@ async def complete_task(request: TaskComplete):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/tasks/complete/bulk")
+def complete_tasks(request: TaskBulkComplete):
+    """
+    批量完成任务，全部成功或全部失败；升级与成就按整批只计算一次
+    
+    POST /api/v1/tasks/complete/bulk
+    Body: {"user_id": "user123", "task_ids": ["task_1", "task_2"]}
+    """
+    try:
+        result = task_manager.complete_tasks(request.user_id, request.task_ids)
+        
+        task_indexer.submit(request.user_id, result["tasks"])
+        leaderboard.record_completion(request.user_id, result["stats"], result["exp_gained"],
+                                      result["tasks"][0]["completed_at"])
+        
+        old_exp = result["total_exp"] - result["exp_gained"]
+        level_info = GameEngine.check_level_up(old_exp, result["total_exp"])
+        achievements = GameEngine.check_achievement(result["changed"])
+        
+        return {
+            "success": True,
+            "tasks": result["tasks"],
+            "exp_gained": result["exp_gained"],
+            "total_exp": result["total_exp"],
+            "level_info": level_info,
+            "achievements": achievements
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/tasks/stats")
-async def get_stats(user_id: str = "default_user"):
+def get_stats(user_id: str = "default_user"):
     """
     获取用户统计
     
@@ -86,12 +239,13 @@ async def get_stats(user_id: str = "default_user"):
     """
     try:
         stats = task_manager.get_user_stats(user_id)
-        level = GameEngine.get_level_from_exp(stats.get("total_exp", 0))
+        progress = GameEngine.get_level_progress(stats.get("total_exp", 0))
         
         return {
             "success": True,
             "stats": stats,
-            "level": level
+            "level": progress["level"],
+            "level_progress": progress
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,17 +1,22 @@
 """
 数据模型定义 (Pydantic Schemas)
 """
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+
+
+# 单个任务的经验值上限：经验值由客户端提交，不加限制时一次完成就能把总经验推到任意大
+MAX_REWARD_EXP = 10000
 
 
 class TaskBase(BaseModel):
     """任务基础模型"""
     title: str
     description: str = ""
-    difficulty: int = 3
+    difficulty: int = Field(3, ge=1, le=5)  # 未指定经验值时按 difficulty * 20 计算
     estimated_time: int = 30
-    reward_exp: Optional[int] = None
+    reward_exp: Optional[int] = Field(None, ge=0, le=MAX_REWARD_EXP)
+    rewards: Optional[Dict[str, int]] = None  # 属性奖励，如 {"INT": 1, "VIT": 4}
 
 
 class TaskCreate(TaskBase):
@@ -19,6 +24,28 @@ class TaskCreate(TaskBase):
     user_id: str = "default_user"
 
 
+class RecurrenceSpec(BaseModel):
+    """重复规则（见 core.recurrence.RecurrenceRule）"""
+    freq: str                               # daily / weekly / monthly
+    start: str                              # 首次日期 YYYY-MM-DD
+    interval: int = 1
+    byweekday: Optional[List[int]] = None   # 0 为周一
+    bymonthday: Optional[int] = None
+    until: Optional[str] = None
+    count: Optional[int] = None
+
+
+class TaskTemplateCreate(TaskCreate):
+    """创建周期任务模板请求"""
+    recurrence: RecurrenceSpec
+
+
+class TaskBulkCreate(BaseModel):
+    """批量创建任务请求"""
+    user_id: str = "default_user"
+    tasks: List[TaskBase] = Field(..., min_length=1, max_length=200)
+
+
 class Task(TaskBase):
     """任务完整模型"""
     id: str
@@ -36,8 +63,18 @@ class TaskComplete(BaseModel):
     task_id: str
 
 
+class TaskBulkComplete(BaseModel):
+    """批量完成任务请求"""
+    user_id: str = "default_user"
+    task_ids: List[str] = Field(..., min_length=1, max_length=200)
+
+
 class UserStats(BaseModel):
     """用户统计"""
     tasks_completed: int = 0
     total_exp: int = 0
     streak_days: int = 0
+    best_streak: int = 0
+    last_active: Optional[str] = None
+    int_total: int = 0
+    vit_total: int = 0
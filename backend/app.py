@@ -1,9 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.routes import ai, tasks
+from fastapi.responses import PlainTextResponse
+from api.routes import ai, leaderboard, tasks
+from core.metrics import REGISTRY, MetricsMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：退出时关闭 LLM 连接池、知识库索引线程与任务存储"""
+    yield
+    await ai.llm_client.aclose()
+    tasks.task_indexer.close()
+    tasks.task_manager.store.close()
+
 
 # 创建 FastAPI 应用
-app = FastAPI(title="LifeOS API", version="1.0.0")
+app = FastAPI(title="LifeOS API", version="1.0.0", lifespan=lifespan)
 
 # 配置CORS（允许前端跨域访问）
 app.add_middleware(
@@ -13,10 +26,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 按路由记录请求耗时（最后添加的中间件最先执行，耗时包含 CORS 处理）
+app.add_middleware(MetricsMiddleware)
 
 # 注册API路由
 app.include_router(ai.router, prefix="/api/v1", tags=["AI"])
 app.include_router(tasks.router, prefix="/api/v1", tags=["Tasks"])
+app.include_router(leaderboard.router, prefix="/api/v1", tags=["Leaderboard"])
 
 @app.get("/")
 async def root():
@@ -27,6 +43,11 @@ async def root():
         "docs": "/docs"
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 格式的运行指标"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,126 @@
+"""
+任务存储并发压测：多线程并发创建与抢着完成同一批任务，校验 ID 不重复、每个任务只完成一次、经验值不重复发放，
+并给出吞吐随线程数的变化（内存存储分别以全局锁 stripes=1 与分段锁运行）
+
+    python -m benchmarks.concurrency --users 64 --tasks 4000 --threads 1,2,4,8,16
+
+注意：标准 CPython 有 GIL，纯内存操作的吞吐不会随线程数线性增长，分段锁消除的是锁竞争本身；
+在 free-threaded 构建（python3.13t 及以上）或写操作释放 GIL 的 SQLite 存储上才能看到多核的收益。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any
+
+from core.storage import MemoryTaskStore, SQLiteTaskStore, TaskAlreadyCompleted, TaskStore
+
+
+def new_task(i: int) -> Dict[str, Any]:
+    return {"title": f"任务{i}", "reward_exp": 1 + i % 7, "rewards": {"INT": i % 3}, "status": "pending",
+            "created_at": f"2026-01-01T00:00:{i % 60:02d}", "completed_at": None}
+
+
+def run(store: TaskStore, users: int, tasks: int, threads: int) -> Dict[str, Any]:
+    user_ids = [f"user_{u}" for u in range(users)]
+    
+    # 阶段一：并发创建，线程与用户交错，同一用户会被多个线程同时写入
+    def create(w: int) -> List[tuple]:
+        created = []
+        for i in range(w, tasks, threads):
+            user_id = user_ids[i % users]
+            created.append((user_id, store.create_task(user_id, new_task(i))["id"], 1 + i % 7))
+        return created
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        created = [item for part in pool.map(create, range(threads)) for item in part]
+    create_rate = tasks / (time.perf_counter() - start)
+    
+    # 阶段二：每个任务被两个线程同时尝试完成，只应有一次成功
+    wins, conflicts = [0] * threads, [0] * threads
+    barrier = threading.Barrier(threads)
+    
+    def complete(w: int):
+        mine = [item for k, item in enumerate(created) if k % threads in (w, (w + 1) % threads)]
+        random.Random(w).shuffle(mine)
+        barrier.wait()
+        for user_id, task_id, _ in mine:
+            try:
+                store.complete_task(user_id, task_id, "2026-01-02T08:00:00")
+                wins[w] += 1
+            except TaskAlreadyCompleted:
+                conflicts[w] += 1
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(complete, range(threads)))
+    complete_rate = (sum(wins) + sum(conflicts)) / (time.perf_counter() - start)
+    
+    errors = check(store, created, sum(wins))
+    store.close()
+    return {"create": create_rate, "complete": complete_rate, "errors": errors}
+
+
+def check(store: TaskStore, created: List[tuple], wins: int) -> List[str]:
+    """校验并发后的最终状态，返回发现的问题"""
+    errors = []
+    by_user: Dict[str, List[str]] = {}
+    exp: Dict[str, int] = {}
+    for user_id, task_id, reward in created:
+        by_user.setdefault(user_id, []).append(task_id)
+        exp[user_id] = exp.get(user_id, 0) + reward
+    
+    if wins != len(created):
+        errors.append(f"完成成功 {wins} 次，应为 {len(created)} 次")
+    for user_id, ids in by_user.items():
+        if len(set(ids)) != len(ids):
+            errors.append(f"{user_id}: 任务ID重复")
+        if sorted(ids) != sorted(f"task_{n}" for n in range(1, len(ids) + 1)):
+            errors.append(f"{user_id}: 任务ID不连续")
+        if any(t["status"] != "completed" for t in store.list_tasks(user_id)):
+            errors.append(f"{user_id}: 存在未完成的任务")
+        stats = store.get_stats(user_id) or {}
+        if stats.get("tasks_completed") != len(ids) or stats.get("total_exp") != exp[user_id]:
+            errors.append(f"{user_id}: 统计不一致 {stats.get('tasks_completed')}/{len(ids)} "
+                          f"经验 {stats.get('total_exp')}/{exp[user_id]}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--tasks", type=int, default=4000, help="每轮创建的任务总数")
+    cpus = os.cpu_count() or 1
+    default_threads = ",".join(str(n) for n in (1, 2, 4, 8, 16, 32) if n <= max(2 * cpus, 4))
+    parser.add_argument("--threads", default=default_threads, help="逗号分隔的线程数")
+    args = parser.parse_args()
+    threads = [int(n) for n in args.threads.split(",")]
+    
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"CPU {cpus} 核，GIL {'开启' if gil else '关闭'}；{args.users} 个用户，{args.tasks} 个任务，每个任务被 2 个线程抢着完成")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        stores: List[tuple] = [
+            ("memory 全局锁", lambda n: MemoryTaskStore(stripes=1)),
+            ("memory 分段锁", lambda n: MemoryTaskStore()),
+            ("sqlite", lambda n: SQLiteTaskStore(os.path.join(tmp, f"bench_{n}.db"))),
+        ]
+        failed = False
+        print(f"{'存储':<16}{'线程':>6}{'创建/秒':>12}{'完成/秒':>12}  校验")
+        for name, factory in stores:
+            for n in threads:
+                result = run(factory(n), args.users, args.tasks, n)
+                failed |= bool(result["errors"])
+                status = "通过" if not result["errors"] else "; ".join(result["errors"][:3])
+                print(f"{name:<16}{n:>6}{result['create']:>14.0f}{result['complete']:>14.0f}  {status}")
+    
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
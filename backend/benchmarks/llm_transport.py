@@ -0,0 +1,64 @@
+"""
+LLM 传输层基准：阻塞的 requests 调用 vs 连接池复用的异步调用
+
+    python -m benchmarks.llm_transport --concurrency 50 --requests 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from benchmarks.mock_llm_server import MockLLMServer
+from core.llm_client import LLMClient
+
+
+def report(name: str, latencies: List[float], elapsed: float):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<14} 请求数 {len(latencies):4d}  p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+          f"p95 {p95 * 1000:7.1f} ms  吞吐 {len(latencies) / elapsed:7.1f} req/s")
+
+
+async def run(client: LLMClient, total: int, concurrency: int, use_async: bool):
+    messages = [{"role": "user", "content": "你好"}]
+    latencies: List[float] = []
+    gate = asyncio.Semaphore(concurrency)
+    
+    async def one():
+        async with gate:
+            start = time.perf_counter()
+            if use_async:
+                result = await client.achat(messages)
+            else:
+                # 旧实现：在 async 路由里直接调用阻塞的 requests.post
+                result = client.chat(messages)
+            assert "error" not in result, result
+            latencies.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.1, help="模拟上游的生成耗时（秒）")
+    args = parser.parse_args()
+    
+    server = MockLLMServer(delay=args.delay).start()
+    
+    # 阻塞实现会把所有请求串行化，只跑少量请求以免基准耗时过长
+    sync_total = min(args.requests, 20)
+    report("requests(阻塞)", *asyncio.run(run(LLMClient("mock", server.url), sync_total, args.concurrency, False)))
+    report("httpx(异步)", *asyncio.run(run(LLMClient("mock", server.url), args.requests, args.concurrency, True)))
+    
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+端到端压测：以固定并发驱动 app.py 的任务增删查、完成、统计与 AI 生成接口，按路由给出 p50/p95/p99 延迟与 RPS，
+并可保存为基线、与基线比较以发现性能回退
+
+    python -m benchmarks.load_test --concurrency 32 --duration 30
+    python -m benchmarks.load_test --save-baseline benchmarks/baselines/local.json
+    python -m benchmarks.load_test --baseline benchmarks/baselines/local.json      # 有回退时退出码为 1
+    python -m benchmarks.load_test --cassette data/cassettes/qwen.jsonl --latency lognormal:0.8,0.4
+    
+默认在进程内通过 ASGI 调用应用（经过中间件、路由、线程池与存储，不经过网络栈），LLM 上游为回放服务
+（benchmarks.replay_llm_server），延迟与 token 速率可控，不调用付费 API；压测进程与被测应用共用 CPU。
+--url 压测已启动的服务，此时需自行将其 LLM_API_URL 指向回放服务。
+
+每个虚拟用户使用独立的 user_id 与固定种子的随机数，按 --mix 的权重循环发送请求（闭环：收到响应后立即发下一个），
+只完成自己创建的任务；AI 生成的目标各不相同，不命中响应缓存。应用内的 AI 限流额度会被调高，避免压测变成测限流。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Any, Optional
+
+import httpx
+
+from benchmarks.replay_llm_server import ReplayLLMServer
+
+# 操作名 -> 路由（与 /metrics 中的 route 标签一致）
+ROUTES = {
+    "create": "POST /tasks",
+    "list": "GET /tasks",
+    "complete": "POST /tasks/complete",
+    "stats": "GET /tasks/stats",
+    "generate": "POST /ai/generate-tasks",
+    "generate_stream": "POST /ai/generate-tasks/stream",
+}
+DEFAULT_MIX = "create=30,list=25,complete=20,stats=15,generate=7,generate_stream=3"
+
+# 与基线比较时的阈值：p95 / p99 变慢或 RPS 下降超过该比例记为回退；
+# 绝对差值低于 MIN_DELTA 秒的延迟变化视为噪声（微秒级的接口比例波动很大）
+TOLERANCE = 0.2
+MIN_DELTA = 0.002
+# 任一次运行中请求数少于该值的路由只打印变化，不判定回退（样本太少时 p99 与 RPS 的波动远超阈值）
+MIN_SAMPLES = 30
+ERROR_RATE_DELTA = 0.01
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"未知操作: {name}（可选 {', '.join(ROUTES)}）")
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩百分位，values 须已排序"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(len(values) * p + 0.5) - 1))]
+
+
+class Recorder:
+    """按路由记录延迟与错误；只统计在计时窗口内完成的请求，预热与收尾阶段的不计入"""
+    
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {route: [] for route in ROUTES.values()}
+        self.errors: Dict[str, int] = {route: 0 for route in ROUTES.values()}
+        self.statuses: Dict[str, Dict[int, int]] = {route: {} for route in ROUTES.values()}
+        self.active = False
+    
+    def add(self, route: str, latency: float, status: int, ok: bool):
+        if not self.active:
+            return
+        self.latencies[route].append(latency)
+        self.statuses[route][status] = self.statuses[route].get(status, 0) + 1
+        if not ok:
+            self.errors[route] += 1
+    
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        routes = {}
+        for route, values in self.latencies.items():
+            if not values:
+                continue
+            values = sorted(values)
+            routes[route] = {
+                "count": len(values), "rps": len(values) / elapsed, "errors": self.errors[route],
+                "error_rate": self.errors[route] / len(values),
+                "p50": percentile(values, 0.50), "p95": percentile(values, 0.95), "p99": percentile(values, 0.99),
+                "max": values[-1], "statuses": {str(k): v for k, v in sorted(self.statuses[route].items())},
+            }
+        return routes
+
+
+class VirtualUser:
+    """一个闭环的虚拟用户"""
+    
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, user_id: str, mix: Dict[str, float],
+                 seed: str):
+        self.client = client
+        self.recorder = recorder
+        self.user_id = user_id
+        self.rng = random.Random(seed)
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.pending: List[str] = []
+        self.goals = 0
+    
+    async def run(self, deadline: float):
+        while time.perf_counter() < deadline:
+            op = self.rng.choices(self.ops, self.weights)[0]
+            if op == "complete" and not self.pending:
+                op = "create"
+            await getattr(self, op)()
+    
+    async def _request(self, op: str, method: str, path: str, **kwargs) -> Optional[Dict[str, Any]]:
+        route = ROUTES[op]
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, "/api/v1" + path, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.add(route, time.perf_counter() - start, 0, False)
+            return None
+        self.recorder.add(route, time.perf_counter() - start, response.status_code, response.status_code < 400)
+        return response.json() if response.status_code < 400 else None
+    
+    def _goal(self) -> Dict[str, Any]:
+        self.goals += 1
+        return {"goal": f"在{self.goals % 12 + 1}周内学会第{self.goals}个技能", "available_time": "每天1小时",
+                "user_id": self.user_id}
+    
+    async def create(self):
+        body = {"user_id": self.user_id, "title": f"任务{self.rng.randrange(10 ** 6)}",
+                "difficulty": self.rng.randint(1, 5)}
+        data = await self._request("create", "POST", "/tasks", json=body)
+        if data:
+            self.pending.append(data["task"]["id"])
+    
+    async def list(self):
+        await self._request("list", "GET", "/tasks", params={"user_id": self.user_id, "limit": 50})
+    
+    async def complete(self):
+        task_id = self.pending.pop(self.rng.randrange(len(self.pending)))
+        await self._request("complete", "POST", "/tasks/complete", json={"user_id": self.user_id, "task_id": task_id})
+    
+    async def stats(self):
+        await self._request("stats", "GET", "/tasks/stats", params={"user_id": self.user_id})
+    
+    async def generate(self):
+        await self._request("generate", "POST", "/ai/generate-tasks", json=self._goal())
+    
+    async def generate_stream(self):
+        route = ROUTES["generate_stream"]
+        start = time.perf_counter()
+        try:
+            async with self.client.stream("POST", "/api/v1/ai/generate-tasks/stream", json=self._goal()) as response:
+                body = b"".join([chunk async for chunk in response.aiter_bytes()])
+        except httpx.HTTPError:
+            self.recorder.add(route, time.perf_counter() - start, 0, False)
+            return
+        # 流中途失败时状态码仍为 200，以 error 事件判断
+        ok = response.status_code < 400 and b"event: error" not in body
+        self.recorder.add(route, time.perf_counter() - start, response.status_code, ok)
+
+
+def _in_process_app(llm_url: str, store: str, tmp: str):
+    """按压测配置设置环境变量后导入 app（存储放在临时目录，不触碰 backend/data）"""
+    os.environ.update({
+        "LLM_API_URL": llm_url, "DASHSCOPE_API_KEY": os.getenv("DASHSCOPE_API_KEY") or "load-test",
+        "TASK_STORE": store, "TASK_DB_PATH": os.path.join(tmp, "lifeos.db"),
+        "TASK_JOURNAL_DIR": os.path.join(tmp, "journal"), "RAG_PATH": "",
+    })
+    import core.llm_client  # noqa: F401  将 model 目录加入 sys.path
+    from config import RATE_LIMIT_CONFIG
+    RATE_LIMIT_CONFIG.update(user_tokens_per_min=10 ** 12, user_burst=10 ** 12,
+                             global_tokens_per_min=10 ** 12, global_burst=10 ** 12)
+    from app import app
+    return app
+
+
+async def run(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    server = None
+    if args.url is None or args.llm_url is None:
+        server = ReplayLLMServer(cassette=args.cassette, latency=args.latency, stream_rate=args.stream_rate,
+                                 seed=args.seed).start()
+    
+    tmp = tempfile.TemporaryDirectory()
+    if args.url:
+        transport, base_url, app = None, args.url, None
+    else:
+        app = _in_process_app(args.llm_url or server.url, args.store, tmp.name)
+        transport, base_url = httpx.ASGITransport(app=app), "http://load-test"
+    
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    recorder = Recorder()
+    run_id = f"{int(time.time())}"
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits,
+                                     timeout=args.timeout) as client:
+            users = [VirtualUser(client, recorder, f"load_{run_id}_{i}", mix, f"{args.seed}:{i}")
+                     for i in range(args.concurrency)]
+            deadline = time.perf_counter() + args.warmup + args.duration
+            
+            async def measure() -> float:
+                await asyncio.sleep(args.warmup)
+                recorder.active = True
+                start = time.perf_counter()
+                await asyncio.sleep(max(0.0, deadline - start))
+                recorder.active = False
+                return time.perf_counter() - start
+            
+            measuring = asyncio.create_task(measure())
+            await asyncio.gather(*(user.run(deadline) for user in users))
+            elapsed = await measuring
+    finally:
+        if app is not None:
+            from api.routes import ai, tasks
+            await ai.llm_client.aclose()
+            tasks.task_manager.store.close()
+        if server is not None:
+            server.shutdown()
+        tmp.cleanup()
+    
+    return {
+        "meta": {
+            "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup, "mix": args.mix,
+            "target": args.url or f"in-process ({args.store})", "llm": {
+                "latency": args.latency, "stream_rate": args.stream_rate, "cassette": args.cassette,
+                "hits": server.hits if server else None, "misses": server.misses if server else None,
+            },
+            "elapsed": elapsed, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "commit": _commit(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "routes": recorder.summary(elapsed),
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def report(result: Dict[str, Any]):
+    meta = result["meta"]
+    print(f"目标 {meta['target']}，并发 {meta['concurrency']}，计时 {meta['elapsed']:.1f}s（预热 {meta['warmup']}s），"
+          f"LLM 首 token {meta['llm']['latency']}、{meta['llm']['stream_rate']} token/s")
+    print(f"{'路由':<32}{'请求数':>8}{'RPS':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'错误':>7}")
+    total = 0
+    for route, stats in result["routes"].items():
+        total += stats["count"]
+        print(f"{route:<32}{stats['count']:>8}{stats['rps']:>9.1f}{stats['p50'] * 1e3:>10.1f}"
+              f"{stats['p95'] * 1e3:>10.1f}{stats['p99'] * 1e3:>10.1f}{stats['max'] * 1e3:>10.1f}{stats['errors']:>7}")
+    print(f"{'合计':<32}{total:>8}{total / meta['elapsed']:>9.1f}")
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE) -> List[str]:
+    """与基线比较，打印各路由的变化并返回回退项"""
+    regressions = []
+    for key in ("concurrency", "mix", "target"):
+        if baseline["meta"].get(key) != result["meta"].get(key):
+            print(f"注意：{key} 与基线不同（基线 {baseline['meta'].get(key)}，本次 {result['meta'].get(key)}），比较结果仅供参考")
+    
+    print(f"与基线比较（{baseline['meta'].get('commit')} @ {baseline['meta'].get('created_at')}，阈值 {tolerance:.0%}）")
+    for route, base in baseline["routes"].items():
+        current = result["routes"].get(route)
+        if current is None:
+            regressions.append(f"{route}: 本次没有请求")
+            continue
+        noisy = min(current["count"], base["count"]) < MIN_SAMPLES
+        changes = []
+        for metric in ("p50", "p95", "p99"):
+            delta = current[metric] - base[metric]
+            changes.append(f"{metric} {delta * 1e3:+.1f}ms")
+            if not noisy and metric != "p50" and delta > MIN_DELTA and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{route}: {metric} {base[metric] * 1e3:.1f}ms -> {current[metric] * 1e3:.1f}ms")
+        ratio = current["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+        changes.append(f"RPS {ratio:+.0%}")
+        if not noisy and ratio < -tolerance:
+            regressions.append(f"{route}: RPS {base['rps']:.1f} -> {current['rps']:.1f}")
+        if current["error_rate"] > base.get("error_rate", 0.0) + ERROR_RATE_DELTA:
+            regressions.append(f"{route}: 错误率 {base.get('error_rate', 0.0):.1%} -> {current['error_rate']:.1%}")
+        print(f"  {route:<32}{'  '.join(changes)}{'  （样本太少，不判定）' if noisy else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=32, help="虚拟用户数")
+    parser.add_argument("--duration", type=float, default=30, help="计时的秒数（不含预热）")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="各操作的权重")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--store", choices=["memory", "sqlite", "journal"], default="sqlite",
+                        help="进程内压测使用的任务存储")
+    parser.add_argument("--url", help="压测已启动的服务，如 http://127.0.0.1:8000")
+    parser.add_argument("--llm-url", help="使用已启动的 LLM 服务，不启动内置的回放服务")
+    parser.add_argument("--cassette", help="回放的录制文件，缺省时回放内置的任务规划")
+    parser.add_argument("--latency", default="lognormal:0.5,0.3", help="LLM 首 token 延迟分布，见 LatencyModel")
+    parser.add_argument("--stream-rate", type=float, default=60.0, help="LLM 每秒生成的 token 数")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把结果保存为基线")
+    parser.add_argument("--baseline", metavar="PATH", help="与基线比较，有回退时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    
+    result = asyncio.run(run(args))
+    report(result)
+    
+    failed = False
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            failed = True
+            print("性能回退：")
+            for item in regressions:
+                print(f"  {item}")
+        else:
+            print("未发现回退")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.save_baseline}")
+    
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
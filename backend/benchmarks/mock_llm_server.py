@@ -0,0 +1,166 @@
+"""
+本地模拟的 OpenAI 兼容 chat/completions 服务
+用于在不调用付费 API 的情况下压测 LLM 调用链路
+
+    python -m benchmarks.mock_llm_server --port 9100 --delay 0.2
+    python -m benchmarks.mock_llm_server --error-rate 0.3 --garbage-rate 0.05   # 注入故障
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any
+
+
+def make_completion(model: str, content: str) -> Dict[str, Any]:
+    """构造 OpenAI 格式的非流式响应"""
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+def make_chunk(model: str, delta: str) -> Dict[str, Any]:
+    """构造 OpenAI 格式的流式增量"""
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+    }
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """
+    处理 POST /v1/chat/completions，等待固定延迟后返回固定内容
+    
+    请求体带 "stream": true 时以 SSE 分块返回，每块间隔 chunk_delay 秒
+    
+    按服务端配置的概率注入故障：返回 error_status 错误码，或返回不合法的 JSON 响应体
+    """
+    
+    protocol_version = "HTTP/1.1"   # 支持 keep-alive
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "mock")
+        content = self.server.content or json.dumps({"tasks": []}, ensure_ascii=False)
+        
+        fault = self.server.next_fault()
+        if fault == "error":
+            time.sleep(self.server.delay)
+            self._send(self.server.error_status, b'{"error": {"message": "injected fault"}}')
+            return
+        if fault == "garbage":
+            time.sleep(self.server.delay)
+            self._send(200, b'{"choices": [{"message": ')
+            return
+        
+        if body.get("stream"):
+            self._stream(model, content)
+            return
+        
+        time.sleep(self.server.delay)
+        
+        payload = json.dumps(make_completion(model, content), ensure_ascii=False).encode()
+        self._send(200, payload)
+    
+    def _send(self, status: int, payload: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _stream(self, model: str, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        
+        size = self.server.chunk_size
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        events = [f"data: {json.dumps(make_chunk(model, p), ensure_ascii=False)}\n\n" for p in pieces]
+        events.append("data: [DONE]\n\n")
+        
+        for event in events:
+            time.sleep(self.server.chunk_delay)
+            data = event.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """每个连接一个线程的模拟服务"""
+    
+    daemon_threads = True
+    request_queue_size = 256
+    handler_class = MockLLMHandler
+    
+    def __init__(self, port: int = 0, delay: float = 0.2, content: str = "",
+                 chunk_size: int = 8, chunk_delay: float = 0.01,
+                 error_rate: float = 0.0, error_status: int = 503, garbage_rate: float = 0.0,
+                 seed: int = 0):
+        super().__init__(("127.0.0.1", port), self.handler_class)
+        self.delay = delay
+        self.content = content
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        # 故障注入，运行中可直接修改以模拟故障与恢复
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.garbage_rate = garbage_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def next_fault(self) -> str:
+        """决定本次请求注入的故障：error / garbage / 空字符串表示正常"""
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+        if roll < self.error_rate:
+            return "error"
+        if roll < self.error_rate + self.garbage_rate:
+            return "garbage"
+        return ""
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/chat/completions"
+    
+    def start(self) -> "MockLLMServer":
+        """在后台线程中启动"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--garbage-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    
+    server = MockLLMServer(args.port, args.delay, error_rate=args.error_rate,
+                           error_status=args.error_status, garbage_rate=args.garbage_rate)
+    print(f"mock LLM server: {server.url}")
+    server.serve_forever()
@@ -0,0 +1,373 @@
+"""
+录制/回放的 OpenAI 兼容 chat/completions 服务
+录制模式把请求转发给真实上游，将请求与响应（内容、用量、首 token 延迟与总耗时）追加写入 JSONL 录制文件；
+回放模式按请求摘要查找录制的响应，以可配置的延迟分布与 token 速率确定性地重放，供端到端压测使用（见 benchmarks.load_test）
+
+    python -m benchmarks.replay_llm_server record --cassette data/cassettes/qwen.jsonl --port 9200
+    python -m benchmarks.replay_llm_server replay --cassette data/cassettes/qwen.jsonl --latency lognormal:0.8,0.4 --stream-rate 40
+    LLM_API_URL=http://127.0.0.1:9200/v1/chat/completions python app.py   # 让后端调用录制/回放服务
+    
+回放时同一请求的第 n 次调用使用以 (seed, 请求摘要, n) 为种子的随机数，延迟序列与并发调度无关，多次运行可复现；
+未录制的请求默认按摘要确定性地选一条录制回放（--on-miss any），录制文件为空时返回内置的任务规划。
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+import requests
+
+from benchmarks.mock_llm_server import MockLLMHandler, MockLLMServer, make_chunk, make_completion
+
+DEFAULT_UPSTREAM = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+
+# 录制文件为空时回放的内容：一个能通过结构化解析的任务规划
+SYNTHETIC_CONTENT = json.dumps({"tasks": [
+    {"title": "阅读官方文档第一章", "description": "通读并记下三个关键概念", "estimated_time": 30, "difficulty": 2,
+     "rewards": {"INT": 3, "VIT": 0}},
+    {"title": "完成一道练习题", "description": "独立完成并对照答案", "estimated_time": 20, "difficulty": 3,
+     "rewards": {"INT": 4, "VIT": 0}},
+    {"title": "散步十五分钟", "description": "学习间隙活动身体", "estimated_time": 15, "difficulty": 1,
+     "rewards": {"INT": 0, "VIT": 2}},
+]}, ensure_ascii=False)
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """请求摘要：只取决定输出的字段，流式与非流式请求共用同一条录制"""
+    canonical = {name: body.get(name) for name in ("model", "messages", "temperature", "max_tokens")}
+    return hashlib.sha256(json.dumps(canonical, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def _token_weight(ch: str) -> float:
+    # 与 session_store.estimate_tokens 一致：中日韩字符 1 字 1 token，其余 4 字符 1 token
+    return 1.0 if "㐀" <= ch <= "鿿" or "豈" <= ch <= "﫿" else 0.25
+
+
+def split_tokens(text: str, chunk_tokens: float) -> List[Tuple[str, float]]:
+    """按估算的 token 数切分文本，返回 [(片段, 片段 token 数)]"""
+    pieces, start, weight = [], 0, 0.0
+    for i, ch in enumerate(text):
+        weight += _token_weight(ch)
+        if weight >= chunk_tokens:
+            pieces.append((text[start:i + 1], weight))
+            start, weight = i + 1, 0.0
+    if start < len(text):
+        pieces.append((text[start:], weight))
+    return pieces
+
+
+class LatencyModel:
+    """
+    首 token 延迟的分布
+    
+        fixed:0.3             固定 0.3 秒
+        uniform:0.2,0.8       均匀分布
+        lognormal:0.5,0.4     对数正态分布，中位数 0.5 秒、sigma 0.4（长尾，接近真实 LLM 服务）
+        recorded[:1.5]        录制时的实测值（可乘以倍数）
+    """
+    
+    ARITY = {"fixed": (1,), "uniform": (2,), "lognormal": (2,), "recorded": (0, 1)}
+    
+    def __init__(self, spec: str = "fixed:0.2"):
+        kind, _, args = spec.partition(":")
+        try:
+            self.args = [float(a) for a in args.split(",") if a.strip()]
+        except ValueError:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        if kind not in self.ARITY or len(self.args) not in self.ARITY[kind]:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        self.kind = kind
+        self.spec = spec
+    
+    def sample(self, rng: random.Random, recorded: Optional[float]) -> float:
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return rng.uniform(self.args[0], self.args[1])
+        if self.kind == "lognormal":
+            return self.args[0] * math.exp(rng.gauss(0.0, self.args[1]))
+        return (recorded or 0.0) * (self.args[0] if self.args else 1.0)
+
+
+class Cassette:
+    """录制文件：每行一条交互，同一请求可录制多次，回放时轮流使用"""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, List[Dict[str, Any]]] = {}
+        self.keys: List[str] = []   # 按录制先后排列，保证回放时的选择可复现
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+    
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+    
+    def _add(self, entry: Dict[str, Any]):
+        entries = self.entries.get(entry["key"])
+        if entries is None:
+            entries = self.entries[entry["key"]] = []
+            self.keys.append(entry["key"])
+        entries.append(entry)
+    
+    def append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._add(entry)
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+
+class ReplayLLMHandler(MockLLMHandler):
+    """处理 POST /v1/chat/completions：录制模式转发并记录，回放模式按录制内容应答"""
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) or b"{}"
+        body = json.loads(raw)
+        if self.server.mode == "record":
+            self._record(raw, body)
+        else:
+            self._replay(body)
+    
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+    
+    def _replay(self, body: Dict[str, Any]):
+        server = self.server
+        key = request_key(body)
+        entry, rng = server.lookup(key)
+        if entry is None:
+            message = json.dumps({"error": {"message": f"no recording for request {key[:12]}"}})
+            self._send(404, message.encode())
+            return
+        
+        model = body.get("model", "mock")
+        first_token = server.latency.sample(rng, entry.get("first_token") or entry.get("latency"))
+        fault = server.next_fault()
+        if fault or entry.get("status", 200) != 200:
+            time.sleep(first_token)
+            if fault == "error":
+                self._send(server.error_status, b'{"error": {"message": "injected fault"}}')
+            elif fault == "garbage":
+                self._send(200, b'{"choices": [{"message": ')
+            else:
+                self._send(entry["status"], (entry.get("error") or "").encode())
+            return
+        
+        content = entry.get("content") or ""
+        pieces = split_tokens(content, server.chunk_tokens)
+        decode = server.decode_time(entry, sum(tokens for _, tokens in pieces))
+        if body.get("stream"):
+            self._stream_pieces(model, pieces, first_token, decode)
+            return
+        
+        time.sleep(first_token + decode)
+        completion = make_completion(model, content)
+        completion["usage"] = entry.get("usage") or server.estimate_usage(body, pieces)
+        self._send(200, json.dumps(completion, ensure_ascii=False).encode())
+    
+    def _stream_pieces(self, model: str, pieces: List[Tuple[str, float]], first_token: float, decode: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        
+        # 按绝对时刻发送各片段，sleep 的误差不会逐块累积
+        total = sum(tokens for _, tokens in pieces) or 1.0
+        start = time.perf_counter() + first_token
+        sent = 0.0
+        for piece, tokens in pieces:
+            delay = start + decode * sent / total - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sent += tokens
+            self._write_chunk(f"data: {json.dumps(make_chunk(model, piece), ensure_ascii=False)}\n\n".encode())
+        delay = start + decode - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+    
+    def _record(self, raw: bytes, body: Dict[str, Any]):
+        server = self.server
+        stream = bool(body.get("stream"))
+        headers = {"Content-Type": "application/json",
+                   "Authorization": self.headers.get("Authorization") or f"Bearer {server.api_key}"}
+        start = time.perf_counter()
+        try:
+            upstream = requests.post(server.upstream, data=raw, headers=headers, stream=stream,
+                                     timeout=server.upstream_timeout)
+        except requests.RequestException as e:
+            self._send(502, json.dumps({"error": {"message": f"upstream unreachable: {e}"}}).encode())
+            return
+        
+        entry = {"key": request_key(body), "model": body.get("model"), "messages": body.get("messages"),
+                 "temperature": body.get("temperature"), "max_tokens": body.get("max_tokens"), "stream": stream,
+                 "status": upstream.status_code, "content": None, "error": None, "usage": None,
+                 "first_token": None, "latency": None, "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        
+        if stream and upstream.status_code == 200:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            parts = []
+            for line in upstream.iter_lines():
+                if not line:
+                    continue
+                self._write_chunk(line + b"\n\n")
+                data = line[5:].strip() if line.startswith(b"data:") else b""
+                if not data or data == b"[DONE]":
+                    continue
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                if chunk.get("usage"):
+                    entry["usage"] = chunk["usage"]
+                delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                if delta:
+                    if entry["first_token"] is None:
+                        entry["first_token"] = time.perf_counter() - start
+                    parts.append(delta)
+            self.wfile.write(b"0\r\n\r\n")
+            entry["content"] = "".join(parts)
+        else:
+            payload = upstream.content
+            self._send(upstream.status_code, payload)
+            try:
+                data = json.loads(payload)
+                entry["content"] = data["choices"][0]["message"]["content"]
+                entry["usage"] = data.get("usage")
+            except (ValueError, KeyError, IndexError, TypeError):
+                entry["error"] = payload.decode("utf-8", "replace")
+            if entry["content"] is None and entry["status"] == 200:
+                # 200 但响应体无法解析，按原样回放
+                entry["status"] = 502
+        
+        entry["latency"] = time.perf_counter() - start
+        server.cassette.append(entry)
+        with server._lock:
+            server.recorded += 1
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayLLMServer(MockLLMServer):
+    """
+    录制/回放服务
+    
+    Args:
+        cassette: 录制文件路径；为 None 时只在内存中保存
+        mode: record（转发给 upstream 并录制）/ replay
+        latency: 首 token 延迟分布，见 LatencyModel
+        stream_rate: 每秒生成的 token 数，用于流式分块的间隔与非流式的总耗时；
+                     0 表示不计生成时间，None 表示使用录制时的实测生成时间
+        chunk_tokens: 流式响应每块的 token 数
+        on_miss: 请求未录制时的处理，any（按摘要确定性地选一条录制）/ error（返回 404）
+        seed: 延迟采样的随机种子
+        其余参数（error_rate 等故障注入）同 MockLLMServer
+    """
+    
+    handler_class = ReplayLLMHandler
+    
+    def __init__(self, port: int = 0, cassette: Optional[str] = None, mode: str = "replay",
+                 upstream: str = DEFAULT_UPSTREAM, api_key: Optional[str] = None, upstream_timeout: float = 120.0,
+                 latency: str = "fixed:0.2", stream_rate: Optional[float] = 50.0, chunk_tokens: float = 4,
+                 on_miss: str = "any", seed: int = 0, content: str = SYNTHETIC_CONTENT, **faults):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知模式: {mode}")
+        if on_miss not in ("any", "error"):
+            raise ValueError(f"未知的未命中处理: {on_miss}")
+        super().__init__(port, content=content, seed=seed, **faults)
+        self.cassette = Cassette(cassette)
+        self.mode = mode
+        self.upstream = upstream
+        self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
+        self.upstream_timeout = upstream_timeout
+        self.latency = LatencyModel(latency)
+        self.stream_rate = stream_rate
+        self.chunk_tokens = chunk_tokens
+        self.on_miss = on_miss
+        self.seed = seed
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._calls: Dict[str, int] = {}
+    
+    def lookup(self, key: str) -> Tuple[Optional[Dict[str, Any]], random.Random]:
+        """查找回放的录制，并返回本次调用的随机数生成器"""
+        with self._lock:
+            n = self._calls.get(key, 0)
+            self._calls[key] = n + 1
+            entries = self.cassette.entries.get(key)
+            if entries:
+                self.hits += 1
+            else:
+                self.misses += 1
+        rng = random.Random(f"{self.seed}:{key}:{n}")
+        if entries:
+            return entries[n % len(entries)], rng
+        if self.on_miss == "error":
+            return None, rng
+        if not self.cassette.keys:
+            return {"status": 200, "content": self.content}, rng
+        entries = self.cassette.entries[self.cassette.keys[int(key[:12], 16) % len(self.cassette.keys)]]
+        return entries[n % len(entries)], rng
+    
+    def decode_time(self, entry: Dict[str, Any], tokens: float) -> float:
+        """生成 tokens 个 token 的耗时"""
+        if self.stream_rate is None:
+            if entry.get("first_token") is None or entry.get("latency") is None:
+                return 0.0
+            return max(0.0, entry["latency"] - entry["first_token"])
+        return tokens / self.stream_rate if self.stream_rate > 0 else 0.0
+    
+    @staticmethod
+    def estimate_usage(body: Dict[str, Any], pieces: List[Tuple[str, float]]) -> Dict[str, int]:
+        messages = body.get("messages") or []
+        prompt_tokens = math.ceil(sum(_token_weight(ch) for m in messages for ch in str(m.get("content", ""))))
+        completion_tokens = math.ceil(sum(tokens for _, tokens in pieces))
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _stream_rate(value: str) -> Optional[float]:
+    return None if value == "recorded" else float(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", required=True, help="录制文件（JSONL）")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM, help="录制模式转发的上游地址")
+    parser.add_argument("--latency", default="fixed:0.2", help="首 token 延迟分布，如 lognormal:0.8,0.4 或 recorded")
+    parser.add_argument("--stream-rate", type=_stream_rate, default=50.0, help="每秒 token 数；recorded 使用实测生成时间")
+    parser.add_argument("--chunk-tokens", type=float, default=4)
+    parser.add_argument("--on-miss", choices=["any", "error"], default="any")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    
+    server = ReplayLLMServer(args.port, args.cassette, args.mode, upstream=args.upstream, latency=args.latency,
+                             stream_rate=args.stream_rate, chunk_tokens=args.chunk_tokens, on_miss=args.on_miss,
+                             seed=args.seed, error_rate=args.error_rate)
+    print(f"{args.mode} LLM server: {server.url}（已录制 {len(server.cassette)} 条）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,90 @@
+"""
+重试与熔断基准：在注入故障的模拟上游上对比不同策略的成功率与上游放大倍数
+
+    python -m benchmarks.resilience --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, Any
+
+from benchmarks.mock_llm_server import MockLLMServer
+from core.llm_client import LLMClient
+from resilience import Resilience
+
+
+async def run(server: MockLLMServer, resilience: Resilience, total: int, concurrency: int) -> Dict[str, Any]:
+    client = LLMClient("mock", server.url, resilience=resilience)
+    gate = asyncio.Semaphore(concurrency)
+    ok = 0
+    
+    async def one(i: int):
+        nonlocal ok
+        async with gate:
+            # 每个请求内容不同，避免被 single-flight 合并
+            result = await client.achat([{"role": "user", "content": f"请求 {i}"}])
+            ok += "error" not in result
+    
+    server.requests = 0
+    before = dict(resilience.counters)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    counters = {name: value - before[name] for name, value in resilience.counters.items()}
+    return {"ok": ok, "upstream": server.requests, "elapsed": elapsed, **counters}
+
+
+def report(name: str, total: int, stats: Dict[str, Any]):
+    print(f"{name:<22} 成功率 {stats['ok'] / total:6.1%}  上游请求/调用 {stats['upstream'] / total:5.2f}  "
+          f"重试 {stats['retries']:4d}  熔断拒绝 {stats['short_circuited']:4d}  耗时 {stats['elapsed']:6.2f} s")
+
+
+def policy(**overrides) -> Resilience:
+    # 缩短退避与熔断恢复时间，让基准在几秒内跑完
+    options = dict(base_delay=0.02, max_delay=0.2, reset_timeout=0.5, budget_min_per_sec=50.0)
+    options.update(overrides)
+    return Resilience(**options)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.01, help="模拟上游的生成耗时（秒）")
+    args = parser.parse_args()
+    total = args.requests
+    
+    server = MockLLMServer(delay=args.delay).start()
+    
+    print("== 30% 请求返回 503 ==")
+    server.error_rate = 0.3
+    report("不重试", total, asyncio.run(run(server, policy(max_attempts=1, failure_threshold=1.1), total, args.concurrency)))
+    report("退避重试", total, asyncio.run(run(server, policy(failure_threshold=1.1), total, args.concurrency)))
+    report("退避重试 + 重试预算", total, asyncio.run(run(server, policy(failure_threshold=1.1, budget_min_per_sec=1.0),
+                                                    total, args.concurrency)))
+    
+    print("== 上游完全不可用 ==")
+    server.error_rate = 1.0
+    report("退避重试(无熔断)", total, asyncio.run(run(server, policy(failure_threshold=1.1), total, args.concurrency)))
+    breaker = policy()
+    report("退避重试 + 熔断", total, asyncio.run(run(server, breaker, total, args.concurrency)))
+    
+    print("== 上游恢复 ==")
+    server.error_rate = 0.0
+    time.sleep(0.5)
+    # 半开状态只放行一个探测请求，探测成功前其余请求仍被快速拒绝
+    report("半开探测", total, asyncio.run(run(server, breaker, total, args.concurrency)))
+    report("探测成功后", total, asyncio.run(run(server, breaker, total, args.concurrency)))
+    
+    print("== 400 与不合法 JSON ==")
+    server.error_rate, server.error_status = 1.0, 400
+    report("400 不重试", total, asyncio.run(run(server, policy(), total, args.concurrency)))
+    server.error_rate, server.garbage_rate = 0.0, 0.2
+    report("20% 不合法 JSON", total, asyncio.run(run(server, policy(), total, args.concurrency)))
+    
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
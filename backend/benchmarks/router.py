@@ -0,0 +1,90 @@
+"""
+模型路由基准：在模拟的上游上对比固定模型、按 SLO 路由、路由 + 对冲三种策略的尾延迟与成本
+
+    python -m benchmarks.router --requests 2000 --concurrency 50
+    
+便宜模型的延迟为对数正态分布（长尾），运行到一半时变慢 --degrade 倍，模拟上游拥塞；
+贵模型稳定但单价高。对冲请求的成本同样计入（被取消的请求也按一次调用计费）。
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from typing import Dict, List, Any
+
+import core.llm_client  # noqa: F401  将 model 目录加入 sys.path
+from resilience import Resilience
+from router import ModelRouter
+
+MODELS = {"cheap": {"cost": 1.0}, "premium": {"cost": 4.0}}
+
+
+class SimulatedUpstream:
+    """按模型给出对数正态延迟的模拟上游"""
+    
+    def __init__(self, median: Dict[str, float], sigma: Dict[str, float], seed: int = 0):
+        self.median = median
+        self.sigma = sigma
+        self.slowdown = {model: 1.0 for model in median}
+        self.calls = {model: 0 for model in median}
+        self._random = random.Random(seed)
+    
+    async def __call__(self, model: str) -> str:
+        self.calls[model] += 1
+        latency = self.median[model] * math.exp(self._random.gauss(0, self.sigma[model])) * self.slowdown[model]
+        await asyncio.sleep(latency)
+        return model
+
+
+async def run(router: ModelRouter, upstream: SimulatedUpstream, total: int, concurrency: int,
+              degrade: float) -> Dict[str, Any]:
+    gate = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    
+    async def one(i: int):
+        async with gate:
+            if i == total // 2:
+                upstream.slowdown["cheap"] = degrade
+            start = time.perf_counter()
+            await router.acall(router.route("chat"), upstream)
+            latencies.append(time.perf_counter() - start)
+    
+    await asyncio.gather(*(one(i) for i in range(total)))
+    latencies.sort()
+    cost = sum(MODELS[model]["cost"] * n for model, n in upstream.calls.items())
+    return {"p50": latencies[len(latencies) // 2], "p95": latencies[int(len(latencies) * 0.95)],
+            "p99": latencies[int(len(latencies) * 0.99)], "cost": cost / total, "calls": dict(upstream.calls),
+            "hedged": router.counters["hedged"], "hedge_won": router.counters["hedge_won"]}
+
+
+def make_router(slo: float, models: List[str], hedge: bool) -> ModelRouter:
+    return ModelRouter(MODELS, {"chat": {"slo": slo, "models": models}}, hedge=hedge, hedge_min_delay=0.01,
+                       resilience=Resilience())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--slo", type=float, default=0.2, help="p95 延迟目标（秒）")
+    parser.add_argument("--degrade", type=float, default=3.0, help="便宜模型在后半程变慢的倍数")
+    args = parser.parse_args()
+    
+    cases = [
+        ("固定便宜模型", lambda: make_router(args.slo, ["cheap"], hedge=False)),
+        ("按 SLO 路由", lambda: make_router(args.slo, ["cheap", "premium"], hedge=False)),
+        ("路由 + 对冲", lambda: make_router(args.slo, ["cheap", "premium"], hedge=True)),
+    ]
+    print(f"{args.requests} 个请求，并发 {args.concurrency}，SLO p95 {args.slo * 1000:.0f} ms，"
+          f"便宜模型后半程变慢 {args.degrade} 倍")
+    for name, factory in cases:
+        upstream = SimulatedUpstream({"cheap": 0.05, "premium": 0.06}, {"cheap": 0.6, "premium": 0.2})
+        result = asyncio.run(run(factory(), upstream, args.requests, args.concurrency, args.degrade))
+        print(f"{name:<12} p50 {result['p50'] * 1000:6.1f} ms  p95 {result['p95'] * 1000:6.1f} ms  "
+              f"p99 {result['p99'] * 1000:6.1f} ms  单次成本 {result['cost']:5.2f}  调用 {result['calls']}  "
+              f"对冲 {result['hedged']}（胜出 {result['hedge_won']}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,66 @@
 游戏核心引擎
 负责经验值、等级、成就等游戏化逻辑
 """
-from typing import Dict, Any
+from bisect import bisect_right
+from typing import Dict, Any, List, Tuple
+
+from core.level_curve import LevelCurve
+
+
+# 成就规则表：指标首次达到阈值时解锁
+# 指标需单调不减（连续天数使用历史最佳 best_streak），因此每个成就只会触发一次
+ACHIEVEMENT_RULES = [
+    {"id": "first_task", "name": "初出茅庐", "desc": "完成第一个任务", "metric": "tasks_completed", "threshold": 1},
+    {"id": "task_master", "name": "任务大师", "desc": "完成10个任务", "metric": "tasks_completed", "threshold": 10},
+    {"id": "task_legend", "name": "传奇执行者", "desc": "完成50个任务", "metric": "tasks_completed", "threshold": 50},
+    {"id": "week_warrior", "name": "一周勇士", "desc": "连续签到7天", "metric": "best_streak", "threshold": 7},
+    {"id": "month_hero", "name": "月度英雄", "desc": "连续签到30天", "metric": "best_streak", "threshold": 30},
+    {"id": "scholar", "name": "求知者", "desc": "智力累计达到50", "metric": "int_total", "threshold": 50},
+    {"id": "athlete", "name": "健将", "desc": "体力累计达到50", "metric": "vit_total", "threshold": 50},
+    {"id": "veteran", "name": "身经百战", "desc": "累计获得1000经验", "metric": "total_exp", "threshold": 1000},
+]
+
+
+class AchievementIndex:
+    """
+    成就规则的阈值索引
+    
+    按指标分组并按阈值排序，一个指标从 old 变为 new 时，
+    用二分查找取出 old < 阈值 <= new 的规则，只检查发生变化的指标
+    """
+    
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self._thresholds: Dict[str, List[int]] = {}
+        self._rules: Dict[str, List[Dict[str, Any]]] = {}
+        for rule in sorted(rules, key=lambda r: r["threshold"]):
+            self._thresholds.setdefault(rule["metric"], []).append(rule["threshold"])
+            self._rules.setdefault(rule["metric"], []).append(rule)
+    
+    def crossed(self, changed: Dict[str, Tuple[Any, Any]]) -> List[Dict[str, Any]]:
+        """
+        找出本次变化跨过阈值的成就
+        
+        Args:
+            changed: {指标: (旧值, 新值)}
+            
+        Returns:
+            解锁的成就列表
+        """
+        unlocked = []
+        for metric, (old, new) in changed.items():
+            thresholds = self._thresholds.get(metric)
+            if not thresholds or new <= old:
+                continue
+            lo = bisect_right(thresholds, old)
+            hi = bisect_right(thresholds, new)
+            unlocked.extend(self._rules[metric][lo:hi])
+        return [{"id": r["id"], "name": r["name"], "desc": r["desc"]} for r in unlocked]
 
 
 class GameEngine:
     """游戏引擎"""
     
-    # 等级经验值配置
+    # 等级经验值配置（前 10 级）
     LEVEL_EXP_TABLE = {
         1: 0,
         2: 100,
@@ -22,6 +75,15 @@ class GameEngine:
         10: 11000,
     }
     
+    # 10 级之后沿用表格的增长规律：升到 L 级需要 500 * (L - 4) 经验，
+    # 累加得达到 L 级的累计经验为 500 + 250 * (L - 4) * (L - 3)；上限 10000 级（约 2.5e10 经验）
+    MAX_LEVEL = 10000
+    LEVEL_CURVE = LevelCurve.from_table(LEVEL_EXP_TABLE, increment=lambda level: 500 * (level - 4),
+                                        max_level=MAX_LEVEL,
+                                        cumulative=lambda level: 500 + 250 * (level - 4) * (level - 3))
+    
+    ACHIEVEMENTS = AchievementIndex(ACHIEVEMENT_RULES)
+    
     @staticmethod
     def calculate_exp_reward(difficulty: int, time_spent: int) -> int:
         """
@@ -49,10 +111,30 @@ class GameEngine:
         Returns:
             当前等级
         """
-        for level in range(10, 0, -1):
-            if total_exp >= GameEngine.LEVEL_EXP_TABLE[level]:
-                return level
-        return 1
+        return GameEngine.LEVEL_CURVE.level(total_exp)
+    
+    @staticmethod
+    def get_level_progress(total_exp: int) -> Dict[str, Any]:
+        """
+        当前等级与升级进度
+        
+        Returns:
+            {"level", "current_exp", "next_exp", "progress"}
+        """
+        return GameEngine.LEVEL_CURVE.progress(total_exp)
+    
+    @staticmethod
+    def get_levels_bulk(total_exp) -> Tuple[Any, Any]:
+        """
+        批量计算等级与升级进度
+        
+        Args:
+            total_exp: 多个用户的总经验（序列或 numpy 数组）
+            
+        Returns:
+            (等级数组, 进度数组)
+        """
+        return GameEngine.LEVEL_CURVE.bulk(total_exp)
     
     @staticmethod
     def check_level_up(old_exp: int, new_exp: int) -> Dict[str, Any]:
@@ -76,32 +158,49 @@ class GameEngine:
         }
     
     @staticmethod
-    def check_achievement(user_stats: Dict[str, Any]) -> list:
+    def check_achievement(changed: Dict[str, Tuple[Any, Any]]) -> list:
         """
         检查成就触发
         
         Args:
-            user_stats: 用户统计数据
+            changed: 本次完成事件中变化的统计指标 {指标: (旧值, 新值)}
             
         Returns:
             解锁的成就列表
         """
-        achievements = []
-        
-        # 任务完成数成就
-        tasks_completed = user_stats.get("tasks_completed", 0)
-        if tasks_completed == 1:
-            achievements.append({"id": "first_task", "name": "初出茅庐", "desc": "完成第一个任务"})
-        elif tasks_completed == 10:
-            achievements.append({"id": "task_master", "name": "任务大师", "desc": "完成10个任务"})
-        elif tasks_completed == 50:
-            achievements.append({"id": "task_legend", "name": "传奇执行者", "desc": "完成50个任务"})
-        
-        # 连续签到成就
-        streak_days = user_stats.get("streak_days", 0)
-        if streak_days == 7:
-            achievements.append({"id": "week_warrior", "name": "一周勇士", "desc": "连续签到7天"})
-        elif streak_days == 30:
-            achievements.append({"id": "month_hero", "name": "月度英雄", "desc": "连续签到30天"})
-        
-        return achievements
+        return GameEngine.ACHIEVEMENTS.crossed(changed)
+
+
+if __name__ == "__main__":
+    # 等级计算基准：python -m core.game_engine
+    # 对比旧的 10 级线性扫描、逐个二分查找与向量化批量计算在 1M 用户上的耗时
+    import time
+    import numpy as np
+    
+    n = 1_000_000
+    exps = np.random.default_rng(0).integers(0, 200_000, n)
+    exp_list = exps.tolist()
+    
+    def linear_scan(total_exp: int) -> int:
+        for level in range(10, 0, -1):
+            if total_exp >= GameEngine.LEVEL_EXP_TABLE[level]:
+                return level
+        return 1
+    
+    GameEngine.get_levels_bulk(exps)    # 预先延伸阈值表
+    
+    start = time.perf_counter()
+    [linear_scan(e) for e in exp_list]
+    print(f"线性扫描(仅10级) : {time.perf_counter() - start:6.3f} s")
+    
+    start = time.perf_counter()
+    [GameEngine.get_level_from_exp(e) for e in exp_list]
+    print(f"逐个二分查找     : {time.perf_counter() - start:6.3f} s")
+    
+    start = time.perf_counter()
+    [GameEngine.get_level_progress(e) for e in exp_list]
+    print(f"逐个等级+进度    : {time.perf_counter() - start:6.3f} s")
+    
+    start = time.perf_counter()
+    levels, progress = GameEngine.get_levels_bulk(exps)
+    print(f"向量化等级+进度  : {time.perf_counter() - start:6.3f} s  (最高 {levels.max()} 级)")
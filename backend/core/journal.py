@@ -0,0 +1,342 @@
+"""
+追加写日志存储
+在内存存储之上，把每次写操作追加到长度前缀的二进制日志中，定期写紧凑快照；
+启动时通过内存映射加载最新快照，只重放其后的日志尾部
+"""
+import gc
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Any, Iterator, Tuple
+
+from core.stats_engine import empty_stats
+from core.storage import MemoryTaskStore, TaskIndex
+
+# 帧：<负载长度 u32><负载 crc32 u32><负载>，负载为 UTF-8 JSON 数组
+_HEADER = struct.Struct("<II")
+
+
+class JournalCorrupted(ValueError):
+    """日志或快照在中间位置损坏（末尾写了一半的记录会被自动截掉，不算损坏）"""
+    
+    def __init__(self, path: str, offset: int):
+        super().__init__(f"日志损坏: {path} @ {offset}")
+
+
+def _frame(record: Any) -> bytes:
+    data = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode()
+    return _HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def _read_frames(buf, batch: int = 4096) -> Iterator[Tuple[int, Any]]:
+    """
+    依次解码 buf（bytes 或 mmap）中的帧，产出 (帧结束位置, 记录)；遇到不完整或校验失败的帧即停止
+    
+    每 batch 帧拼成一个 JSON 数组一次解码，比逐帧 json.loads 快一倍以上
+    """
+    offset, size = 0, len(buf)
+    chunk, ends = [], []
+    while offset + _HEADER.size <= size:
+        length, crc = _HEADER.unpack_from(buf, offset)
+        end = offset + _HEADER.size + length
+        if end > size:
+            break
+        data = buf[offset + _HEADER.size:end]
+        if zlib.crc32(data) != crc:
+            break
+        chunk.append(data)
+        ends.append(end)
+        offset = end
+        if len(chunk) == batch:
+            yield from zip(ends, json.loads(b"[" + b",".join(chunk) + b"]"))
+            chunk, ends = [], []
+    if chunk:
+        yield from zip(ends, json.loads(b"[" + b",".join(chunk) + b"]"))
+
+
+class JournalTaskStore(MemoryTaskStore):
+    """
+    日志持久化的内存存储
+    
+    - 写：写操作在用户的分段锁内修改内存并把记录编码进缓冲区，后台线程每 fsync_interval 秒
+      把缓冲区写入当前日志段并 fsync 一次（批量 fsync）；fsync_interval=0 时每次写操作同步落盘
+    - 记录：每条记录带该用户写操作后的版本号；完成类记录带统计的增量（只含变化的字段），重放时不重新计算
+    - 压缩：当前快照之后的日志超过 compact_bytes 时，后台切换到新日志段并写快照，然后删除旧日志段，
+      日志大小与启动时需要重放的记录数都有上界
+    - 快照不停写：逐个用户在其分段锁内序列化，快照中某用户的状态可能已包含新日志段开头的部分记录，
+      重放时跳过版本号不大于当前版本的记录，因此重放是幂等的
+      
+    目录结构：journal-{n}.log 为第 n 个日志段，snapshot-{n}.snap 表示重放第 n 段及之后的日志即可恢复
+    """
+    
+    def __init__(self, path: str, fsync_interval: float = 0.01, compact_bytes: int = 64 * 1024 * 1024,
+                 stripes: int = 64):
+        """
+        Args:
+            path: 日志目录
+            fsync_interval: 批量 fsync 的间隔（秒），即进程崩溃时最多丢失的写入窗口；0 表示每次写操作都 fsync
+            compact_bytes: 快照之后的日志达到该大小时触发压缩
+            stripes: 分段锁数量，见 MemoryTaskStore
+        """
+        super().__init__(stripes)
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.counters = {"records": 0, "fsyncs": 0, "compactions": 0}
+        self.recovery: Dict[str, Any] = {}
+        
+        os.makedirs(path, exist_ok=True)
+        self._buf: List[bytes] = []
+        self._buf_lock = threading.Lock()
+        self._io_lock = threading.Lock()        # 保护当前日志段文件（写入、fsync、切换）
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        self._journal_bytes = 0                 # 最新快照之后的日志大小
+        
+        self._segment = self._recover()
+        self._file = open(self._segment_path(self._segment), "ab")
+        
+        self._closed = threading.Event()
+        self._flusher = None
+        if fsync_interval > 0:
+            self._flusher = threading.Thread(target=self._run_flusher, name="journal-flusher", daemon=True)
+            self._flusher.start()
+    
+    def _segment_path(self, n: int) -> str:
+        return os.path.join(self.path, f"journal-{n:08d}.log")
+    
+    def _snapshot_path(self, n: int) -> str:
+        return os.path.join(self.path, f"snapshot-{n:08d}.snap")
+    
+    def _files(self, prefix: str, suffix: str) -> List[Tuple[int, str]]:
+        """目录中按序号排序的日志段或快照：[(n, 路径)]"""
+        found = []
+        for name in os.listdir(self.path):
+            if name.startswith(prefix) and name.endswith(suffix):
+                number = name[len(prefix):-len(suffix)]
+                if number.isdigit():
+                    found.append((int(number), os.path.join(self.path, name)))
+        return sorted(found)
+    
+    # ---- 写入 ----
+    
+    def _record(self, user_id: str, event: str, *payload: Any):
+        if event in ("complete", "occurrence"):
+            # 最后一个参数是 {指标: (旧值, 新值)}，只记录新值
+            payload = (*payload[:-1], {field: new for field, (_, new) in payload[-1].items()})
+        frame = _frame([event, user_id, self.versions[user_id], *payload])
+        with self._buf_lock:
+            self._buf.append(frame)
+            self.counters["records"] += 1
+        if self._flusher is None:
+            self.flush()
+    
+    def flush(self):
+        """把缓冲的记录写入当前日志段并 fsync"""
+        with self._io_lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        with self._buf_lock:
+            buf, self._buf = self._buf, []
+        if not buf:
+            return
+        data = b"".join(buf)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._journal_bytes += len(data)
+        self.counters["fsyncs"] += 1
+    
+    def _run_flusher(self):
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+            if self._journal_bytes >= self.compact_bytes and (self._compactor is None or not self._compactor.is_alive()):
+                self._compactor = threading.Thread(target=self.compact, name="journal-compactor", daemon=True)
+                self._compactor.start()
+    
+    # ---- 快照与压缩 ----
+    
+    def compact(self):
+        """切换到新日志段并写快照，完成后删除快照之前的日志段与旧快照"""
+        with self._compact_lock:
+            with self._io_lock:
+                self._flush_locked()
+                self._file.close()
+                self._segment += 1
+                self._file = open(self._segment_path(self._segment), "ab")
+                self._journal_bytes = 0
+                segment = self._segment
+            
+            target = self._snapshot_path(segment)
+            with open(target + ".tmp", "wb") as f:
+                f.write(_frame(["snapshot", segment]))
+                for user_id in list(self.versions):
+                    with self._lock(user_id):
+                        frame = _frame(self._dump_user(user_id))
+                    f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(target + ".tmp", target)
+            self._fsync_dir()
+            
+            for n, path in self._files("journal-", ".log") + self._files("snapshot-", ".snap"):
+                if n < segment:
+                    os.remove(path)
+            self.counters["compactions"] += 1
+    
+    def _dump_user(self, user_id: str) -> list:
+        index = self.tasks.get(user_id)
+        return [
+            user_id,
+            self.versions.get(user_id, 0),
+            index.seq if index is not None else 0,
+            list(index) if index is not None else [],
+            self.user_stats.get(user_id),
+            list(self.templates.get(user_id, {}).values()),
+            [[template_id, day, task_id] for (template_id, day), task_id in self.occurrences.get(user_id, {}).items()],
+        ]
+    
+    def _load_user(self, record: list):
+        user_id, version, seq, tasks, stats, templates, occurrences = record
+        index = TaskIndex()
+        for task in tasks:
+            index.add(task)
+        index.seq = seq
+        self.tasks[user_id] = index
+        self.versions[user_id] = version
+        if stats is not None:
+            self.user_stats[user_id] = stats
+        if templates:
+            self.templates[user_id] = {template["id"]: template for template in templates}
+        if occurrences:
+            self.occurrences[user_id] = {(template_id, day): task_id for template_id, day, task_id in occurrences}
+    
+    def _fsync_dir(self):
+        # Windows 上无法以只读方式打开目录，rename 本身已足够
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    
+    # ---- 恢复 ----
+    
+    def _recover(self) -> int:
+        """加载最新快照并重放其后的日志，返回新日志段的序号"""
+        # 恢复期间只新建对象、不产生循环引用，暂停分代 GC 避免它在对象数增长时反复全量扫描
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._load()
+        finally:
+            if enabled:
+                gc.enable()
+    
+    def _load(self) -> int:
+        start = time.perf_counter()
+        for name in os.listdir(self.path):
+            if name.endswith(".snap.tmp"):
+                # 上次压缩中途退出留下的半个快照
+                os.remove(os.path.join(self.path, name))
+        snapshots = self._files("snapshot-", ".snap")
+        first, users = 0, 0
+        if snapshots:
+            first, path = snapshots[-1]
+            for _, record in self._map_frames(path, truncate=False):
+                if record[0] != "snapshot":
+                    self._load_user(record)
+                    users += 1
+        
+        segments = [(n, path) for n, path in self._files("journal-", ".log") if n >= first]
+        replayed = skipped = 0
+        for i, (_, path) in enumerate(segments):
+            for _, record in self._map_frames(path, truncate=i == len(segments) - 1):
+                if self._apply(record):
+                    replayed += 1
+                else:
+                    skipped += 1
+            self._journal_bytes += os.path.getsize(path)
+        
+        self.recovery = {"snapshot_users": users, "segments": len(segments), "replayed": replayed,
+                         "skipped": skipped, "seconds": time.perf_counter() - start}
+        return max([first] + [n for n, _ in segments]) + 1
+    
+    def _map_frames(self, path: str, truncate: bool) -> Iterator[Tuple[int, Any]]:
+        """
+        通过内存映射读取文件中的帧
+        
+        truncate=True 用于最后一个日志段：末尾不完整的帧（写到一半时进程退出）被截掉；
+        其它文件在中间遇到坏帧说明已损坏，抛出 JournalCorrupted
+        """
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        valid = 0
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for valid, record in _read_frames(buf):
+                yield valid, record
+        if valid < size:
+            if not truncate:
+                raise JournalCorrupted(path, valid)
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+    
+    def _apply(self, record: list) -> bool:
+        """重放一条记录；版本号不大于当前版本（快照已包含）时跳过，返回是否应用"""
+        event, user_id, version, *payload = record
+        if version <= self.versions.get(user_id, 0):
+            return False
+        
+        if event == "create":
+            index = self._index(user_id)
+            for task in payload[0]:
+                index.add(task)
+            index.seq += len(payload[0])
+        elif event == "complete":
+            task_ids, completed_at, delta = payload
+            index = self.tasks[user_id]
+            for task_id in task_ids:
+                task = index.by_id[task_id]
+                index.set_status(task, "completed")
+                task["completed_at"] = completed_at
+            self._add_delta(user_id, delta)
+        elif event == "template":
+            self.templates.setdefault(user_id, {})[payload[0]["id"]] = payload[0]
+        elif event == "occurrence":
+            template_id, day, task, delta = payload
+            index = self._index(user_id)
+            index.add(task)
+            index.seq += 1
+            self.occurrences.setdefault(user_id, {})[(template_id, day)] = task["id"]
+            self._add_delta(user_id, delta)
+        self.versions[user_id] = version
+        return True
+    
+    def _index(self, user_id: str) -> TaskIndex:
+        # 重放是热路径，避免 setdefault 每次都构造一个新的 TaskIndex
+        index = self.tasks.get(user_id)
+        if index is None:
+            index = self.tasks[user_id] = TaskIndex()
+        return index
+    
+    def _add_delta(self, user_id: str, delta: Dict[str, Any]):
+        stats = self.user_stats.get(user_id)
+        if stats is None:
+            stats = self.user_stats[user_id] = empty_stats()
+        stats.update(delta)
+    
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._compact_lock, self._io_lock:
+            self._flush_locked()
+            self._file.close()
@@ -0,0 +1,102 @@
+"""
+用户知识库
+把用户完成的任务与笔记写入 RAG 检索器，生成任务时检索相关历史作为 Prompt 上下文
+"""
+import os
+import queue
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# 添加模型模块到路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../model'))
+from rag import Retriever, HashingEmbedder, SentenceTransformerEmbedder
+
+from core.metrics import REGISTRY, counters_sample
+
+
+def create_retriever() -> Retriever:
+    """
+    根据环境变量创建检索器
+    
+    RAG_EMBEDDER: hashing（默认，离线可用）/ bge（sentence-transformers 加载 RAG_CONFIG 中的模型）
+    RAG_PATH: 向量文件目录，默认 backend/data/rag；设为空字符串时仅保存在内存中
+    """
+    kind = os.getenv("RAG_EMBEDDER", "hashing").lower()
+    embedder = SentenceTransformerEmbedder() if kind == "bge" else HashingEmbedder()
+    
+    default_path = os.path.join(os.path.dirname(__file__), "../data/rag")
+    return Retriever(embedder, os.getenv("RAG_PATH", default_path) or None)
+
+
+class TaskIndexer:
+    """
+    在后台线程中把任务变化写入知识库，不占用任务接口的请求时间
+    
+    - 任务写入存储成功后调用 submit 即返回；向量化、写向量文件与（达到阈值时）训练 IVF 索引都在后台进行
+    - 每批取出队列中已有的全部任务，同一任务多次变化（如创建后马上完成）只索引最后一次
+    - 索引失败只计数，不影响已经成功的任务写入；知识库只是生成任务时的参考，短暂落后可以接受
+    """
+    
+    def __init__(self, retriever: Retriever):
+        self.retriever = retriever
+        self._queue: "queue.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.Queue()
+        self.counters = {"queued": 0, "indexed": 0, "skipped": 0, "errors": 0}
+        self._lock = threading.Lock()     # submit 来自线程池中的多个请求；其余计数只由后台线程修改
+        self._worker = threading.Thread(target=self._index_loop, name="rag-indexer", daemon=True)
+        self._worker.start()
+    
+    def submit(self, user_id: str, tasks: List[Dict[str, Any]]):
+        """把任务的最新状态加入索引队列"""
+        with self._lock:
+            self.counters["queued"] += len(tasks)
+        for task in tasks:
+            self._queue.put((user_id, task))
+    
+    def _index_loop(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = None in items
+            latest: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+            for item in items:
+                if item is not None:
+                    user_id, task = item
+                    latest[(user_id, task.get("id"))] = task
+            self.counters["skipped"] += sum(item is not None for item in items) - len(latest)
+            
+            for (user_id, _), task in latest.items():
+                try:
+                    self.retriever.upsert_task(user_id, task)
+                    self.counters["indexed"] += 1
+                except Exception:
+                    self.counters["errors"] += 1
+            for _ in items:
+                self._queue.task_done()
+            if stop:
+                break
+    
+    def flush(self):
+        """阻塞直到已提交的任务都处理完（测试与基准中使用）"""
+        self._queue.join()
+    
+    def close(self):
+        """处理完队列中剩余的任务后停止后台线程"""
+        if self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
+
+
+# 全局实例
+knowledge_base = create_retriever()
+task_indexer = TaskIndexer(knowledge_base)
+
+
+@REGISTRY.collector
+def _collect_indexer_counters():
+    yield counters_sample("lifeos_rag_index_events_total", "任务写入知识库的后台索引", task_indexer.counters)
@@ -0,0 +1,266 @@
+"""
+排行榜
+基于可按名次索引的跳表（order-statistic skip list），更新、查名次、按名次取区间均为 O(log n)
+"""
+import random
+import threading
+from datetime import date, timedelta
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from core.storage import TaskStore
+from core.task_manager import task_manager
+
+_MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+    
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        # width[i]：沿第 i 层指针前进一步跨过的元素个数
+        self.width: List[int] = [1] * level
+
+
+class IndexableSkipList:
+    """
+    可按名次索引的有序集合
+    
+    每层指针记录跨过的元素个数，插入、删除、查名次、按名次取元素均为期望 O(log n)
+    """
+    
+    def __init__(self):
+        self._head = _Node(None, _MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < _MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+    
+    def _path(self, key) -> Tuple[List[_Node], List[int]]:
+        """查找 key 的插入位置：每层最后一个小于 key 的节点，以及该节点的名次（从 0 起，头节点为 -1）"""
+        update = [self._head] * _MAX_LEVEL
+        ranks = [-1] * _MAX_LEVEL
+        node, rank = self._head, -1
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                rank += node.width[i]
+                node = node.next[i]
+            update[i], ranks[i] = node, rank
+        return update, ranks
+    
+    def insert(self, key):
+        update, ranks = self._path(key)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i], ranks[i] = self._head, -1
+                self._head.width[i] = self._size + 1
+            self._level = level
+        
+        node = _Node(key, level)
+        rank = ranks[0] + 1    # 新节点的名次
+        for i in range(level):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            # prev 到新节点跨过 rank - ranks[i] 个，新节点到原后继跨过剩余部分
+            node.width[i] = prev.width[i] - (rank - ranks[i]) + 1
+            prev.width[i] = rank - ranks[i]
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+    
+    def remove(self, key) -> bool:
+        update, _ = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+    
+    def rank(self, key) -> Optional[int]:
+        """key 的名次（从 0 起），不存在时返回 None"""
+        update, ranks = self._path(key)
+        node = update[0].next[0]
+        return ranks[0] + 1 if node is not None and node.key == key else None
+    
+    def _node_at(self, index: int) -> _Node:
+        node, rank = self._head, -1
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and rank + node.width[i] <= index:
+                rank += node.width[i]
+                node = node.next[i]
+        return node
+    
+    def slice(self, start: int, count: int) -> Iterator[Any]:
+        """按名次顺序取 [start, start + count) 的元素"""
+        if start >= self._size or count <= 0:
+            return
+        node = self._node_at(max(start, 0))
+        for _ in range(min(count, self._size - max(start, 0))):
+            yield node.key
+            node = node.next[0]
+
+
+class Leaderboard:
+    """
+    单个榜单：分数高者在前，同分按用户 ID 排序
+    
+    跳表中保存 (-score, user_id)，名次即为跳表中的位置
+    """
+    
+    def __init__(self):
+        self.scores: Dict[str, int] = {}
+        self._index = IndexableSkipList()
+    
+    def __len__(self) -> int:
+        return len(self._index)
+    
+    def set(self, user_id: str, score: int):
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._index.remove((-old, user_id))
+        self.scores[user_id] = score
+        self._index.insert((-score, user_id))
+    
+    def add(self, user_id: str, delta: int):
+        self.set(user_id, self.scores.get(user_id, 0) + delta)
+    
+    def rank(self, user_id: str) -> Optional[int]:
+        """名次（从 1 起），未上榜返回 None"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self._index.rank((-score, user_id)) + 1
+    
+    def page(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        return [
+            {"rank": offset + i + 1, "user_id": user_id, "score": -neg}
+            for i, (neg, user_id) in enumerate(self._index.slice(offset, limit))
+        ]
+
+
+class LeaderboardService:
+    """
+    排行榜服务
+    
+    - 总榜：total_exp / int_total / vit_total / best_streak，直接取用户统计的最新值
+    - 周期榜：daily / weekly，按完成时间累加本周期获得的经验，只保留当前与上一个周期
+    """
+    
+    TOTAL_BOARDS = ("total_exp", "int_total", "vit_total", "best_streak")
+    WINDOW_BOARDS = ("daily", "weekly")
+    BOARDS = TOTAL_BOARDS + WINDOW_BOARDS
+    
+    def __init__(self):
+        self._totals = {name: Leaderboard() for name in self.TOTAL_BOARDS}
+        self._windows: Dict[str, Dict[str, Leaderboard]] = {name: {} for name in self.WINDOW_BOARDS}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def period(board: str, day: date) -> str:
+        """日期所属的周期：daily 为日期本身，weekly 为 ISO 周（如 2026-W03）"""
+        if board == "daily":
+            return day.isoformat()
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    
+    @classmethod
+    def from_store(cls, store: TaskStore, today: Optional[date] = None) -> "LeaderboardService":
+        """启动时从存储重建：总榜取用户统计，周期榜汇总本周以来完成的任务"""
+        service = cls()
+        today = today or date.today()
+        for user_id, stats in store.iter_stats():
+            service.update_totals(user_id, stats)
+        
+        week_start = today - timedelta(days=today.weekday())
+        for user_id, completed_at, exp in store.iter_completions(week_start.isoformat()):
+            service.add_window_exp(user_id, exp, completed_at)
+        return service
+    
+    def update_totals(self, user_id: str, stats: Dict[str, Any]):
+        """用户统计变化后更新总榜"""
+        with self._lock:
+            for name, board in self._totals.items():
+                if stats.get(name):
+                    board.set(user_id, stats[name])
+    
+    def add_window_exp(self, user_id: str, exp: int, completed_at: str):
+        """把一次完成获得的经验计入所在的日榜与周榜"""
+        day = date.fromisoformat(completed_at[:10])
+        with self._lock:
+            for name, boards in self._windows.items():
+                key = self.period(name, day)
+                if key not in boards:
+                    # 只保留最近两个周期：比保留的周期都旧的完成（乱序到达）直接忽略
+                    if len(boards) >= 2 and key < min(boards):
+                        continue
+                    boards[key] = Leaderboard()
+                    for old in sorted(boards)[:-2]:
+                        del boards[old]
+                boards[key].add(user_id, exp)
+    
+    def record_completion(self, user_id: str, stats: Dict[str, Any], exp: int, completed_at: str):
+        """完成任务后调用，O(log n)"""
+        self.update_totals(user_id, stats)
+        self.add_window_exp(user_id, exp, completed_at)
+    
+    def _board(self, board: str, period: Optional[str] = None) -> Optional[Leaderboard]:
+        if board in self._totals:
+            return self._totals[board]
+        if board not in self._windows:
+            raise ValueError(f"未知的排行榜: {board}")
+        return self._windows[board].get(period or self.period(board, date.today()))
+    
+    def top(self, board: str, limit: int = 10, offset: int = 0, period: Optional[str] = None) -> Dict[str, Any]:
+        """按名次分页"""
+        with self._lock:
+            lb = self._board(board, period)
+            return {
+                "total": len(lb) if lb else 0,
+                "entries": lb.page(offset, limit) if lb else []
+            }
+    
+    def rank(self, board: str, user_id: str, period: Optional[str] = None) -> Dict[str, Any]:
+        """用户的名次与分数，未上榜时 rank 为 None"""
+        with self._lock:
+            lb = self._board(board, period)
+            return {
+                "user_id": user_id,
+                "rank": lb.rank(user_id) if lb else None,
+                "score": lb.scores.get(user_id) if lb else None,
+                "total": len(lb) if lb else 0
+            }
+    
+    def around(self, board: str, user_id: str, radius: int = 5, period: Optional[str] = None) -> Dict[str, Any]:
+        """用户前后各 radius 名"""
+        with self._lock:
+            lb = self._board(board, period)
+            rank = lb.rank(user_id) if lb else None
+            if rank is None:
+                return {"rank": None, "total": len(lb) if lb else 0, "entries": []}
+            offset = max(rank - 1 - radius, 0)
+            return {"rank": rank, "total": len(lb), "entries": lb.page(offset, rank - offset + radius)}
+
+
+# 全局实例，启动时从任务存储重建
+leaderboard = LeaderboardService.from_store(task_manager.store)
@@ -0,0 +1,169 @@
+"""
+等级曲线
+把总经验值映射为等级，支持表格与公式两种定义方式，可选等级上限
+"""
+import threading
+from bisect import bisect_right
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+
+class LevelCurve:
+    """
+    等级曲线
+    
+    thresholds[i] 为达到 i+1 级所需的累计经验（thresholds[0] 恒为 0），
+    表格之外的等级由 increment(level) 给出「从 level-1 升到 level 还需的经验」，在查询时按需向后延伸。
+    单次查询为 O(log n) 的二分查找，批量查询用 numpy.searchsorted 向量化。
+    
+    阈值表最多展开到 TABLE_LIMIT 级；给出 cumulative（累计经验的闭式）时，更高的等级对 cumulative 二分求得，
+    不再逐级展开，极大的经验值也只需 O(log 等级) 次计算。
+    """
+    
+    TABLE_LIMIT = 4096
+    
+    def __init__(self, thresholds: List[int], increment: Optional[Callable[[int], int]] = None,
+                 max_level: Optional[int] = None, cumulative: Optional[Callable[[int], int]] = None):
+        """
+        Args:
+            thresholds: 前若干级的累计经验，必须从 0 开始且严格递增
+            increment: 表格之后每一级所需的经验增量，为 None 时表格最后一级即最高级
+            max_level: 等级上限，为 None 时不设上限
+            cumulative: 达到 level 级所需的累计经验（须与表格及 increment 一致），给出时超出 TABLE_LIMIT 的等级按它计算；
+                        没有给出时阈值表一直展开到 max_level（未设上限时随经验值无限展开）
+        """
+        if not thresholds or thresholds[0] != 0:
+            raise ValueError("thresholds 必须从 0 开始")
+        if any(b <= a for a, b in zip(thresholds, thresholds[1:])):
+            raise ValueError("thresholds 必须严格递增")
+        
+        self.increment = increment
+        self.cumulative = cumulative if increment is not None else None
+        self.max_level = max_level if increment is not None else len(thresholds)
+        self._thresholds = list(thresholds[:self.max_level] if self.max_level else thresholds)
+        self._array = np.asarray(self._thresholds, dtype=np.int64)
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_table(cls, table: Dict[int, int], increment: Optional[Callable[[int], int]] = None,
+                   max_level: Optional[int] = None,
+                   cumulative: Optional[Callable[[int], int]] = None) -> "LevelCurve":
+        """由 {等级: 累计经验} 表格创建，等级需从 1 开始连续"""
+        levels = sorted(table)
+        if levels != list(range(1, len(levels) + 1)):
+            raise ValueError("等级表必须从 1 开始连续")
+        return cls([table[level] for level in levels], increment, max_level, cumulative)
+    
+    @classmethod
+    def from_formula(cls, increment: Callable[[int], int], max_level: Optional[int] = None,
+                     cumulative: Optional[Callable[[int], int]] = None) -> "LevelCurve":
+        """完全由公式定义：increment(level) 为从 level-1 升到 level 所需的经验"""
+        return cls([0], increment, max_level, cumulative)
+    
+    def _extend(self, total_exp: int):
+        """把阈值表延伸到超过 total_exp（或达到等级上限）"""
+        if self.increment is None or total_exp < self._thresholds[-1]:
+            return
+        limit = self._table_limit()
+        with self._lock:
+            thresholds = self._thresholds
+            while thresholds[-1] <= total_exp and (limit is None or len(thresholds) < limit):
+                step = int(self.increment(len(thresholds) + 1))
+                if step <= 0:
+                    raise ValueError("increment 必须为正数")
+                thresholds.append(thresholds[-1] + step)
+            if len(thresholds) != len(self._array):
+                self._array = np.asarray(thresholds, dtype=np.int64)
+    
+    def _table_limit(self) -> Optional[int]:
+        """阈值表最多展开到的等级数，None 表示不限"""
+        limits = [n for n in (self.max_level, self.TABLE_LIMIT if self.cumulative else None) if n is not None]
+        return min(limits) if limits else None
+    
+    def _beyond_table(self, total_exp: int) -> bool:
+        """该经验值是否超出了阈值表、需要按闭式计算（此前须已调用 _extend）"""
+        return (self.cumulative is not None and total_exp >= self._thresholds[-1]
+                and len(self._thresholds) == self._table_limit() and self._table_limit() != self.max_level)
+    
+    def _closed_level(self, total_exp: int) -> int:
+        """超出阈值表时：对 cumulative 倍增定界后二分，求累计经验不超过 total_exp 的最高等级"""
+        lo = len(self._thresholds)
+        hi = lo * 2
+        while (self.max_level is None or hi < self.max_level) and self.cumulative(hi) <= total_exp:
+            lo, hi = hi, hi * 2
+        if self.max_level is not None:
+            hi = min(hi, self.max_level + 1)
+        # 不变量：cumulative(lo) <= total_exp < cumulative(hi)（hi 为上限 + 1 时视为无穷大）
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.cumulative(mid) <= total_exp:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    
+    def threshold(self, level: int) -> Optional[int]:
+        """达到该等级所需的累计经验，超过等级上限时返回 None"""
+        if self.max_level is not None and level > self.max_level:
+            return None
+        if self.cumulative is not None and level > self.TABLE_LIMIT:
+            return int(self.cumulative(level))
+        while len(self._thresholds) < level:
+            self._extend(self._thresholds[-1])
+        return self._thresholds[level - 1]
+    
+    def level(self, total_exp: int) -> int:
+        """总经验对应的等级（最低 1 级）"""
+        thresholds = self._thresholds
+        if total_exp >= thresholds[-1]:
+            self._extend(total_exp)
+            if self._beyond_table(total_exp):
+                return self._closed_level(total_exp)
+        return bisect_right(thresholds, total_exp) or 1
+    
+    def progress(self, total_exp: int) -> Dict[str, Any]:
+        """
+        当前等级与升级进度
+        
+        Returns:
+            {"level", "current_exp": 本级起点, "next_exp": 下一级起点（已满级为 None）, "progress": 0~1}
+        """
+        level = self.level(total_exp)
+        current = self.threshold(level)
+        nxt = self.threshold(level + 1)
+        ratio = 1.0 if nxt is None else (total_exp - current) / (nxt - current)
+        return {"level": level, "current_exp": current, "next_exp": nxt, "progress": max(ratio, 0.0)}
+    
+    def bulk(self, total_exp) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量计算等级与升级进度（排行榜、夜间重算等场景）
+        
+        Args:
+            total_exp: 每个用户的总经验，任意可转为整数数组的序列
+            
+        Returns:
+            (levels, progress)：等级为 int64 数组，进度为 0~1 的 float64 数组；已满级的进度为 1
+        """
+        exp = np.asarray(total_exp, dtype=np.int64)
+        if exp.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        self._extend(int(exp.max()))
+        # 多取一级作为「下一级」的阈值，满级时用无穷大使进度为 1
+        self.threshold(len(self._thresholds) + 1)
+        table = self._array
+        
+        levels = np.maximum(np.searchsorted(table, exp, side="right"), 1)
+        current = table[levels - 1]
+        bounds = np.append(table, np.iinfo(np.int64).max)
+        nxt = bounds[levels]
+        capped = nxt == np.iinfo(np.int64).max
+        span = np.where(capped, 1, nxt - current)
+        progress = np.where(capped, 1.0, np.clip((exp - current) / span, 0.0, 1.0))
+        if self.cumulative is not None:
+            # 超出阈值表的少数用户逐个按闭式计算
+            for i in np.flatnonzero(exp >= table[-1]):
+                if self._beyond_table(int(exp[i])):
+                    info = self.progress(int(exp[i]))
+                    levels[i], progress[i] = info["level"], info["progress"]
+        return levels, progress
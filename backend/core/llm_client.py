@@ -2,56 +2,314 @@
 LLM 客户端封装
 负责调用大语言模型API
 """
+import asyncio
+import hashlib
+import json
 import os
 import sys
+import time
+import httpx
 import requests
-from typing import Optional, Dict, Any
+from datetime import date
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, List, Tuple
 
 # 添加模型模块到路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../model'))
-from prompts.task_generation import get_task_prompt
+from config import API_CONFIG, PROMPT_CONFIG
+from prompts.assembly import AssembledPrompt, PromptBuilder
+from prompts.task_generation import TASK_GENERATION_PROMPT, build_task_prompt
+from resilience import Resilience, ResponseParseError, UpstreamError, shared
+from router import ModelRouter, shared as shared_router
+from structured_output import parse_task_plan
+from core.metrics import REGISTRY
+from core.response_cache import ResponseCache, make_key
+from core.single_flight import SingleFlight
+
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "lifeos_llm_request_duration_seconds", "单次上游 LLM 请求耗时（不含重试退避）", ("model", "outcome")
+)
+UPSTREAM_FIRST_TOKEN = REGISTRY.histogram(
+    "lifeos_llm_stream_first_token_seconds", "流式请求收到第一个片段的耗时", ("model",)
+)
+UPSTREAM_TOKENS = REGISTRY.counter(
+    "lifeos_llm_tokens_total", "上游返回的 token 用量", ("model", "kind")
+)
+PROMPT_TOKENS = REGISTRY.counter(
+    "lifeos_prompt_tokens_total", "本地估算的任务生成 prompt token 数（kind=cacheable 为预计可命中服务端缓存的前缀）", ("kind",)
+)
+PROMPT_TRIMMED = REGISTRY.counter(
+    "lifeos_prompt_trimmed_tokens_total", "超出预算被裁剪的 prompt token 数", ("section",)
+)
 
 
 class LLMClient:
     """通义千问客户端"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, api_url: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None, resilience: Optional[Resilience] = None,
+                 router: Optional[ModelRouter] = None):
         self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
-        self.api_url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        self.model = "qwen-plus"
+        # LLM_API_URL 可指向任意 OpenAI 兼容服务，如压测用的录制/回放服务（benchmarks.replay_llm_server）
+        self.api_url = api_url or os.getenv("LLM_API_URL") or \
+            "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+        self.temperature = 0.7
+        self.max_tokens = 2000  # 任务生成的最大生成 token 数
+        
+        # 任务生成 prompt 的组装与 token 预算
+        self.prompts = PromptBuilder(min_cacheable_tokens=PROMPT_CONFIG["min_cacheable_tokens"])
+        self.prompt_budget = PROMPT_CONFIG["task_prompt_budget"]
         
-    def chat(self, messages: list, temperature: float = 0.7, max_tokens: int = 2000) -> Dict[str, Any]:
+        # 任务生成结果缓存，为 None 时不缓存
+        self.cache = cache
+        # 合并并发中的相同请求
+        self.flight = SingleFlight()
+        # 重试退避与按模型熔断，默认与进程内其它客户端共享熔断状态
+        self.resilience = resilience or shared
+        # 按请求类别（chat / planning）选择模型并对冲慢请求，默认与进程内其它客户端共享延迟统计
+        self.router = router or shared_router
+        
+        # 异步连接池与并发上限，在首次异步调用时于当前事件循环中创建
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._batch_semaphore: Optional[asyncio.Semaphore] = None
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+    
+    def _payload(self, model: str, messages: list, temperature: float, max_tokens: int) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+    
+    def _async_client(self) -> httpx.AsyncClient:
+        """获取长连接复用的异步客户端"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self._headers(),
+                timeout=httpx.Timeout(API_CONFIG["timeout"], connect=API_CONFIG["connect_timeout"]),
+                limits=httpx.Limits(
+                    max_connections=API_CONFIG["max_connections"],
+                    max_keepalive_connections=API_CONFIG["max_keepalive"]
+                )
+            )
+            self._semaphore = asyncio.Semaphore(API_CONFIG["max_concurrency"])
+            self._batch_semaphore = asyncio.Semaphore(API_CONFIG["batch_concurrency"])
+        return self._client
+    
+    async def aclose(self):
+        """关闭连接池（应用退出时调用）"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+            self._batch_semaphore = None
+    
+    def chat(self, messages: list, temperature: float = 0.7, max_tokens: int = 2000,
+             parse: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+             kind: str = "chat") -> Dict[str, Any]:
         """
         调用聊天接口
         
+        超时、连接失败、429 与 5xx 会按 API_CONFIG["retry_times"] 退避重试，其余错误直接返回。
+        
         Args:
             messages: 对话消息列表，格式：[{"role": "user", "content": "..."}]
             temperature: 温度参数，越高越随机
             max_tokens: 最大生成token数
+            parse: 对响应的解析，抛出 ResponseParseError 时立即重新请求（次数有限）
+            kind: 请求类别（见 ROUTER_CONFIG["classes"]），决定路由到哪个模型
             
         Returns:
-            API响应结果
+            API响应结果（提供 parse 时为解析结果）；失败时为 {"error": "..."}，
+            若上游已返回过内容（如解析失败），附带这些响应合计的 usage
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        parse = parse or _identity
+        received: List[Dict[str, Any]] = []
         
-        data = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
+        def call(model: str) -> Dict[str, Any]:
+            payload = self._payload(model, messages, temperature, max_tokens)
+            
+            def once():
+                response = self._post(model, payload)
+                received.append(response)
+                return parse(response)
+            
+            return self.resilience.call(model, once)
         
         try:
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self.router.call(self.router.route(kind), call)
+        except UpstreamError as e:
+            return _error_result(e, received)
+    
+    def _post(self, model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            response = requests.post(
+                self.api_url,
+                headers=self._headers(),
+                json=payload,
+                timeout=(API_CONFIG["connect_timeout"], API_CONFIG["timeout"])
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._observe(model, start, "network_error")
+            raise UpstreamError(str(e) or type(e).__name__, retryable=True) from e
         except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+            self._observe(model, start, "network_error")
+            raise UpstreamError(str(e) or type(e).__name__) from e
+        
+        return self._handle(model, response.status_code, response.headers, response.json, start)
+    
+    async def achat(self, messages: list, temperature: float = 0.7, max_tokens: int = 2000,
+                    parse: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                    kind: str = "chat") -> Dict[str, Any]:
+        """
+        调用聊天接口（异步版本，不阻塞事件循环）
+        
+        复用连接池中的长连接，并通过信号量限制同时在途的上游请求数。
+        参数与返回值同 chat。并发中完全相同（且解析方式相同）的请求只发出一次。
+        首选模型超过其 p95 仍未返回时，向第二个模型发出对冲请求，先成功者胜出（见 ModelRouter.acall）。
+        """
+        key = hashlib.sha256(json.dumps([kind, messages, temperature, max_tokens], ensure_ascii=False,
+                                        sort_keys=True).encode()).hexdigest()
+        parser = getattr(parse, "__name__", "")
+        return await self._coalesce(f"chat:{parser}:{key}",
+                                    lambda: self._apost(kind, messages, temperature, max_tokens, parse))
+    
+    async def _coalesce(self, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        # 合并进他人调用的结果标记 shared：上游用量已记在发起调用的请求上，限流结算时按 0 计
+        result, shared = await self.flight.join(key, fn)
+        return {**result, "shared": True} if shared and isinstance(result, dict) else result
+    
+    async def _apost(self, kind: str, messages: list, temperature: float, max_tokens: int,
+                     parse: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> Dict[str, Any]:
+        parse = parse or _identity
+        received: List[Dict[str, Any]] = []
+        
+        async def call(model: str) -> Dict[str, Any]:
+            payload = self._payload(model, messages, temperature, max_tokens)
+            
+            async def once():
+                response = await self._apost_once(model, payload)
+                received.append(response)
+                return parse(response)
+            
+            return await self.resilience.acall(model, once)
+        
+        try:
+            return await self.router.acall(self.router.route(kind), call)
+        except UpstreamError as e:
+            return _error_result(e, received)
+    
+    async def _apost_once(self, model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # 只在单次请求期间占用并发名额，退避等待时让出
+        client = self._async_client()
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(self.api_url, json=payload)
+            except httpx.TransportError as e:
+                self._observe(model, start, "network_error")
+                raise UpstreamError(str(e) or type(e).__name__, retryable=True) from e
+            except httpx.HTTPError as e:
+                self._observe(model, start, "network_error")
+                raise UpstreamError(str(e) or type(e).__name__) from e
+        
+        return self._handle(model, response.status_code, response.headers, response.json, start)
+    
+    def _handle(self, model: str, status: int, headers, read_json: Callable[[], Dict[str, Any]],
+                start: float) -> Dict[str, Any]:
+        """记录耗时与 token 用量，并把错误状态码 / 非法响应转换为 UpstreamError"""
+        if status >= 400:
+            self._observe(model, start, f"http_{status}")
+            raise _status_error(status, headers)
+        try:
+            result = read_json()
+        except ValueError as e:
+            self._observe(model, start, "invalid_json")
+            raise ResponseParseError(f"响应不是合法 JSON: {e}") from e
+        self._observe(model, start, "ok")
+        
+        usage = result.get("usage") if isinstance(result, dict) else None
+        if isinstance(usage, dict):
+            for kind in ("prompt_tokens", "completion_tokens"):
+                if usage.get(kind):
+                    UPSTREAM_TOKENS.inc(model, kind[:-len("_tokens")], amount=usage[kind])
+        return result
+    
+    def _observe(self, model: str, start: float, outcome: str):
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, model, outcome)
+    
+    async def astream_chat(self, messages: list, temperature: float = 0.7, max_tokens: int = 2000,
+                           kind: str = "chat") -> AsyncIterator[str]:
+        """
+        流式调用聊天接口（OpenAI 兼容的 stream: true）
+        
+        已经输出的片段无法撤回，流式请求只按类别路由、不对冲；整个流的耗时计入所选模型的延迟统计
+        
+        Args:
+            messages: 对话消息列表
+            temperature: 温度参数
+            max_tokens: 最大生成token数
+            kind: 请求类别，决定路由到哪个模型
+            
+        Yields:
+            模型逐步生成的文本片段
+            
+        Raises:
+            httpx.HTTPError: 网络请求失败
+            UpstreamError: 上游返回错误状态码，或该模型处于熔断状态（CircuitOpenError）
+        """
+        client = self._async_client()
+        model = self.router.route(kind).primary
+        payload = self._payload(model, messages, temperature, max_tokens)
+        payload["stream"] = True
+        started = time.perf_counter()
+        
+        # 已经输出的片段无法撤回，流式请求不重试，只参与熔断统计
+        try:
+            with self.resilience.guard(model, transient=(httpx.TransportError,)):
+                async for delta in self._astream(client, model, payload):
+                    yield delta
+        except Exception as e:
+            self.router.record(model, kind, error=e)
+            raise
+        self.router.record(model, kind, time.perf_counter() - started)
     
-    def generate_tasks(self, user_goal: str, available_time: str, username: str = "用户") -> Dict[str, Any]:
+    async def _astream(self, client: httpx.AsyncClient, model: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        async with self._semaphore:
+            start, first = time.perf_counter(), True
+            async with client.stream("POST", self.api_url, json=payload) as response:
+                if response.status_code >= 400:
+                    self._observe(model, start, f"http_{response.status_code}")
+                    raise _status_error(response.status_code, response.headers)
+                async for line in response.aiter_lines():
+                    # SSE 格式：每个事件一行 "data: {...}"，以 "data: [DONE]" 结束
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    
+                    chunk = json.loads(data)
+                    if not chunk.get("choices"):
+                        continue
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        if first:
+                            UPSTREAM_FIRST_TOKEN.observe(time.perf_counter() - start, model)
+                            first = False
+                        yield delta
+            self._observe(model, start, "ok")
+    
+    def generate_tasks(self, user_goal: str, available_time: str, username: str = "用户",
+                       context: str = "") -> Dict[str, Any]:
         """
         生成任务列表
         
@@ -59,16 +317,143 @@ class LLMClient:
             user_goal: 用户目标
             available_time: 可用时间
             username: 用户名
+            context: 检索到的用户历史（RAG 上下文），可为空
             
         Returns:
-            生成的任务列表
+            上游原始响应，附带解析校验后的 tasks，以及 repairs / coerced / dropped（见 structured_output.ParsedPlan）；
+            实际请求了上游时还附带 prompt（token 数、可缓存前缀占比、被裁剪的段落，见 AssembledPrompt.report）；
+            命中缓存时带 cached: True，与并发相同请求共享结果时带 shared: True（两者都没有产生本次的上游用量）
         """
-        # 使用模型组提供的Prompt模板
-        prompt = get_task_prompt(
-            username=username,
-            goal=user_goal,
-            available_time=available_time
+        key = self._cache_key(user_goal, available_time, username, context)
+        cached = self.cache.get(key, user_goal) if self.cache else None
+        if cached is not None:
+            return {**cached, "cached": True}
+        
+        prompt = self._task_prompt(user_goal, available_time, username, context)
+        result = self.chat(prompt.messages, self.temperature, self.max_tokens, parse=_parse_tasks, kind="planning")
+        self._cache_put(key, result, user_goal)
+        return {**result, "prompt": prompt.report()}
+    
+    async def agenerate_tasks(self, user_goal: str, available_time: str, username: str = "用户",
+                              context: str = "") -> Dict[str, Any]:
+        """
+        生成任务列表（异步版本），参数与返回值同 generate_tasks
+        
+        归一化后相同的并发请求共享一次上游调用与解析结果
+        """
+        key = self._cache_key(user_goal, available_time, username, context)
+        cached = self.cache.get(key, user_goal) if self.cache else None
+        if cached is not None:
+            return {**cached, "cached": True}
+        
+        return await self._coalesce(
+            f"gen:{key[0]}",
+            lambda: self._agenerate(key, user_goal, available_time, username, context)
         )
+    
+    async def _agenerate(self, key, user_goal: str, available_time: str, username: str,
+                         context: str) -> Dict[str, Any]:
+        prompt = self._task_prompt(user_goal, available_time, username, context)
+        result = await self.achat(prompt.messages, self.temperature, self.max_tokens, parse=_parse_tasks,
+                                  kind="planning")
+        self._cache_put(key, result, user_goal)
+        return {**result, "prompt": prompt.report()}
+    
+    def _task_prompt(self, user_goal: str, available_time: str, username: str, context: str) -> AssembledPrompt:
+        """组装任务生成的消息（静态指令在前，超出预算时先裁剪 RAG 上下文），并记录 token 指标"""
+        prompt = build_task_prompt(username, user_goal, available_time, context,
+                                   budget=self.prompt_budget, builder=self.prompts)
+        PROMPT_TOKENS.inc("cacheable", amount=prompt.cacheable_tokens)
+        PROMPT_TOKENS.inc("uncached", amount=prompt.tokens - prompt.cacheable_tokens)
+        for trimmed in prompt.trimmed:
+            PROMPT_TRIMMED.inc(trimmed["section"], amount=trimmed["tokens"])
+        return prompt
+    
+    async def agenerate_tasks_batch(self, goals: List[Tuple[str, str]], username: str = "用户",
+                                    contexts: Optional[List[str]] = None,
+                                    workers: Optional[int] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        并发生成多个目标的任务列表，按完成先后逐个产出
         
-        messages = [{"role": "user", "content": prompt}]
-        return self.chat(messages)
+        Args:
+            goals: [(目标, 可用时间), ...]
+            username: 用户名
+            contexts: 每个目标对应的 RAG 上下文，可为空
+            workers: 本批次内的并发数，默认 API_CONFIG["batch_workers"]
+            
+        Yields:
+            (目标序号, 结果)；单个目标失败时结果为 {"error": "..."}，不影响其它目标
+        """
+        self._async_client()
+        local = asyncio.Semaphore(workers or API_CONFIG["batch_workers"])
+        contexts = contexts or [""] * len(goals)
+        
+        async def run(index: int, goal: str, available_time: str, context: str):
+            # 先占本批次的名额，再占全局批量名额，避免一个大批次占满全局名额
+            async with local:
+                async with self._batch_semaphore:
+                    try:
+                        return index, await self.agenerate_tasks(goal, available_time, username, context)
+                    except Exception as e:
+                        return index, {"error": str(e) or type(e).__name__}
+        
+        pending = [
+            asyncio.ensure_future(run(i, goal, available_time, context))
+            for i, ((goal, available_time), context) in enumerate(zip(goals, contexts))
+        ]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                yield await next_done
+        finally:
+            # 调用方提前退出（如客户端断开）时取消剩余目标
+            for task in pending:
+                task.cancel()
+    
+    def _cache_key(self, user_goal: str, available_time: str, username: str, context: str):
+        # 按请求类别而不是具体模型区分：同一类别内路由到哪个模型不影响结果能否复用
+        return make_key(TASK_GENERATION_PROMPT, user_goal, available_time, "planning", self.temperature,
+                        username, context, date.today().isoformat())
+    
+    def _cache_put(self, key, result: Dict[str, Any], user_goal: str):
+        # 失败的响应不缓存；shared 只对本次调用方有意义
+        if self.cache is not None and "error" not in result:
+            self.cache.put(key, {k: v for k, v in result.items() if k != "shared"}, user_goal)
+    
+    def astream_generate_tasks(self, user_goal: str, available_time: str, username: str = "用户",
+                               context: str = "") -> AsyncIterator[str]:
+        """流式生成任务列表，逐步产出模型输出的文本片段"""
+        prompt = self._task_prompt(user_goal, available_time, username, context)
+        return self.astream_chat(prompt.messages, self.temperature, self.max_tokens, kind="planning")
+
+
+def _identity(response: Dict[str, Any]) -> Dict[str, Any]:
+    return response
+
+
+def _error_result(error: UpstreamError, responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """失败结果；已收到的响应（如解析失败、重试前的响应）消耗了上游 token，合计后作为 usage 带上"""
+    result = {"error": str(error)}
+    totals = [r["usage"].get("total_tokens") for r in responses
+              if isinstance(r, dict) and isinstance(r.get("usage"), dict)]
+    totals = [t for t in totals if isinstance(t, int)]
+    if totals:
+        result["usage"] = {"total_tokens": sum(totals)}
+    return result
+
+
+def _parse_tasks(response: Dict[str, Any]) -> Dict[str, Any]:
+    """从 OpenAI 兼容的响应中取出模型输出，容错解析为任务列表并合并到响应中"""
+    try:
+        content = response["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as e:
+        raise ResponseParseError(f"响应中缺少模型输出: {e!r}") from e
+    return {**response, **parse_task_plan(content).to_dict()}
+
+
+def _status_error(status: int, headers) -> UpstreamError:
+    """把上游的错误状态码转换为 UpstreamError，并带上 Retry-After（秒）"""
+    try:
+        retry_after = float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        retry_after = None
+    return UpstreamError.from_status(status, retry_after=retry_after)
@@ -0,0 +1,240 @@
+"""
+运行指标
+进程内的计数器与直方图，以 Prometheus 文本格式导出；热路径上只有一次加锁与 bisect
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Any, Callable, Iterable, Optional, Sequence, Tuple
+
+# 请求与上游调用耗时的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 进程内操作（如任务存储）耗时的分桶（秒）
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# collector 返回的样本：(指标名, 类型, 说明, [(标签, 值), ...])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+    
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *labels: Any, amount: float = 1):
+        """按标签值（顺序同定义时的 labels）累加"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0)
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in items)
+        return lines
+
+
+class Histogram:
+    """
+    分桶直方图
+    
+    每组标签只保存各桶的（非累计）计数、总和与总数，观测时 bisect 定位桶；导出时再累加为 Prometheus 的 le 桶。
+    """
+    
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数（最后一个为 +Inf）, 总和, 总数]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *labels: Any):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, *labels: Any):
+        """记录 with 代码块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+    
+    def timed(self, *labels: Any):
+        """记录函数耗时的装饰器"""
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+    
+    def count(self, *labels: Any) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, counts, total, n in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {n}")
+        return lines
+
+
+class Registry:
+    """指标注册表；collector 在导出时读取其它组件已有的计数（如缓存命中），不增加热路径开销"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+    
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # 模块被重复导入（如测试中）时复用已注册的指标
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+    
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+    
+    def collector(self, fn: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+        """注册导出时调用的 collector（可用作装饰器）"""
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+    
+    def render(self) -> str:
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collect in list(self._collectors):
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def counters_sample(name: str, help: str, counters: Dict[str, float], label: str = "event",
+                    **labels: str) -> Sample:
+    """把组件自带的计数字典（如 ResponseCache.counters）转换为一个带标签的 counter 样本"""
+    return name, "counter", help, [({**labels, label: key}, value) for key, value in counters.items()]
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "lifeos_http_request_duration_seconds", "HTTP 请求耗时（流式响应为整个流的时长）",
+    ("method", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    """
+    记录每个路由的请求耗时（纯 ASGI 中间件，不包装请求与响应体，对流式响应无额外开销）
+    
+    路由按声明时的模板（如 /leaderboard/{board}）而不是实际路径统计，避免标签基数随 ID 增长；
+    未匹配任何路由的请求（404）统一记为 unmatched。
+    """
+    
+    def __init__(self, app, histogram: Optional[Histogram] = None):
+        self.app = app
+        self.histogram = histogram or HTTP_LATENCY
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(time.perf_counter() - start, scope["method"], path, status)
+
+
+if __name__ == "__main__":
+    # 开销基准：python -m core.metrics
+    import timeit
+    
+    histogram = Histogram("bench_seconds", "bench", ("op",), FAST_BUCKETS)
+    counter = Counter("bench_total", "bench", ("op",))
+    rounds = 1_000_000
+    cost = timeit.timeit(lambda: histogram.observe(0.0003, "get"), number=rounds)
+    print(f"Histogram.observe: {cost / rounds * 1e9:8.1f} ns")
+    cost = timeit.timeit(lambda: counter.inc("get"), number=rounds)
+    print(f"Counter.inc:       {cost / rounds * 1e9:8.1f} ns")
+    
+    @histogram.timed("op")
+    def noop():
+        pass
+    
+    cost = timeit.timeit(noop, number=rounds)
+    print(f"timed 装饰的空函数: {cost / rounds * 1e9:8.1f} ns")
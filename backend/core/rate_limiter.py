@@ -0,0 +1,354 @@
+"""
+AI 接口限流
+按用户与全局两级令牌桶限制上游 token 消耗：支持优先级、额度不足时短暂排队，并按用户累计 token 成本
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Any, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../model'))
+from config import RATE_LIMIT_CONFIG
+from session_store import estimate_tokens
+from core.metrics import REGISTRY
+
+
+# (桶键, 本次扣减的 token 数, 每秒补充速率, 容量, 该优先级可用的下限)
+Bucket = Tuple[str, float, float, float, float]
+
+GLOBAL_KEY = "__global__"
+USAGE_FIELDS = ("requests", "queued", "rejected", "reserved_tokens", "used_tokens", "wait_seconds")
+
+DECISIONS = REGISTRY.counter("lifeos_rate_limit_requests_total", "限流决策", ("priority", "outcome"))
+TOKENS = REGISTRY.counter("lifeos_rate_limit_tokens_total", "限流预占与结算的 token 数", ("kind",))
+
+
+class RateLimited(Exception):
+    """额度不足且需要等待的时间超过该优先级的排队上限"""
+    
+    def __init__(self, retry_after: float, scope: str):
+        super().__init__(f"请求过于频繁（{'全局' if scope == GLOBAL_KEY else '用户'}额度不足），请 {retry_after:.1f} 秒后重试")
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+def _take(tokens: float, updated: float, now: float, bucket: Bucket) -> Tuple[float, float]:
+    """
+    补充令牌后计算本次需要等待的时间
+    
+    采用预占方式：放行的请求立即扣减（余额可以为负），需要等待的时长由欠下的额度决定，
+    之后的请求排在它后面，因此排队顺序与到达顺序一致。
+    
+    Returns:
+        (补充后的余额, 需要等待的秒数)
+    """
+    _, cost, rate, capacity, floor = bucket
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    # 单个请求最多按整桶计算，避免超大请求永远无法放行
+    need = min(cost, capacity - floor)
+    return tokens, max(0.0, (floor + need - tokens) / rate)
+
+
+class BucketStore:
+    """
+    令牌桶状态与用量计数的存储接口
+    
+    acquire 对多个桶的检查与扣减必须是原子的：任一桶不放行时，所有桶都不扣减。
+    """
+    
+    # 调用是否会阻塞（阻塞的存储在线程中调用，不占用事件循环）
+    blocking = False
+    
+    def acquire(self, buckets: List[Bucket], max_wait: float, now: float) -> float:
+        """
+        预占令牌
+        
+        Returns:
+            放行前需要等待的秒数
+            
+        Raises:
+            RateLimited: 需要等待的时间超过 max_wait，此时不扣减
+        """
+        raise NotImplementedError
+    
+    def refund(self, buckets: List[Tuple[str, float, float]]):
+        """按 (桶键, 退回的 token 数, 容量) 退回预占多出的额度（可为负数，即补扣）"""
+        raise NotImplementedError
+    
+    def record(self, user_id: str, **counters: float):
+        """累加用户的用量计数（字段见 USAGE_FIELDS）"""
+        raise NotImplementedError
+    
+    def usage(self, user_id: str) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    """进程内存储，多个 worker 进程之间不共享额度"""
+    
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.counters: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, buckets: List[Bucket], max_wait: float, now: float) -> float:
+        with self._lock:
+            states, wait, scope = [], 0.0, ""
+            for bucket in buckets:
+                tokens, updated = self.buckets.get(bucket[0], (bucket[3], now))
+                tokens, need = _take(tokens, updated, now, bucket)
+                states.append((bucket[0], tokens - bucket[1]))
+                if need > wait:
+                    wait, scope = need, bucket[0]
+            if wait > max_wait:
+                raise RateLimited(wait, scope)
+            for key, tokens in states:
+                self.buckets[key] = (tokens, now)
+            return wait
+    
+    def refund(self, buckets: List[Tuple[str, float, float]]):
+        with self._lock:
+            for key, tokens, capacity in buckets:
+                if key in self.buckets:
+                    current, updated = self.buckets[key]
+                    self.buckets[key] = (min(capacity, current + tokens), updated)
+    
+    def record(self, user_id: str, **counters: float):
+        with self._lock:
+            usage = self.counters.setdefault(user_id, dict.fromkeys(USAGE_FIELDS, 0))
+            for name, value in counters.items():
+                usage[name] += value
+    
+    def usage(self, user_id: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.counters.get(user_id) or dict.fromkeys(USAGE_FIELDS, 0))
+
+
+_BUCKET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key      TEXT PRIMARY KEY,
+    tokens   REAL NOT NULL,
+    updated  REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usage (
+    user_id          TEXT PRIMARY KEY,
+    requests         INTEGER NOT NULL DEFAULT 0,
+    queued           INTEGER NOT NULL DEFAULT 0,
+    rejected         INTEGER NOT NULL DEFAULT 0,
+    reserved_tokens  INTEGER NOT NULL DEFAULT 0,
+    used_tokens      INTEGER NOT NULL DEFAULT 0,
+    wait_seconds     REAL    NOT NULL DEFAULT 0
+);
+"""
+
+_SQL_GET_BUCKET = "SELECT tokens, updated FROM buckets WHERE key = ?"
+_SQL_PUT_BUCKET = "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)"
+_SQL_REFUND = "UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?"
+_SQL_GET_USAGE = f"SELECT {', '.join(USAGE_FIELDS)} FROM usage WHERE user_id = ?"
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    基于 SQLite 文件的共享存储：同一台机器上的多个 uvicorn worker 共享同一份额度
+    
+    每次预占是一个 BEGIN IMMEDIATE 事务，写锁保证多进程间的检查与扣减是原子的。
+    """
+    
+    blocking = True
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_BUCKET_SCHEMA)
+    
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 限流状态丢失最多让额度提前恢复，不需要每次提交都 fsync
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    def acquire(self, buckets: List[Bucket], max_wait: float, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            states, wait, scope = [], 0.0, ""
+            for bucket in buckets:
+                row = conn.execute(_SQL_GET_BUCKET, (bucket[0],)).fetchone()
+                tokens, need = _take(*(row or (bucket[3], now)), now, bucket)
+                states.append((bucket[0], tokens - bucket[1], now))
+                if need > wait:
+                    wait, scope = need, bucket[0]
+            if wait > max_wait:
+                raise RateLimited(wait, scope)
+            conn.executemany(_SQL_PUT_BUCKET, states)
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def refund(self, buckets: List[Tuple[str, float, float]]):
+        self._conn().executemany(_SQL_REFUND, [(capacity, tokens, key) for key, tokens, capacity in buckets])
+    
+    def record(self, user_id: str, **counters: float):
+        names = list(counters)
+        self._conn().execute(
+            f"INSERT INTO usage (user_id, {', '.join(names)}) VALUES (?{', ?' * len(names)}) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {', '.join(f'{n} = {n} + excluded.{n}' for n in names)}",
+            (user_id, *counters.values())
+        )
+    
+    def usage(self, user_id: str) -> Dict[str, float]:
+        row = self._conn().execute(_SQL_GET_USAGE, (user_id,)).fetchone()
+        return dict(zip(USAGE_FIELDS, row or (0,) * len(USAGE_FIELDS)))
+
+
+class Reservation:
+    """一次放行的预占额度；请求结束后按实际用量结算"""
+    
+    __slots__ = ("user_id", "cost", "wait", "used")
+    
+    def __init__(self, user_id: str, cost: int, wait: float):
+        self.user_id = user_id
+        self.cost = cost
+        self.wait = wait
+        self.used: Optional[int] = None     # 实际消耗的 token 数，未知时按预占额度结算
+
+
+class RateLimiter:
+    """
+    两级令牌桶限流（单位：token）
+    
+    - 用户桶限制单个用户，全局桶保护上游配额；两个桶都放行才放行
+    - 额度不足时按欠额计算等待时间，不超过该优先级的 max_wait 就排队等待，否则拒绝并给出 Retry-After
+    - 低优先级（如批量生成）只能把全局桶用到 reserve 比例为止，剩余额度留给交互请求
+    - 放行时按 prompt 估算 + max_tokens 预占，结束后按上游返回的 usage 退回多占的部分
+    """
+    
+    def __init__(self, store: Optional[BucketStore] = None, user_tokens_per_min: float = 20000,
+                 user_burst: float = 40000, global_tokens_per_min: float = 300000,
+                 global_burst: float = 400000, priorities: Optional[Dict[str, Dict[str, float]]] = None):
+        self.store = store if store is not None else MemoryBucketStore()
+        self.user_rate = user_tokens_per_min / 60
+        self.user_burst = user_burst
+        self.global_rate = global_tokens_per_min / 60
+        self.global_burst = global_burst
+        self.priorities = priorities or {"interactive": {"max_wait": 2.0, "reserve": 0.0}}
+    
+    @staticmethod
+    def estimate(prompt: str, max_tokens: int) -> int:
+        """预占额度：prompt 的估算 token 数加上最多生成的 token 数"""
+        return estimate_tokens(prompt) + max_tokens
+    
+    async def _call(self, fn, *args, **kwargs):
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+    
+    async def acquire(self, user_id: str, cost: int, priority: str = "interactive") -> Reservation:
+        """
+        预占额度，需要排队时等待到放行为止
+        
+        Raises:
+            RateLimited: 需要等待的时间超过该优先级的排队上限
+            KeyError: 未配置的优先级
+        """
+        policy = self.priorities[priority]
+        buckets = [
+            (f"user:{user_id}", cost, self.user_rate, self.user_burst, 0.0),
+            (GLOBAL_KEY, cost, self.global_rate, self.global_burst, policy.get("reserve", 0.0) * self.global_burst)
+        ]
+        try:
+            wait = await self._call(self.store.acquire, buckets, policy["max_wait"], time.time())
+        except RateLimited:
+            DECISIONS.inc(priority, "rejected")
+            await self._call(self.store.record, user_id, rejected=1)
+            raise
+        
+        DECISIONS.inc(priority, "queued" if wait > 0 else "admitted")
+        TOKENS.inc("reserved", amount=cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self._call(self.store.record, user_id, requests=1, queued=int(wait > 0),
+                         reserved_tokens=cost, wait_seconds=wait)
+        return Reservation(user_id, cost, wait)
+    
+    async def settle(self, reservation: Reservation, failed: bool = False):
+        """
+        按实际用量结算：退回多占的额度并累计用户的 token 成本
+        
+        请求失败且用量未知时，视为没有消耗，全部退回。
+        """
+        used = reservation.used
+        if used is None:
+            used = 0 if failed else reservation.cost
+        refund = reservation.cost - used
+        TOKENS.inc("used", amount=used)
+        if refund:
+            await self._call(self.store.refund, [(f"user:{reservation.user_id}", refund, self.user_burst),
+                                                 (GLOBAL_KEY, refund, self.global_burst)])
+        await self._call(self.store.record, reservation.user_id, used_tokens=used)
+    
+    @asynccontextmanager
+    async def limit(self, user_id: str, cost: int, priority: str = "interactive"):
+        """
+        预占额度并在退出时结算；调用方把实际用量写入 reservation.used
+        
+        用法:
+            async with limiter.limit(user_id, cost) as reservation:
+                result = await ...
+                reservation.used = result["usage"]["total_tokens"]
+        """
+        reservation = await self.acquire(user_id, cost, priority)
+        try:
+            yield reservation
+        except BaseException:
+            await self.settle(reservation, failed=True)
+            raise
+        await self.settle(reservation)
+    
+    async def usage(self, user_id: str) -> Dict[str, float]:
+        """用户的累计用量"""
+        return await self._call(self.store.usage, user_id)
+
+
+def usage_tokens(result: Dict[str, Any]) -> Optional[int]:
+    """
+    OpenAI 兼容响应中的实际 token 用量；缺少 usage 时为 None
+    
+    命中缓存（cached）或与并发相同请求共享结果（shared）时为 0：本次请求没有消耗上游 token。
+    上游调用失败（{"error": ...}）时按其中的 usage 计（如返回了内容但解析失败），没有 usage 时为 0
+    """
+    if not isinstance(result, dict):
+        return None
+    if result.get("cached") or result.get("shared"):
+        return 0
+    usage = result.get("usage")
+    if isinstance(usage, dict) and usage.get("total_tokens") is not None:
+        return usage["total_tokens"]
+    return 0 if "error" in result else None
+
+
+def create_limiter() -> RateLimiter:
+    """
+    根据环境变量创建限流器
+    
+    RATE_LIMIT_STORE: memory（默认）/ sqlite（同机多个 worker 共享额度）
+    RATE_LIMIT_DB_PATH: SQLite 文件路径，默认 backend/data/rate_limit.db
+    """
+    if os.getenv("RATE_LIMIT_STORE", "memory").lower() == "sqlite":
+        default_path = os.path.join(os.path.dirname(__file__), "../data/rate_limit.db")
+        store = SQLiteBucketStore(os.getenv("RATE_LIMIT_DB_PATH", default_path))
+    else:
+        store = MemoryBucketStore()
+    return RateLimiter(store, **RATE_LIMIT_CONFIG)
@@ -0,0 +1,135 @@
+"""
+周期任务的重复规则
+类似 iCalendar RRULE 的精简版本，按查询的日期窗口惰性展开，不预先生成实例
+"""
+from datetime import date, timedelta
+from typing import Dict, Any, Iterator, List, Optional
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+
+class RecurrenceRule:
+    """
+    重复规则
+    
+    - freq: daily / weekly / monthly
+    - interval: 间隔，如 weekly + 2 表示每两周
+    - byweekday: weekly 时在一周中的哪几天（0 为周一），默认与 start 同一天
+    - bymonthday: monthly 时在每月的哪一天，默认与 start 同一天；当月没有这一天时跳过
+    - start: 首次发生的日期（含）
+    - until: 结束日期（含），可选
+    - count: 最多发生的次数，可选
+    """
+    
+    def __init__(self, freq: str, start: date, interval: int = 1, byweekday: Optional[List[int]] = None,
+                 bymonthday: Optional[int] = None, until: Optional[date] = None, count: Optional[int] = None):
+        if freq not in FREQUENCIES:
+            raise ValueError(f"不支持的重复频率: {freq}")
+        if interval < 1:
+            raise ValueError("interval 必须为正整数")
+        if byweekday is not None and (not byweekday or any(d not in range(7) for d in byweekday)):
+            raise ValueError("byweekday 取值为 0（周一）到 6（周日）")
+        if bymonthday is not None and bymonthday not in range(1, 32):
+            raise ValueError("bymonthday 取值为 1 到 31")
+        if count is not None and count < 1:
+            raise ValueError("count 必须为正整数")
+        if until is not None and until < start:
+            raise ValueError("until 不能早于 start")
+        
+        self.freq = freq
+        self.start = start
+        self.interval = interval
+        self.byweekday = sorted(set(byweekday)) if byweekday else [start.weekday()]
+        self.bymonthday = bymonthday or start.day
+        self.until = until
+        self.count = count
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RecurrenceRule":
+        """由 JSON 规则创建（日期为 YYYY-MM-DD 字符串）"""
+        try:
+            return cls(
+                freq=data["freq"],
+                start=date.fromisoformat(data["start"]),
+                interval=int(data.get("interval") or 1),
+                byweekday=data.get("byweekday"),
+                bymonthday=data.get("bymonthday"),
+                until=date.fromisoformat(data["until"]) if data.get("until") else None,
+                count=data.get("count")
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"无效的重复规则: {e}")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"freq": self.freq, "start": self.start.isoformat(), "interval": self.interval}
+        if self.freq == "weekly":
+            data["byweekday"] = self.byweekday
+        if self.freq == "monthly":
+            data["bymonthday"] = self.bymonthday
+        if self.until:
+            data["until"] = self.until.isoformat()
+        if self.count:
+            data["count"] = self.count
+        return data
+    
+    def _periods_before(self, day: date) -> int:
+        """day 之前已经完整经过的周期数，用于直接跳到窗口起点附近"""
+        if day <= self.start:
+            return 0
+        if self.freq == "daily":
+            return (day - self.start).days // self.interval
+        if self.freq == "weekly":
+            week0 = self.start - timedelta(days=self.start.weekday())
+            return (day - week0).days // 7 // self.interval
+        months = (day.year - self.start.year) * 12 + day.month - self.start.month
+        return max(months // self.interval, 0)
+    
+    def _period_dates(self, period: int) -> List[date]:
+        """第 period 个周期内的发生日期"""
+        if self.freq == "daily":
+            return [self.start + timedelta(days=period * self.interval)]
+        if self.freq == "weekly":
+            week = self.start - timedelta(days=self.start.weekday()) + timedelta(weeks=period * self.interval)
+            return [week + timedelta(days=d) for d in self.byweekday]
+        months = self.start.month - 1 + period * self.interval
+        year, month = self.start.year + months // 12, months % 12 + 1
+        try:
+            return [date(year, month, self.bymonthday)]
+        except ValueError:
+            return []
+    
+    def occurrences(self, start: date, end: date) -> Iterator[date]:
+        """
+        [start, end) 窗口内的发生日期
+        
+        没有 count 时从窗口起点所在周期开始展开，开销只与窗口大小有关；
+        有 count 时需要从头计数，但最多展开 count 次
+        """
+        period = 0 if self.count else self._periods_before(start)
+        seen = 0
+        while True:
+            for day in self._period_dates(period):
+                if day < self.start:
+                    continue
+                if (self.until and day > self.until) or day >= end:
+                    return
+                seen += 1
+                if self.count and seen > self.count:
+                    return
+                if day >= start:
+                    yield day
+            period += 1
+            if self._period_start(period) >= end or (self.until and self._period_start(period) > self.until):
+                return
+    
+    def _period_start(self, period: int) -> date:
+        if self.freq == "daily":
+            return self.start + timedelta(days=period * self.interval)
+        if self.freq == "weekly":
+            return self.start - timedelta(days=self.start.weekday()) + timedelta(weeks=period * self.interval)
+        months = self.start.month - 1 + period * self.interval
+        return date(self.start.year + months // 12, months % 12 + 1, 1)
+    
+    def includes(self, day: date) -> bool:
+        """day 是否为一次发生"""
+        return next(self.occurrences(day, day + timedelta(days=1)), None) == day
@@ -0,0 +1,178 @@
+"""
+LLM 响应缓存
+对相同（或近似）的任务生成请求复用已有结果，减少上游调用与 token 消耗
+"""
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Callable, Sequence, Tuple
+
+# 归一化时去掉的标点（含全角）
+_PUNCTUATION = re.compile(r"[\s,.!?;:，。！？；：、~～\"'“”‘’]+")
+
+
+def normalize_text(text: str) -> str:
+    """归一化用户输入：去首尾空白、转小写、去掉空白与标点"""
+    return _PUNCTUATION.sub("", text.strip().lower())
+
+
+def make_key(template: str, goal: str, available_time: str, model: str, temperature: float,
+             username: str = "", context: str = "", today: str = "") -> Tuple[str, str]:
+    """
+    生成缓存键
+    
+    Args:
+        template: Prompt 模板原文（模板变化后旧缓存自动失效）
+        goal: 用户目标
+        available_time: 可用时间
+        model: 模型名
+        temperature: 温度参数
+        username: 用户名（会填入 Prompt，因此也参与键）
+        context: 检索到的用户历史上下文（会填入 Prompt，因此也参与键）
+        today: 填入 Prompt 的日期（生成的日期与重复规则依赖它，缓存按天区分）
+        
+    Returns:
+        (精确键, 作用域键)；语义层只在同一作用域（除目标外其它参数都相同）内比较目标
+    """
+    scope = json.dumps([
+        hashlib.sha256(template.encode()).hexdigest()[:16],
+        normalize_text(available_time),
+        model,
+        round(temperature, 2),
+        username,
+        hashlib.sha256(context.encode()).hexdigest()[:16] if context else "",
+        today
+    ], ensure_ascii=False)
+    exact = hashlib.sha256(f"{scope}|{normalize_text(goal)}".encode()).hexdigest()
+    return exact, scope
+
+
+class ResponseCache:
+    """
+    带 TTL 的 LRU 响应缓存，可选语义近似匹配
+    
+    - 精确层：归一化后的请求完全一致即命中，O(1)
+    - 语义层：配置 embedder 后，对未精确命中的请求计算目标文本的向量，
+      与同一作用域内已缓存目标做余弦相似度比较，超过阈值即命中
+    """
+    
+    def __init__(self, max_entries: int = 2048, ttl: float = 6 * 3600,
+                 embedder: Optional[Callable[[str], Sequence[float]]] = None,
+                 similarity_threshold: float = 0.92):
+        """
+        Args:
+            max_entries: 最多缓存条数，超出后淘汰最久未使用的条目
+            ttl: 条目过期时间（秒）
+            embedder: 文本 -> 向量的函数，为 None 时不启用语义层
+            similarity_threshold: 语义层命中所需的最小余弦相似度
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        
+        # key -> (过期时间, 作用域, 单位向量, 值)
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[List[float]], Any]]" = OrderedDict()
+        self._scopes: Dict[str, Dict[str, None]] = {}   # 作用域 -> 该作用域下的键
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+    
+    def get(self, key: Tuple[str, str], text: str = "") -> Optional[Any]:
+        """
+        查询缓存
+        
+        Args:
+            key: make_key 生成的键
+            text: 原始目标文本，用于语义层匹配
+            
+        Returns:
+            命中的值，未命中返回 None
+        """
+        exact, scope = key
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(exact)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(exact)
+                    self.counters["hits"] += 1
+                    return entry[3]
+                self._remove(exact)
+                self.counters["expired"] += 1
+            
+            if self.embedder is None or not text or scope not in self._scopes:
+                self.counters["misses"] += 1
+                return None
+            candidates = list(self._scopes[scope])
+        
+        # 向量计算放在锁外
+        vector = self._unit(self.embedder(normalize_text(text)))
+        best_key, best_score = None, self.similarity_threshold
+        for candidate in candidates:
+            entry = self._entries.get(candidate)
+            if entry is None or entry[2] is None or entry[0] <= now:
+                continue
+            score = sum(a * b for a, b in zip(vector, entry[2]))
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        
+        with self._lock:
+            entry = self._entries.get(best_key) if best_key else None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.counters["semantic_hits"] += 1
+            return entry[3]
+    
+    def put(self, key: Tuple[str, str], value: Any, text: str = ""):
+        """
+        写入缓存
+        
+        Args:
+            key: make_key 生成的键
+            value: 要缓存的值
+            text: 原始目标文本，用于语义层匹配
+        """
+        exact, scope = key
+        vector = self._unit(self.embedder(normalize_text(text))) if self.embedder and text else None
+        with self._lock:
+            if exact in self._entries:
+                self._remove(exact)
+            self._entries[exact] = (time.monotonic() + self.ttl, scope, vector, value)
+            self._scopes.setdefault(scope, {})[exact] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        lookups = self.counters["hits"] + self.counters["semantic_hits"] + self.counters["misses"]
+        hits = self.counters["hits"] + self.counters["semantic_hits"]
+        return {
+            **self.counters,
+            "size": len(self._entries),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+    
+    def _remove(self, exact: str):
+        _, scope, _, _ = self._entries.pop(exact)
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.pop(exact, None)
+            if not keys:
+                del self._scopes[scope]
+    
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> List[float]:
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
@@ -0,0 +1,71 @@
+"""
+请求合并（single-flight）
+同一时刻相同的上游请求只真正发出一次，其余调用方共享该次调用的结果
+"""
+import asyncio
+from typing import Dict, Any, Awaitable, Callable, Tuple
+
+
+class SingleFlight:
+    """
+    按键合并并发中的异步调用
+    
+    - 第一个调用方（leader）发起真正的调用，调用在独立的 Task 中执行，
+      因此任何一个调用方被取消都不会中断其它调用方正在等待的结果
+    - 调用结束（无论成功或异常）后立即移除该键，异常只传给当时在等待的调用方，
+      不会影响之后的调用
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.counters = {"calls": 0, "executed": 0, "coalesced": 0, "errors": 0}
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入一次调用
+        
+        Args:
+            key: 合并键，相同键的并发调用共享一次执行
+            fn: 发起真正调用的协程函数
+            
+        Returns:
+            fn 的返回值（同键的调用方拿到同一个对象，不应原地修改）
+        """
+        result, _ = await self.join(key, fn)
+        return result
+    
+    async def join(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        同 do，并返回本次是否加入了他人发起的调用
+        
+        Returns:
+            (fn 的返回值, 是否为合并进来的调用方)；合并进来的调用方没有产生上游用量
+        """
+        self.counters["calls"] += 1
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            self.counters["executed"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.counters["coalesced"] += 1
+        
+        return await asyncio.shield(task), shared
+    
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 取出异常，避免所有调用方都已取消时出现 "exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["errors"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        calls = self.counters["calls"]
+        return {
+            **self.counters,
+            "inflight": len(self._inflight),
+            "coalesce_rate": round(self.counters["coalesced"] / calls, 4) if calls else 0.0
+        }
@@ -0,0 +1,82 @@
+"""
+用户统计引擎
+每完成一个任务就增量更新已物化的统计（完成数、经验、连续天数、属性总值），
+不回扫历史任务，单次更新的开销与历史长度无关
+"""
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+# 属性奖励的键（见 model/llm_client.SYSTEM_PROMPT 中任务的 rewards）与对应的统计字段
+ATTRIBUTES = {"INT": "int_total", "VIT": "vit_total"}
+
+STAT_FIELDS = ("tasks_completed", "total_exp", "streak_days", "best_streak", "last_active",
+               *ATTRIBUTES.values())
+
+
+def empty_stats() -> Dict[str, Any]:
+    """从未完成过任务的用户统计"""
+    stats = {field: 0 for field in STAT_FIELDS}
+    stats["last_active"] = None
+    return stats
+
+
+def apply_completion(stats: Optional[Dict[str, Any]], task: Dict[str, Any],
+                     completed_at: str) -> Tuple[Dict[str, Any], Dict[str, Tuple[Any, Any]]]:
+    """
+    把一次任务完成事件应用到统计上
+    
+    Args:
+        stats: 当前统计，None 表示尚无统计
+        task: 完成的任务（使用 reward_exp 与 rewards）
+        completed_at: 完成时间（ISO 格式），按其日期计算连续天数
+        
+    Returns:
+        (新的统计, 发生变化的指标 {指标: (旧值, 新值)})
+    """
+    old = stats or empty_stats()
+    new = dict(old)
+    
+    new["tasks_completed"] += 1
+    new["total_exp"] += task.get("reward_exp") or 0
+    
+    rewards = task.get("rewards") or {}
+    for key, field in ATTRIBUTES.items():
+        new[field] += int(rewards.get(key) or 0)
+    
+    # 连续天数：同一天不变，紧接前一天 +1，中断后从 1 重新开始
+    day = completed_at[:10]
+    last = old["last_active"]
+    if last != day:
+        if last and last > day:
+            # 乱序到达的较早事件不影响连续天数
+            day = last
+        elif last and date.fromisoformat(day) - date.fromisoformat(last) == timedelta(days=1):
+            new["streak_days"] += 1
+        else:
+            new["streak_days"] = 1
+        new["last_active"] = day
+    new["best_streak"] = max(new["best_streak"], new["streak_days"])
+    
+    changed = {field: (old[field], new[field]) for field in STAT_FIELDS if old[field] != new[field]}
+    return new, changed
+
+
+def current_streak(stats: Dict[str, Any], today: date) -> int:
+    """读取时的连续天数：最后活跃日早于昨天说明已经中断"""
+    last = stats.get("last_active")
+    if not last or today - date.fromisoformat(last) > timedelta(days=1):
+        return 0
+    return stats.get("streak_days", 0)
+
+
+def apply_completions(stats: Optional[Dict[str, Any]], tasks: List[Dict[str, Any]],
+                      completed_at: str) -> Tuple[Dict[str, Any], Dict[str, Tuple[Any, Any]]]:
+    """
+    批量应用同一时刻完成的多个任务，返回值同 apply_completion，changed 为整批前后的变化
+    """
+    old = stats or empty_stats()
+    new = old
+    for task in tasks:
+        new, _ = apply_completion(new, task, completed_at)
+    changed = {field: (old[field], new[field]) for field in STAT_FIELDS if old[field] != new[field]}
+    return new, changed
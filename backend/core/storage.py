@@ -0,0 +1,854 @@
+"""
+任务存储后端
+TaskManager 通过 TaskStore 接口读写任务与用户统计，可在内存与 SQLite 之间切换
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Any, Iterator, Optional, Callable, Tuple
+
+from core.stats_engine import STAT_FIELDS, apply_completion, apply_completions
+
+
+class TaskNotFound(ValueError):
+    """任务不存在"""
+    
+    def __init__(self):
+        super().__init__("任务不存在")
+
+
+class TaskAlreadyCompleted(ValueError):
+    """任务已完成"""
+    
+    def __init__(self):
+        super().__init__("任务已完成")
+
+
+class DuplicateTaskIds(ValueError):
+    """批量操作中出现重复的任务ID"""
+    
+    def __init__(self):
+        super().__init__("任务ID重复")
+
+
+class TaskIndex:
+    """
+    单个用户的带索引任务集合
+    
+    - by_id: task_id -> task，dict 本身保持插入顺序，即创建顺序
+    - by_status: status -> 有序的 task_id 集合（以 dict 作为有序集合）
+    - order: task_id -> 创建序号，用于恢复状态集合内的创建顺序
+    - seq: 已分配的最大任务序号，只增不减，删除任务后也不会复用旧 ID
+    
+    按 ID 查找、状态切换均为 O(1)，按状态筛选为 O(k)（k 为结果数量）
+    本身不加锁，由 MemoryTaskStore 在该用户的分段锁内调用
+    """
+    
+    def __init__(self):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_status: Dict[str, Dict[str, None]] = {}
+        self.order: Dict[str, int] = {}
+        self.seq = 0
+    
+    def __len__(self) -> int:
+        return len(self.by_id)
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.by_id.values())
+    
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self.by_id
+    
+    def next_id(self) -> str:
+        """分配下一个任务 ID（task_{n}）"""
+        self.seq += 1
+        return f"task_{self.seq}"
+    
+    def add(self, task: Dict[str, Any]):
+        """添加任务并登记到对应状态集合"""
+        self.order[task["id"]] = len(self.by_id)
+        self.by_id[task["id"]] = task
+        self.by_status.setdefault(task["status"], {})[task["id"]] = None
+    
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 查找任务"""
+        return self.by_id.get(task_id)
+    
+    def set_status(self, task: Dict[str, Any], status: str):
+        """修改任务状态，同步维护状态集合"""
+        self.by_status.get(task["status"], {}).pop(task["id"], None)
+        task["status"] = status
+        self.by_status.setdefault(status, {})[task["id"]] = None
+    
+    def compare_and_set(self, task: Dict[str, Any], expected: str, status: str) -> bool:
+        """仅当任务当前状态为 expected 时改为 status，返回是否修改"""
+        if task["status"] != expected:
+            return False
+        self.set_status(task, status)
+        return True
+    
+    def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        按创建顺序列出任务
+        
+        注意：状态变更后加入新集合的任务会排在该集合末尾，
+        因此除 pending（只在创建时加入，天然有序）外需按创建序号恢复顺序。
+        """
+        if not status:
+            return list(self.by_id.values())
+        
+        ids = self.by_status.get(status)
+        if not ids:
+            return []
+        
+        tasks = [self.by_id[task_id] for task_id in ids]
+        if status != "pending":
+            tasks.sort(key=lambda t: self.order[t["id"]])
+        return tasks
+
+
+class TaskStore:
+    """
+    任务存储接口
+    
+    任务 ID 由存储分配，以保证并发创建时不会重复；
+    完成任务与增量更新统计（见 core.stats_engine）在同一次存储操作内完成，避免中间状态被读到。
+    """
+    
+    def create_task(self, user_id: str, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        保存新任务
+        
+        Args:
+            user_id: 用户ID
+            task: 不含 id 的任务数据
+            
+        Returns:
+            分配了 id 的任务
+        """
+        raise NotImplementedError
+    
+    def create_tasks(self, user_id: str, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量保存新任务，全部成功或全部不写入"""
+        raise NotImplementedError
+    
+    def get_task(self, user_id: str, task_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 读取任务，不存在时返回 None"""
+        raise NotImplementedError
+    
+    def list_tasks(self, user_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按创建顺序列出任务，可按状态筛选"""
+        raise NotImplementedError
+    
+    def page_tasks(self, user_id: str, status: Optional[str] = None, after: Optional[Tuple[str, int]] = None,
+                   limit: int = 50, created_from: Optional[str] = None,
+                   created_to: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int]]]:
+        """
+        按 (created_at, seq) 键集分页列出任务
+        
+        Args:
+            user_id: 用户ID
+            status: 筛选状态
+            after: 上一页最后一个任务的键，None 表示第一页
+            limit: 每页数量
+            created_from: 创建时间下限（含）
+            created_to: 创建时间上限（不含）
+            
+        Returns:
+            (本页任务, 本页最后一个任务的键；没有下一页时为 None)
+        """
+        raise NotImplementedError
+    
+    def get_version(self, user_id: str) -> int:
+        """该用户数据的版本号，任何写操作都会使其递增，用于生成 ETag"""
+        raise NotImplementedError
+    
+    def complete_task(self, user_id: str, task_id: str, completed_at: str) -> Dict[str, Any]:
+        """
+        标记任务完成并累加用户统计
+        
+        Args:
+            user_id: 用户ID
+            task_id: 任务ID
+            completed_at: 完成时间（ISO 格式）
+            
+        Returns:
+            {"task": 任务, "stats": 更新后的统计, "changed": {指标: (旧值, 新值)}}
+            
+        Raises:
+            TaskNotFound: 任务不存在
+            TaskAlreadyCompleted: 任务已完成
+        """
+        raise NotImplementedError
+    
+    def complete_tasks(self, user_id: str, task_ids: List[str], completed_at: str) -> Dict[str, Any]:
+        """
+        批量标记任务完成，全部成功或全部不写入
+        
+        Returns:
+            {"tasks": 任务列表, "stats": 更新后的统计, "changed": 整批前后变化的指标}
+            
+        Raises:
+            DuplicateTaskIds: 任务ID重复
+            TaskNotFound: 任一任务不存在
+            TaskAlreadyCompleted: 任一任务已完成
+        """
+        raise NotImplementedError
+    
+    def create_template(self, user_id: str, template: Dict[str, Any]) -> Dict[str, Any]:
+        """保存周期任务模板（含 rule 重复规则），分配 tmpl_{n} 形式的 ID"""
+        raise NotImplementedError
+    
+    def get_template(self, user_id: str, template_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 读取模板，不存在时返回 None"""
+        raise NotImplementedError
+    
+    def list_templates(self, user_id: str) -> List[Dict[str, Any]]:
+        """按创建顺序列出模板"""
+        raise NotImplementedError
+    
+    def completed_occurrences(self, user_id: str, start: str, end: str) -> Dict[Tuple[str, str], str]:
+        """[start, end) 日期范围内已完成的周期任务实例：{(模板ID, 日期): 任务ID}"""
+        raise NotImplementedError
+    
+    def complete_occurrence(self, user_id: str, template_id: str, day: str, task: Dict[str, Any],
+                            completed_at: str) -> Dict[str, Any]:
+        """
+        完成周期任务的某次实例：此时才把实例写成一条真实任务，并记录 (模板, 日期) 已完成
+        
+        Returns:
+            同 complete_task
+            
+        Raises:
+            TaskAlreadyCompleted: 该实例已完成
+        """
+        raise NotImplementedError
+    
+    def get_stats(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """读取用户统计，用户从未完成过任务时返回 None"""
+        raise NotImplementedError
+    
+    def iter_stats(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """遍历所有完成过任务的用户统计：(user_id, stats)，用于启动时重建排行榜"""
+        raise NotImplementedError
+    
+    def iter_completions(self, since: str) -> Iterator[Tuple[str, str, int]]:
+        """按完成时间顺序遍历 since（ISO 日期）之后完成的任务：(user_id, completed_at, reward_exp)"""
+        raise NotImplementedError
+    
+    def close(self):
+        """释放资源"""
+
+
+class MemoryTaskStore(TaskStore):
+    """
+    内存存储，进程重启后数据丢失，主要用于测试与本地调试
+    
+    并发模型：按 user_id 的哈希分段加锁（lock striping），同一用户的写操作串行，不同用户的写操作互不阻塞。
+    所有写操作只修改本用户名下的数据，顶层字典只做单键的读取与 setdefault，二者本身是原子的；
+    任务 ID 由 TaskIndex.seq 在锁内单调分配，完成任务在锁内对状态做 pending -> completed 的比较并设置，
+    同一任务被并发完成时只有一次成功，经验值不会重复发放。
+    单键读取不加锁；需要遍历的读操作在锁内取快照。
+    """
+    
+    def __init__(self, stripes: int = 64):
+        self.tasks: Dict[str, TaskIndex] = {}   # {user_id: TaskIndex}
+        self.user_stats: Dict[str, Dict] = {}   # {user_id: stats}
+        self.versions: Dict[str, int] = {}      # {user_id: version}
+        self.templates: Dict[str, Dict[str, Dict]] = {}             # {user_id: {template_id: template}}
+        self.occurrences: Dict[str, Dict[Tuple[str, str], str]] = {}  # {user_id: {(template_id, day): task_id}}
+        # stripes=1 即退化为全局锁
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+    
+    def _lock(self, user_id: str) -> threading.Lock:
+        """该用户所在分段的锁"""
+        return self._locks[hash(user_id) % len(self._locks)]
+    
+    def _record(self, user_id: str, event: str, *payload: Any):
+        """
+        每个写操作成功后在锁内调用一次（此时版本号已递增），默认什么也不做
+        
+        子类（如 core.journal.JournalTaskStore）据此按用户内的先后顺序记录变更
+        """
+    
+    def create_task(self, user_id: str, task: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock(user_id):
+            index = self.tasks.setdefault(user_id, TaskIndex())
+            task = {"id": index.next_id(), **task}
+            index.add(task)
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            self._record(user_id, "create", [task])
+        return task
+    
+    def create_tasks(self, user_id: str, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self._lock(user_id):
+            index = self.tasks.setdefault(user_id, TaskIndex())
+            created = []
+            for task in tasks:
+                task = {"id": index.next_id(), **task}
+                index.add(task)
+                created.append(task)
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            self._record(user_id, "create", created)
+        return created
+    
+    def get_task(self, user_id: str, task_id: str) -> Optional[Dict[str, Any]]:
+        index = self.tasks.get(user_id)
+        return index.get(task_id) if index is not None else None
+    
+    def list_tasks(self, user_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        index = self.tasks.get(user_id)
+        if index is None:
+            return []
+        # 遍历状态集合时若有并发写入会改变字典大小，因此在锁内取快照
+        with self._lock(user_id):
+            return index.list(status)
+    
+    def page_tasks(self, user_id: str, status: Optional[str] = None, after: Optional[Tuple[str, int]] = None,
+                   limit: int = 50, created_from: Optional[str] = None,
+                   created_to: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int]]]:
+        index = self.tasks.get(user_id)
+        if index is None:
+            return [], None
+        
+        # 内存存储主要用于测试，这里线性过滤即可；任务不会被删除，序号即创建序号 + 1，与 ID 一致
+        with self._lock(user_id):
+            keyed = [((t["created_at"], index.order[t["id"]] + 1), t) for t in index.list(status)]
+        keyed = [
+            (key, t) for key, t in keyed
+            if (after is None or key > tuple(after))
+            and (created_from is None or key[0] >= created_from)
+            and (created_to is None or key[0] < created_to)
+        ]
+        keyed.sort(key=lambda item: item[0])
+        page = keyed[:limit]
+        return [t for _, t in page], page[-1][0] if len(keyed) > limit else None
+    
+    def get_version(self, user_id: str) -> int:
+        return self.versions.get(user_id, 0)
+    
+    def complete_task(self, user_id: str, task_id: str, completed_at: str) -> Dict[str, Any]:
+        with self._lock(user_id):
+            index = self.tasks.get(user_id)
+            task = index.get(task_id) if index is not None else None
+            
+            if not task:
+                raise TaskNotFound()
+            
+            result = self._complete_locked(user_id, index, task, completed_at)
+            self._record(user_id, "complete", [task_id], completed_at, result["changed"])
+            return result
+    
+    def _complete_locked(self, user_id: str, index: TaskIndex, task: Dict[str, Any],
+                         completed_at: str) -> Dict[str, Any]:
+        if not index.compare_and_set(task, "pending", "completed"):
+            raise TaskAlreadyCompleted()
+        task["completed_at"] = completed_at
+        
+        stats, changed = apply_completion(self.user_stats.get(user_id), task, completed_at)
+        self.user_stats[user_id] = stats
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        return {"task": task, "stats": dict(stats), "changed": changed}
+    
+    def complete_tasks(self, user_id: str, task_ids: List[str], completed_at: str) -> Dict[str, Any]:
+        if len(set(task_ids)) != len(task_ids):
+            raise DuplicateTaskIds()
+        
+        with self._lock(user_id):
+            index = self.tasks.get(user_id)
+            tasks = [index.get(task_id) if index is not None else None for task_id in task_ids]
+            
+            # 先检查全部任务，再统一修改，保证全部成功或全部不变；检查与修改在同一次持锁内
+            if not all(tasks):
+                raise TaskNotFound()
+            if any(task["status"] != "pending" for task in tasks):
+                raise TaskAlreadyCompleted()
+            
+            for task in tasks:
+                index.set_status(task, "completed")
+                task["completed_at"] = completed_at
+            
+            stats, changed = apply_completions(self.user_stats.get(user_id), tasks, completed_at)
+            self.user_stats[user_id] = stats
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            self._record(user_id, "complete", task_ids, completed_at, changed)
+            return {"tasks": tasks, "stats": dict(stats), "changed": changed}
+    
+    def create_template(self, user_id: str, template: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock(user_id):
+            templates = self.templates.setdefault(user_id, {})
+            template = {"id": f"tmpl_{len(templates) + 1}", **template}
+            templates[template["id"]] = template
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            self._record(user_id, "template", template)
+        return template
+    
+    def get_template(self, user_id: str, template_id: str) -> Optional[Dict[str, Any]]:
+        return self.templates.get(user_id, {}).get(template_id)
+    
+    def list_templates(self, user_id: str) -> List[Dict[str, Any]]:
+        return list(self.templates.get(user_id, {}).values())
+    
+    def completed_occurrences(self, user_id: str, start: str, end: str) -> Dict[Tuple[str, str], str]:
+        with self._lock(user_id):
+            return {key: task_id for key, task_id in self.occurrences.get(user_id, {}).items()
+                    if start <= key[1] < end}
+    
+    def complete_occurrence(self, user_id: str, template_id: str, day: str, task: Dict[str, Any],
+                            completed_at: str) -> Dict[str, Any]:
+        with self._lock(user_id):
+            done = self.occurrences.setdefault(user_id, {})
+            if (template_id, day) in done:
+                raise TaskAlreadyCompleted()
+            
+            index = self.tasks.setdefault(user_id, TaskIndex())
+            task = {"id": index.next_id(), **task}
+            index.add(task)
+            done[(template_id, day)] = task["id"]
+            result = self._complete_locked(user_id, index, task, completed_at)
+            self._record(user_id, "occurrence", template_id, day, task, result["changed"])
+            return result
+    
+    def get_stats(self, user_id: str) -> Optional[Dict[str, Any]]:
+        stats = self.user_stats.get(user_id)
+        return dict(stats) if stats is not None else None
+    
+    def iter_stats(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # 先取用户列表的快照，再逐个用户在其分段锁内复制，不会同时持有多把锁
+        items = []
+        for user_id in list(self.user_stats):
+            with self._lock(user_id):
+                items.append((user_id, dict(self.user_stats[user_id])))
+        return iter(items)
+    
+    def iter_completions(self, since: str) -> Iterator[Tuple[str, str, int]]:
+        rows = []
+        for user_id, index in list(self.tasks.items()):
+            with self._lock(user_id):
+                rows.extend((user_id, task["completed_at"], task["reward_exp"] or 0)
+                            for task in index.list("completed") if task["completed_at"] >= since)
+        rows.sort(key=lambda row: row[1])
+        return iter(rows)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    user_id        TEXT    NOT NULL,
+    id             TEXT    NOT NULL,
+    seq            INTEGER NOT NULL,
+    title          TEXT,
+    description    TEXT,
+    difficulty     INTEGER,
+    estimated_time INTEGER,
+    reward_exp     INTEGER,
+    status         TEXT    NOT NULL,
+    created_at     TEXT    NOT NULL,
+    completed_at   TEXT,
+    rewards        TEXT,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_status_created ON tasks (user_id, status, created_at, seq);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at, seq);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id         TEXT PRIMARY KEY,
+    task_seq        INTEGER NOT NULL DEFAULT 0,
+    tasks_completed INTEGER NOT NULL DEFAULT 0,
+    total_exp       INTEGER NOT NULL DEFAULT 0,
+    streak_days     INTEGER NOT NULL DEFAULT 0,
+    best_streak     INTEGER NOT NULL DEFAULT 0,
+    last_active     TEXT,
+    int_total       INTEGER NOT NULL DEFAULT 0,
+    vit_total       INTEGER NOT NULL DEFAULT 0,
+    version         INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS task_templates (
+    user_id        TEXT    NOT NULL,
+    id             TEXT    NOT NULL,
+    seq            INTEGER NOT NULL,
+    title          TEXT,
+    description    TEXT,
+    difficulty     INTEGER,
+    estimated_time INTEGER,
+    reward_exp     INTEGER,
+    rewards        TEXT,
+    rule           TEXT    NOT NULL,
+    created_at     TEXT    NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+-- 只记录已完成的周期任务实例，未完成的实例按规则在查询时展开
+CREATE TABLE IF NOT EXISTS template_occurrences (
+    user_id     TEXT NOT NULL,
+    template_id TEXT NOT NULL,
+    day         TEXT NOT NULL,
+    task_id     TEXT NOT NULL,
+    PRIMARY KEY (user_id, template_id, day)
+);
+CREATE INDEX IF NOT EXISTS idx_occurrences_user_day ON template_occurrences (user_id, day);
+"""
+
+# 旧版本数据库缺少的列，启动时补齐：(表, 列, 定义)
+_MIGRATIONS = (
+    ("tasks", "rewards", "TEXT"),
+    ("user_stats", "streak_days", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_stats", "best_streak", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_stats", "last_active", "TEXT"),
+    ("user_stats", "int_total", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_stats", "vit_total", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_stats", "version", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+# SQL 保持为模块级常量：sqlite3 按 SQL 文本缓存预编译语句，重复执行时不再解析
+_TASK_COLUMNS = ("id", "title", "description", "difficulty", "estimated_time",
+                 "reward_exp", "status", "created_at", "completed_at", "rewards")
+_SELECT_TASK = f"SELECT {', '.join(_TASK_COLUMNS)} FROM tasks"
+_SQL_GET_TASK = f"{_SELECT_TASK} WHERE user_id = ? AND id = ?"
+_SQL_LIST_TASKS = f"{_SELECT_TASK} WHERE user_id = ? ORDER BY created_at, seq"
+_SQL_LIST_TASKS_BY_STATUS = f"{_SELECT_TASK} WHERE user_id = ? AND status = ? ORDER BY created_at, seq"
+# 键集分页：行值比较 (created_at, seq) > (?, ?) 可以直接利用 (user_id, [status,] created_at, seq) 索引定位
+_PAGE_FILTER = "created_at >= ? AND created_at < ? AND (created_at, seq) > (?, ?) ORDER BY created_at, seq LIMIT ?"
+_SELECT_TASK_SEQ = f"SELECT seq, {', '.join(_TASK_COLUMNS)} FROM tasks"
+_SQL_PAGE_TASKS = f"{_SELECT_TASK_SEQ} WHERE user_id = ? AND {_PAGE_FILTER}"
+_SQL_PAGE_TASKS_BY_STATUS = f"{_SELECT_TASK_SEQ} WHERE user_id = ? AND status = ? AND {_PAGE_FILTER}"
+_SQL_NEXT_SEQ = ("INSERT INTO user_stats (user_id, task_seq, version) VALUES (?, 1, 1) "
+                 "ON CONFLICT (user_id) DO UPDATE SET task_seq = task_seq + 1, version = version + 1 "
+                 "RETURNING task_seq")
+_SQL_GET_VERSION = "SELECT version FROM user_stats WHERE user_id = ?"
+_SQL_INSERT_TASK = (f"INSERT INTO tasks (user_id, seq, {', '.join(_TASK_COLUMNS)}) "
+                    f"VALUES (?, ?, {', '.join('?' * len(_TASK_COLUMNS))})")
+_SQL_MARK_COMPLETED = ("UPDATE tasks SET status = 'completed', completed_at = ? "
+                       "WHERE user_id = ? AND id = ? AND status = 'pending' RETURNING id")
+_SQL_READ_STATS = f"SELECT {', '.join(STAT_FIELDS)} FROM user_stats WHERE user_id = ?"
+_SQL_WRITE_STATS = (f"UPDATE user_stats SET {', '.join(f'{f} = ?' for f in STAT_FIELDS)}, "
+                    "version = version + 1 WHERE user_id = ?")
+_SQL_GET_STATS = f"{_SQL_READ_STATS} AND tasks_completed > 0"
+_SQL_ALL_STATS = f"SELECT user_id, {', '.join(STAT_FIELDS)} FROM user_stats WHERE tasks_completed > 0"
+_SQL_COMPLETIONS_SINCE = ("SELECT user_id, completed_at, COALESCE(reward_exp, 0) FROM tasks "
+                          "WHERE status = 'completed' AND completed_at >= ? ORDER BY completed_at")
+_TEMPLATE_COLUMNS = ("id", "title", "description", "difficulty", "estimated_time", "reward_exp",
+                     "rewards", "rule", "created_at")
+_SELECT_TEMPLATE = f"SELECT {', '.join(_TEMPLATE_COLUMNS)} FROM task_templates"
+_SQL_GET_TEMPLATE = f"{_SELECT_TEMPLATE} WHERE user_id = ? AND id = ?"
+_SQL_LIST_TEMPLATES = f"{_SELECT_TEMPLATE} WHERE user_id = ? ORDER BY seq"
+_SQL_NEXT_TEMPLATE_SEQ = "SELECT COALESCE(MAX(seq), 0) + 1 FROM task_templates WHERE user_id = ?"
+_SQL_INSERT_TEMPLATE = (f"INSERT INTO task_templates (user_id, seq, {', '.join(_TEMPLATE_COLUMNS)}) "
+                        f"VALUES (?, ?, {', '.join('?' * len(_TEMPLATE_COLUMNS))})")
+_SQL_BUMP_VERSION = ("INSERT INTO user_stats (user_id, version) VALUES (?, 1) "
+                     "ON CONFLICT (user_id) DO UPDATE SET version = version + 1")
+_SQL_OCCURRENCES = "SELECT template_id, day, task_id FROM template_occurrences WHERE user_id = ? AND day >= ? AND day < ?"
+_SQL_INSERT_OCCURRENCE = "INSERT INTO template_occurrences (user_id, template_id, day, task_id) VALUES (?, ?, ?, ?)"
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite 持久化存储（WAL 模式）
+    
+    - 读：每个线程一个连接，WAL 下读写互不阻塞，多个 uvicorn worker 可共享同一个数据库文件
+    - 写：所有写操作交给单个写线程，写线程把同时排队的操作合并到一个事务中提交（group commit），
+      每个操作包在独立的 SAVEPOINT 中，单个操作失败不会影响同批的其它操作
+    - 并发：任务 ID 由 user_stats.task_seq 原子递增分配（_SQL_NEXT_SEQ），完成任务是带 status 条件的
+      UPDATE ... RETURNING，二者都是单条语句内的比较并设置，不依赖写线程串行也不会重复
+    """
+    
+    def __init__(self, db_path: str, max_batch: int = 256, batch_wait: float = 0.001):
+        """
+        Args:
+            db_path: 数据库文件路径
+            max_batch: 单个事务最多合并的写操作数，1 表示不合并
+            batch_wait: 收到第一个写操作后，最多再等待多少秒收集同批操作
+        """
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        self._migrate(conn)
+        conn.close()
+        
+        self._local = threading.local()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # 每次提交都 fsync；批量提交把这部分开销分摊到整批写操作上
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        for table, column, definition in _MIGRATIONS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+    
+    def _submit(self, op: Callable[[sqlite3.Connection], Any]) -> Any:
+        """把写操作交给写线程，阻塞直到所在批次提交"""
+        future: Future = Future()
+        self._queue.put((op, future))
+        return future.result()
+    
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            self._run_batch(conn, batch)
+            if stop:
+                break
+        conn.close()
+    
+    @staticmethod
+    def _run_batch(conn: sqlite3.Connection, batch: List[tuple]):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op, _ in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((True, op(conn)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(False, e)] * len(batch)
+        
+        for (_, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+    
+    @staticmethod
+    def _row_to_task(row: tuple) -> Dict[str, Any]:
+        task = dict(zip(_TASK_COLUMNS, row))
+        task["rewards"] = json.loads(task["rewards"]) if task["rewards"] else None
+        return task
+    
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, user_id: str, task: Dict[str, Any]) -> Dict[str, Any]:
+        (seq,) = conn.execute(_SQL_NEXT_SEQ, (user_id,)).fetchone()
+        row = {"id": f"task_{seq}", **task}
+        values = {**row, "rewards": json.dumps(row["rewards"]) if row.get("rewards") else None}
+        conn.execute(_SQL_INSERT_TASK, (user_id, seq, *(values.get(c) for c in _TASK_COLUMNS)))
+        return row
+    
+    def create_task(self, user_id: str, task: Dict[str, Any]) -> Dict[str, Any]:
+        return self._submit(lambda conn: self._insert(conn, user_id, task))
+    
+    def create_tasks(self, user_id: str, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # 整批在同一个 SAVEPOINT 中执行，任一条失败则整批回滚
+        return self._submit(lambda conn: [self._insert(conn, user_id, task) for task in tasks])
+    
+    def get_task(self, user_id: str, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute(_SQL_GET_TASK, (user_id, task_id)).fetchone()
+        return self._row_to_task(row) if row else None
+    
+    def list_tasks(self, user_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        if status:
+            rows = self._reader().execute(_SQL_LIST_TASKS_BY_STATUS, (user_id, status))
+        else:
+            rows = self._reader().execute(_SQL_LIST_TASKS, (user_id,))
+        return [self._row_to_task(row) for row in rows]
+    
+    def page_tasks(self, user_id: str, status: Optional[str] = None, after: Optional[Tuple[str, int]] = None,
+                   limit: int = 50, created_from: Optional[str] = None,
+                   created_to: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int]]]:
+        # 未指定的边界用不会出现在 ISO 时间中的极值代替，保证 SQL 文本固定
+        after_at, after_seq = after if after is not None else ("", 0)
+        bounds = (created_from or "", created_to or "\uffff", after_at, after_seq, limit + 1)
+        if status:
+            rows = self._reader().execute(_SQL_PAGE_TASKS_BY_STATUS, (user_id, status, *bounds)).fetchall()
+        else:
+            rows = self._reader().execute(_SQL_PAGE_TASKS, (user_id, *bounds)).fetchall()
+        
+        page = rows[:limit]
+        tasks = [self._row_to_task(row[1:]) for row in page]
+        return tasks, (tasks[-1]["created_at"], page[-1][0]) if len(rows) > limit else None
+    
+    def get_version(self, user_id: str) -> int:
+        row = self._reader().execute(_SQL_GET_VERSION, (user_id,)).fetchone()
+        return row[0] if row else 0
+    
+    def _mark_completed(self, conn: sqlite3.Connection, user_id: str, task_id: str,
+                        completed_at: str) -> Dict[str, Any]:
+        updated = conn.execute(_SQL_MARK_COMPLETED, (completed_at, user_id, task_id)).fetchone()
+        if updated is None:
+            if conn.execute(_SQL_GET_TASK, (user_id, task_id)).fetchone() is None:
+                raise TaskNotFound()
+            raise TaskAlreadyCompleted()
+        return self._row_to_task(conn.execute(_SQL_GET_TASK, (user_id, task_id)).fetchone())
+    
+    @staticmethod
+    def _add_completion(conn: sqlite3.Connection, user_id: str, task: Dict[str, Any],
+                        completed_at: str) -> Dict[str, Any]:
+        # 统计行在创建任务时已由 _SQL_NEXT_SEQ 建好，这里只读改写该用户的一行
+        row = conn.execute(_SQL_READ_STATS, (user_id,)).fetchone()
+        stats, changed = apply_completion(dict(zip(STAT_FIELDS, row)), task, completed_at)
+        conn.execute(_SQL_WRITE_STATS, (*(stats[f] for f in STAT_FIELDS), user_id))
+        return {"task": task, "stats": stats, "changed": changed}
+    
+    def complete_task(self, user_id: str, task_id: str, completed_at: str) -> Dict[str, Any]:
+        def op(conn: sqlite3.Connection) -> Dict[str, Any]:
+            task = self._mark_completed(conn, user_id, task_id, completed_at)
+            return self._add_completion(conn, user_id, task, completed_at)
+        
+        return self._submit(op)
+    
+    def complete_tasks(self, user_id: str, task_ids: List[str], completed_at: str) -> Dict[str, Any]:
+        if len(set(task_ids)) != len(task_ids):
+            raise DuplicateTaskIds()
+        
+        def op(conn: sqlite3.Connection) -> Dict[str, Any]:
+            # 任一任务失败时异常使整个 SAVEPOINT 回滚；统计只读写一次
+            tasks = [self._mark_completed(conn, user_id, task_id, completed_at) for task_id in task_ids]
+            row = conn.execute(_SQL_READ_STATS, (user_id,)).fetchone()
+            stats, changed = apply_completions(dict(zip(STAT_FIELDS, row)), tasks, completed_at)
+            conn.execute(_SQL_WRITE_STATS, (*(stats[f] for f in STAT_FIELDS), user_id))
+            return {"tasks": tasks, "stats": stats, "changed": changed}
+        
+        return self._submit(op)
+    
+    @staticmethod
+    def _row_to_template(row: tuple) -> Dict[str, Any]:
+        template = dict(zip(_TEMPLATE_COLUMNS, row))
+        template["rewards"] = json.loads(template["rewards"]) if template["rewards"] else None
+        template["rule"] = json.loads(template["rule"])
+        return template
+    
+    def create_template(self, user_id: str, template: Dict[str, Any]) -> Dict[str, Any]:
+        def op(conn: sqlite3.Connection) -> Dict[str, Any]:
+            (seq,) = conn.execute(_SQL_NEXT_TEMPLATE_SEQ, (user_id,)).fetchone()
+            row = {"id": f"tmpl_{seq}", **template}
+            values = {**row, "rewards": json.dumps(row["rewards"]) if row.get("rewards") else None,
+                      "rule": json.dumps(row["rule"])}
+            conn.execute(_SQL_INSERT_TEMPLATE, (user_id, seq, *(values.get(c) for c in _TEMPLATE_COLUMNS)))
+            conn.execute(_SQL_BUMP_VERSION, (user_id,))
+            return row
+        
+        return self._submit(op)
+    
+    def get_template(self, user_id: str, template_id: str) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute(_SQL_GET_TEMPLATE, (user_id, template_id)).fetchone()
+        return self._row_to_template(row) if row else None
+    
+    def list_templates(self, user_id: str) -> List[Dict[str, Any]]:
+        return [self._row_to_template(row) for row in self._reader().execute(_SQL_LIST_TEMPLATES, (user_id,))]
+    
+    def completed_occurrences(self, user_id: str, start: str, end: str) -> Dict[Tuple[str, str], str]:
+        rows = self._reader().execute(_SQL_OCCURRENCES, (user_id, start, end))
+        return {(template_id, day): task_id for template_id, day, task_id in rows}
+    
+    def complete_occurrence(self, user_id: str, template_id: str, day: str, task: Dict[str, Any],
+                            completed_at: str) -> Dict[str, Any]:
+        def op(conn: sqlite3.Connection) -> Dict[str, Any]:
+            row = self._insert(conn, user_id, task)
+            try:
+                conn.execute(_SQL_INSERT_OCCURRENCE, (user_id, template_id, day, row["id"]))
+            except sqlite3.IntegrityError:
+                # 抛出异常会回滚本操作的 SAVEPOINT，刚插入的任务一并撤销
+                raise TaskAlreadyCompleted()
+            completed = self._mark_completed(conn, user_id, row["id"], completed_at)
+            return self._add_completion(conn, user_id, completed, completed_at)
+        
+        return self._submit(op)
+    
+    def get_stats(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute(_SQL_GET_STATS, (user_id,)).fetchone()
+        return dict(zip(STAT_FIELDS, row)) if row else None
+    
+    def iter_stats(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for row in self._reader().execute(_SQL_ALL_STATS):
+            yield row[0], dict(zip(STAT_FIELDS, row[1:]))
+    
+    def iter_completions(self, since: str) -> Iterator[Tuple[str, str, int]]:
+        return iter(self._reader().execute(_SQL_COMPLETIONS_SINCE, (since,)).fetchall())
+    
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+
+def create_store() -> TaskStore:
+    """
+    根据环境变量创建存储后端
+    
+    TASK_STORE: sqlite（默认）/ memory / journal
+    TASK_DB_PATH: SQLite 数据库文件路径，默认 backend/data/lifeos.db
+    TASK_JOURNAL_DIR: journal 存储的日志目录，默认 backend/data/journal
+    """
+    kind = os.getenv("TASK_STORE", "sqlite").lower()
+    if kind == "memory":
+        return MemoryTaskStore()
+    if kind == "journal":
+        from core.journal import JournalTaskStore
+        default_dir = os.path.join(os.path.dirname(__file__), "../data/journal")
+        return JournalTaskStore(os.getenv("TASK_JOURNAL_DIR", default_dir))
+    
+    default_path = os.path.join(os.path.dirname(__file__), "../data/lifeos.db")
+    return SQLiteTaskStore(os.getenv("TASK_DB_PATH", default_path))
+
+
+if __name__ == "__main__":
+    # 写吞吐基准：python -m core.storage
+    # 模拟线程池中的并发 POST /tasks，对比内存存储、逐条提交与批量提交的 SQLite
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    
+    workers, per_worker = 32, 300
+    
+    def run(store: TaskStore) -> float:
+        def worker(w: int):
+            for i in range(per_worker):
+                store.create_task(f"user_{w}", {"title": f"任务{i}", "reward_exp": 10,
+                                                "status": "pending", "created_at": f"{i:08d}"})
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(worker, range(workers)))
+        elapsed = time.perf_counter() - start
+        store.close()
+        return workers * per_worker / elapsed
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"memory           : {run(MemoryTaskStore()):10.0f} 写/秒")
+        print(f"sqlite 逐条提交  : {run(SQLiteTaskStore(os.path.join(tmp, 'a.db'), max_batch=1, batch_wait=0)):10.0f} 写/秒")
+        print(f"sqlite 批量提交  : {run(SQLiteTaskStore(os.path.join(tmp, 'b.db'))):10.0f} 写/秒")
@@ -2,17 +2,32 @@
 任务管理器
 负责任务的创建、完成、统计等逻辑
 """
-from typing import Dict, List, Any
-from datetime import datetime
+import base64
+import json
+from typing import Dict, List, Any, Optional
+from datetime import date, datetime, timedelta
+
+from core.metrics import FAST_BUCKETS, REGISTRY
+from core.recurrence import RecurrenceRule
+from core.stats_engine import current_streak, empty_stats
+from core.storage import TaskStore, MemoryTaskStore, TaskNotFound, create_store
+
+
+# 周期任务实例的 ID：模板ID@日期，如 tmpl_1@2026-01-05
+OCCURRENCE_SEP = "@"
+# 一次最多展开的日期范围
+MAX_OCCURRENCE_WINDOW = timedelta(days=366)
+
+OP_LATENCY = REGISTRY.histogram("lifeos_task_op_duration_seconds", "TaskManager 操作耗时", ("op",), FAST_BUCKETS)
 
 
 class TaskManager:
-    """任务管理器（临时内存存储，后续可换成数据库）"""
+    """任务管理器（数据读写委托给可替换的 TaskStore）"""
     
-    def __init__(self):
-        self.tasks: Dict[str, List[Dict]] = {}  # {user_id: [tasks]}
-        self.user_stats: Dict[str, Dict] = {}   # {user_id: stats}
+    def __init__(self, store: Optional[TaskStore] = None):
+        self.store = store if store is not None else MemoryTaskStore()
     
+    @OP_LATENCY.timed("create_task")
     def create_task(self, user_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         创建任务
@@ -24,24 +39,38 @@ class TaskManager:
         Returns:
             创建的任务
         """
-        if user_id not in self.tasks:
-            self.tasks[user_id] = []
+        return self.store.create_task(user_id, self._new_task(task_data, datetime.now().isoformat()))
+    
+    @OP_LATENCY.timed("create_tasks")
+    def create_tasks(self, user_id: str, tasks_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        批量创建任务（一次存储操作，全部成功或全部失败）
         
-        task = {
-            "id": f"task_{len(self.tasks[user_id]) + 1}",
+        Args:
+            user_id: 用户ID
+            tasks_data: 任务数据列表
+            
+        Returns:
+            创建的任务列表，顺序与输入一致
+        """
+        created_at = datetime.now().isoformat()
+        return self.store.create_tasks(user_id, [self._new_task(data, created_at) for data in tasks_data])
+    
+    @staticmethod
+    def _new_task(task_data: Dict[str, Any], created_at: str) -> Dict[str, Any]:
+        return {
             "title": task_data.get("title"),
             "description": task_data.get("description"),
             "difficulty": task_data.get("difficulty", 3),
             "estimated_time": task_data.get("estimated_time", 30),
             "reward_exp": task_data.get("reward_exp", 50),
+            "rewards": task_data.get("rewards"),
             "status": "pending",
-            "created_at": datetime.now().isoformat(),
+            "created_at": created_at,
             "completed_at": None
         }
-        
-        self.tasks[user_id].append(task)
-        return task
     
+    @OP_LATENCY.timed("get_tasks")
     def get_tasks(self, user_id: str, status: str = None) -> List[Dict]:
         """
         获取任务列表
@@ -53,16 +82,39 @@ class TaskManager:
         Returns:
             任务列表
         """
-        if user_id not in self.tasks:
-            return []
-        
-        tasks = self.tasks[user_id]
-        
-        if status:
-            tasks = [t for t in tasks if t["status"] == status]
+        return self.store.list_tasks(user_id, status)
+    
+    @OP_LATENCY.timed("get_tasks_page")
+    def get_tasks_page(self, user_id: str, status: Optional[str] = None, cursor: Optional[str] = None,
+                       limit: int = 50, created_from: Optional[str] = None,
+                       created_to: Optional[str] = None) -> Dict[str, Any]:
+        """
+        分页获取任务列表（按创建时间排序）
         
-        return tasks
+        Args:
+            user_id: 用户ID
+            status: 筛选状态
+            cursor: 上一页返回的 next_cursor，为空表示第一页
+            limit: 每页数量
+            created_from: 创建时间下限（含，ISO 格式）
+            created_to: 创建时间上限（不含，ISO 格式）
+            
+        Returns:
+            {"tasks": 本页任务, "next_cursor": 下一页游标，没有下一页时为 None}
+            
+        Raises:
+            ValueError: 游标无效
+        """
+        after = _decode_cursor(cursor) if cursor else None
+        tasks, last = self.store.page_tasks(user_id, status, after, limit, created_from, created_to)
+        return {"tasks": tasks, "next_cursor": _encode_cursor(last) if last else None}
+    
+    @OP_LATENCY.timed("get_version")
+    def get_version(self, user_id: str) -> int:
+        """用户数据版本号，任务或统计有任何变化都会递增"""
+        return self.store.get_version(user_id)
     
+    @OP_LATENCY.timed("complete_task")
     def complete_task(self, user_id: str, task_id: str) -> Dict[str, Any]:
         """
         完成任务
@@ -72,43 +124,169 @@ class TaskManager:
             task_id: 任务ID
             
         Returns:
-            完成结果（包含经验值奖励）
+            完成结果（包含经验值奖励，以及本次变化的统计指标 changed）
+            
+        Raises:
+            ValueError: 任务不存在或已完成
+        """
+        # 标记完成并更新用户统计（存储层保证两者原子完成）
+        completed_at = datetime.now().isoformat()
+        if OCCURRENCE_SEP in task_id:
+            result = self._complete_occurrence(user_id, task_id, completed_at)
+        else:
+            result = self.store.complete_task(user_id, task_id, completed_at)
+        task, stats = result["task"], result["stats"]
+        
+        return {
+            "task": task,
+            "exp_gained": task["reward_exp"],
+            "total_exp": stats["total_exp"],
+            "tasks_completed": stats["tasks_completed"],
+            "stats": stats,
+            "changed": result["changed"]
+        }
+    
+    @OP_LATENCY.timed("complete_tasks")
+    def complete_tasks(self, user_id: str, task_ids: List[str]) -> Dict[str, Any]:
+        """
+        批量完成任务（一次存储操作，全部成功或全部失败）
+        
+        Returns:
+            完成结果，exp_gained 与 changed 为整批合计
+            
+        Raises:
+            ValueError: 任务ID重复、任一任务不存在或已完成
         """
-        tasks = self.tasks.get(user_id, [])
-        task = next((t for t in tasks if t["id"] == task_id), None)
+        result = self.store.complete_tasks(user_id, task_ids, datetime.now().isoformat())
+        stats = result["stats"]
         
-        if not task:
-            raise ValueError("任务不存在")
+        return {
+            "tasks": result["tasks"],
+            "exp_gained": sum(task["reward_exp"] or 0 for task in result["tasks"]),
+            "total_exp": stats["total_exp"],
+            "tasks_completed": stats["tasks_completed"],
+            "stats": stats,
+            "changed": result["changed"]
+        }
+    
+    @OP_LATENCY.timed("create_template")
+    def create_template(self, user_id: str, task_data: Dict[str, Any], rule: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        创建周期任务模板，代替逐个创建每次发生的任务
         
-        if task["status"] == "completed":
-            raise ValueError("任务已完成")
+        Args:
+            user_id: 用户ID
+            task_data: 任务数据（同 create_task）
+            rule: 重复规则，见 core.recurrence.RecurrenceRule
+            
+        Raises:
+            ValueError: 重复规则无效
+        """
+        template = self._new_task(task_data, datetime.now().isoformat())
+        for key in ("status", "completed_at"):
+            template.pop(key)
+        template["rule"] = RecurrenceRule.from_dict(rule).to_dict()
+        return self.store.create_template(user_id, template)
+    
+    @OP_LATENCY.timed("get_templates")
+    def get_templates(self, user_id: str) -> List[Dict]:
+        """获取周期任务模板列表"""
+        return self.store.list_templates(user_id)
+    
+    @OP_LATENCY.timed("get_occurrences")
+    def get_occurrences(self, user_id: str, start: date, end: date) -> List[Dict[str, Any]]:
+        """
+        展开 [start, end) 内周期任务的实例
         
-        # 标记完成
-        task["status"] = "completed"
-        task["completed_at"] = datetime.now().isoformat()
+        实例只在查询时按规则生成，已完成的实例由存储中稀疏记录的 (模板, 日期) 标出。
         
-        # 更新用户统计
-        if user_id not in self.user_stats:
-            self.user_stats[user_id] = {"tasks_completed": 0, "total_exp": 0}
+        Returns:
+            按日期排序的实例列表，id 形如 tmpl_1@2026-01-05，可直接用于完成任务
+            
+        Raises:
+            ValueError: 日期范围无效或过大
+        """
+        if end <= start or end - start > MAX_OCCURRENCE_WINDOW:
+            raise ValueError(f"日期范围须为 1 到 {MAX_OCCURRENCE_WINDOW.days} 天")
         
-        self.user_stats[user_id]["tasks_completed"] += 1
-        self.user_stats[user_id]["total_exp"] += task["reward_exp"]
+        done = self.store.completed_occurrences(user_id, start.isoformat(), end.isoformat())
+        instances = []
+        for template in self.store.list_templates(user_id):
+            rule = RecurrenceRule.from_dict(template["rule"])
+            for day in rule.occurrences(start, end):
+                key = (template["id"], day.isoformat())
+                instances.append({
+                    **{k: v for k, v in template.items() if k not in ("id", "rule", "created_at")},
+                    "id": OCCURRENCE_SEP.join(key),
+                    "template_id": template["id"],
+                    "date": key[1],
+                    "status": "completed" if key in done else "pending",
+                    "task_id": done.get(key)
+                })
+        instances.sort(key=lambda t: t["date"])
+        return instances
+    
+    def _complete_occurrence(self, user_id: str, occurrence_id: str, completed_at: str) -> Dict[str, Any]:
+        template_id, _, day = occurrence_id.partition(OCCURRENCE_SEP)
+        template = self.store.get_template(user_id, template_id)
+        try:
+            valid = template is not None and RecurrenceRule.from_dict(template["rule"]).includes(date.fromisoformat(day))
+        except ValueError:
+            valid = False
+        if not valid:
+            raise TaskNotFound()
         
-        return {
-            "task": task,
-            "exp_gained": task["reward_exp"],
-            "total_exp": self.user_stats[user_id]["total_exp"],
-            "tasks_completed": self.user_stats[user_id]["tasks_completed"]
-        }
+        task = self._new_task(template, completed_at)
+        return self.store.complete_occurrence(user_id, template_id, day, task, completed_at)
     
+    @OP_LATENCY.timed("get_user_stats")
     def get_user_stats(self, user_id: str) -> Dict[str, Any]:
-        """获取用户统计数据"""
-        return self.user_stats.get(user_id, {
-            "tasks_completed": 0,
-            "total_exp": 0,
-            "streak_days": 0
-        })
+        """获取用户统计数据（连续天数按今天重新判断是否已中断）"""
+        stats = self.store.get_stats(user_id) or empty_stats()
+        stats["streak_days"] = current_streak(stats, date.today())
+        return stats
+
+
+def _encode_cursor(key) -> str:
+    """游标对客户端不透明：(created_at, seq) 的 URL 安全 base64"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, seq = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), int(seq)
+    except (ValueError, TypeError):
+        raise ValueError("无效的分页游标")
 
 
 # 全局实例
-task_manager = TaskManager()
+task_manager = TaskManager(create_store())
+
+
+if __name__ == "__main__":
+    # 微基准：python -m core.task_manager
+    # 对比旧的线性扫描实现与索引实现在单用户 N 个任务时的耗时
+    import timeit
+    
+    n = 20000
+    manager = TaskManager(MemoryTaskStore())
+    for i in range(n):
+        manager.create_task("bench", {"title": f"任务{i}", "reward_exp": 10})
+    # 典型的长期用户：大部分任务已完成，只有少量待办
+    for i in range(1, n + 1):
+        if i % 100:
+            manager.complete_task("bench", f"task_{i}")
+    
+    index = manager.store.tasks["bench"]
+    flat = list(index)
+    last_id = f"task_{n}"
+    rounds = 200
+    
+    scan = timeit.timeit(lambda: next(t for t in flat if t["id"] == last_id), number=rounds)
+    lookup = timeit.timeit(lambda: index.get(last_id), number=rounds)
+    print(f"按ID查找  线性扫描: {scan / rounds * 1e6:10.1f} us   索引: {lookup / rounds * 1e6:10.1f} us")
+    
+    scan = timeit.timeit(lambda: [t for t in flat if t["status"] == "pending"], number=rounds)
+    view = timeit.timeit(lambda: manager.get_tasks("bench", "pending"), number=rounds)
+    print(f"状态筛选  线性扫描: {scan / rounds * 1e6:10.1f} us   索引: {view / rounds * 1e6:10.1f} us")
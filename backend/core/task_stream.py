@@ -0,0 +1,121 @@
+"""
+增量 JSON 解析
+从流式输出的文本中，在每个任务对象闭合时立即把它解析出来，而不必等待整段 JSON 结束
+"""
+import os
+import sys
+from typing import Dict, List, Any, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../model'))
+from resilience import ResponseParseError
+from structured_output import coerce_task, load_json
+
+
+class TaskStreamParser:
+    """
+    增量解析 {"tasks": [{...}, {...}]} 结构中的任务对象；顶层直接是任务数组 [{...}, {...}] 时同样解析
+    （与 structured_output.parse_task_plan 的 wrapped 处理一致）
+    
+    逐字符扫描新到达的文本，跟踪嵌套深度与字符串状态；
+    当位于 tasks 数组中的某个对象闭合时，解析该对象并返回。
+    第一个 { 或 [ 之前、顶层 JSON 闭合之后的文字（说明文字、```json 代码块标记）不参与扫描，
+    其中不成对的引号不会影响解析。
+    每个对象按 structured_output 容错解析并校验，被纠正的字段记录在 coerced 中，无法修复的对象记录在 dropped 中。
+    
+    用法:
+        parser = TaskStreamParser()
+        for chunk in stream:
+            for task in parser.feed(chunk):
+                ...
+    """
+    
+    def __init__(self, key: str = "tasks"):
+        self.key = key
+        self.text = ""                      # 已接收的全部文本
+        self._pos = 0                       # 下一个待扫描的位置
+        self._depth = 0                     # 当前嵌套深度（{ 与 [ 都计入）
+        self._started = False               # 是否已遇到第一个 { 或 [
+        self._finished = False              # 顶层 JSON 是否已闭合
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key: Optional[str] = None    # 最近一个位于顶层对象中的字符串
+        self._array_depth: Optional[int] = None # tasks 数组所在的深度
+        self._item_start: Optional[int] = None  # 当前任务对象的起始位置
+        self._items = 0                         # 已闭合的任务对象数（含被丢弃的）
+        self.tasks: List[Dict[str, Any]] = []
+        self.coerced: List[Dict[str, Any]] = []
+        self.dropped: List[Dict[str, Any]] = []
+    
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        输入新的文本片段
+        
+        Args:
+            chunk: 新到达的文本
+            
+        Returns:
+            本次新闭合的任务对象列表
+        """
+        self.text += chunk
+        completed = []
+        text = self.text
+        
+        for i in range(self._pos, len(text)):
+            if self._finished:
+                break
+            ch = text[i]
+            if not self._started:
+                if ch not in "{[":
+                    continue
+                self._started = True
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start:i]
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and (self._depth == 1 or self._depth == 2 and self._last_key == self.key):
+                    self._array_depth = self._depth
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = i
+            elif ch in "}]":
+                if ch == "}" and self._item_start is not None and self._depth == self._array_depth + 1:
+                    task = self._parse(text[self._item_start:i + 1])
+                    if task is not None:
+                        completed.append(task)
+                    self._item_start = None
+                elif ch == "]" and self._depth == self._array_depth:
+                    self._array_depth = None
+                self._depth = max(self._depth - 1, 0)
+                self._finished = self._depth == 0
+        
+        self._pos = len(text)
+        self.tasks.extend(completed)
+        return completed
+    
+    def _parse(self, raw: str) -> Optional[Dict[str, Any]]:
+        path = f"tasks[{self._items}]"
+        self._items += 1
+        try:
+            task, _ = load_json(raw)
+        except ResponseParseError as e:
+            self.dropped.append({"field": path, "error": str(e)})
+            return None
+        model, fixes, error = coerce_task(task, path)
+        self.coerced.extend(fixes)
+        if model is None:
+            self.dropped.append({"field": path, "error": error})
+            return None
+        return model.model_dump(exclude_none=True)
@@ -0,0 +1,172 @@
+"""
+重试、退避、重试预算与熔断：通过注入故障的模拟上游（benchmarks.mock_llm_server）驱动真实的 LLMClient
+"""
+import time
+
+import pytest
+
+from benchmarks.mock_llm_server import MockLLMServer
+from core.llm_client import LLMClient, _parse_tasks
+from core.rate_limiter import usage_tokens
+from resilience import CircuitOpenError, Resilience, UpstreamError
+from router import ModelRouter
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = MockLLMServer(delay=0.0, content="好的").start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def reset_faults(server):
+    server.error_rate, server.error_status, server.garbage_rate = 0.0, 503, 0.0
+    server.requests = 0
+
+
+def make_client(server, **options) -> LLMClient:
+    # 退避很短，让测试在毫秒级完成；单模型、不对冲，熔断器名称固定为 mock
+    settings = dict(max_attempts=3, base_delay=0.001, max_delay=0.005, failure_threshold=1.1)
+    settings.update(options)
+    resilience = Resilience(**settings)
+    router = ModelRouter({"mock": {"cost": 1.0}}, {"chat": {"slo": 1.0, "models": ["mock"]}},
+                         hedge=False, resilience=resilience)
+    return LLMClient("key", server.url, resilience=resilience, router=router)
+
+
+def test_transient_errors_are_retried_until_max_attempts(server):
+    client = make_client(server)
+    server.error_rate = 1.0
+
+    result = client.chat(MESSAGES)
+
+    assert "error" in result
+    assert server.requests == 3
+    assert client.resilience.counters["retries"] == 2
+    assert client.resilience.counters["failures"] == 1
+
+
+def test_retry_recovers_from_intermittent_errors():
+    # 独立的上游与固定种子：故障序列确定，不受其它测试消耗随机数的影响
+    server = MockLLMServer(delay=0.0, content="好的", error_rate=0.3, seed=1).start()
+    try:
+        # 预算放宽到每次调用都能重试，只考察重试本身
+        client = make_client(server, max_attempts=5, budget_ratio=1.0, budget_min_per_sec=50.0)
+        results = [client.chat(MESSAGES) for _ in range(20)]
+    finally:
+        server.shutdown()
+
+    assert all("error" not in r for r in results)
+    assert server.requests == 20 + client.resilience.counters["retries"]
+    assert client.resilience.counters["retries"] > 0
+
+
+def test_client_errors_are_not_retried(server):
+    client = make_client(server)
+    server.error_rate, server.error_status = 1.0, 400
+
+    assert "error" in client.chat(MESSAGES)
+    assert server.requests == 1
+    assert client.resilience.breaker("mock").state == "closed"
+
+
+def test_parse_errors_retry_once_without_backoff(server):
+    client = make_client(server, max_attempts=5, base_delay=10.0, max_delay=10.0)
+    server.garbage_rate = 1.0
+
+    start = time.monotonic()
+    assert "error" in client.chat(MESSAGES)
+    assert server.requests == 2
+    assert time.monotonic() - start < 5.0
+
+
+def test_failed_result_carries_upstream_usage(server, monkeypatch):
+    # 上游返回了内容但缺少模型输出：两次解析失败的响应都消耗了 token，失败结果按合计用量结算
+    client = make_client(server)
+    monkeypatch.setattr(client, "_post", lambda model, payload: {"usage": {"total_tokens": 7}})
+
+    result = client.chat(MESSAGES, parse=_parse_tasks)
+
+    assert "error" in result
+    assert usage_tokens(result) == 14
+    assert usage_tokens({"error": "上游返回 HTTP 503"}) == 0
+
+
+def test_backoff_is_jittered_exponential_with_retry_after_floor():
+    resilience = Resilience(base_delay=0.1, max_delay=1.0)
+    error = UpstreamError.from_status(503)
+    for attempt in range(1, 8):
+        cap = min(1.0, 0.1 * 2 ** (attempt - 1))
+        assert all(0.0 <= resilience.backoff(attempt, error) <= cap for _ in range(50))
+
+    throttled = UpstreamError.from_status(429, retry_after=2.5)
+    assert resilience.backoff(1, throttled) == 2.5
+
+
+def test_retry_budget_caps_retries(server):
+    # ratio=0、不随时间补充：只剩初始的 1 个令牌，之后的失败不再重试
+    client = make_client(server, max_attempts=5, budget_ratio=0.0, budget_min_per_sec=0.0)
+    server.error_rate = 1.0
+
+    client.chat(MESSAGES)
+    client.chat(MESSAGES)
+
+    assert server.requests == 3
+    assert client.resilience.counters["retries"] == 1
+    assert client.resilience.counters["budget_exhausted"] == 2
+
+
+def test_breaker_opens_then_half_open_probe_closes_it(server):
+    client = make_client(server, max_attempts=1, failure_threshold=0.5, min_calls=5, reset_timeout=0.2)
+    breaker = client.resilience.breaker("mock")
+    server.error_rate = 1.0
+
+    for _ in range(5):
+        client.chat(MESSAGES)
+    assert breaker.state == "open"
+
+    # 熔断期间直接失败，不发出请求
+    assert "熔断" in client.chat(MESSAGES)["error"]
+    assert server.requests == 5
+    assert client.resilience.counters["short_circuited"] == 1
+
+    server.error_rate = 0.0
+    time.sleep(0.25)
+    assert breaker.available()
+    assert "error" not in client.chat(MESSAGES)
+    assert breaker.state == "closed"
+    assert server.requests == 6
+
+
+def test_failed_half_open_probe_reopens_breaker(server):
+    client = make_client(server, max_attempts=1, failure_threshold=0.5, min_calls=5, reset_timeout=0.2)
+    breaker = client.resilience.breaker("mock")
+    server.error_rate = 1.0
+    for _ in range(5):
+        client.chat(MESSAGES)
+
+    time.sleep(0.25)
+    client.chat(MESSAGES)
+
+    assert breaker.state == "open"
+    assert not breaker.available()
+    assert server.requests == 6
+
+
+def test_half_open_admits_a_single_probe():
+    resilience = Resilience(failure_threshold=0.5, min_calls=5, reset_timeout=0.0)
+    breaker = resilience.breaker("mock")
+    for _ in range(5):
+        breaker.record(True)
+
+    assert breaker.acquire() == "probe"
+    assert breaker.acquire() is None
+    with pytest.raises(CircuitOpenError):
+        resilience.call("mock", lambda: "ok")
+
+    breaker.record(False)
+    assert breaker.state == "closed"
+    assert resilience.call("mock", lambda: "ok") == "ok"
@@ -0,0 +1,52 @@
+"""
+TaskStreamParser：逐块输入时按对象闭合推送任务
+"""
+import json
+
+from core.task_stream import TaskStreamParser
+
+
+def feed_in_chunks(text: str, size: int = 7) -> list:
+    parser = TaskStreamParser()
+    tasks = []
+    for i in range(0, len(text), size):
+        tasks.extend(parser.feed(text[i:i + size]))
+    assert tasks == parser.tasks
+    return tasks
+
+
+def test_tasks_inside_object():
+    text = json.dumps({"tasks": [{"title": "跑步", "difficulty": 2}, {"title": "背单词"}]}, ensure_ascii=False)
+    assert [t["title"] for t in feed_in_chunks(text)] == ["跑步", "背单词"]
+
+
+def test_top_level_array():
+    text = '```json\n[{"title": "跑步", "difficulty": 2}, {"title": "读书 [第一章]"}]\n```'
+    assert [t["title"] for t in feed_in_chunks(text)] == ["跑步", "读书 [第一章]"]
+
+
+def test_unmatched_quote_in_preamble_is_ignored():
+    text = '好的，下面是"学习计划：\n{"tasks": [{"title": "阅读文档"}, {"title": "写练习"}]}\n以上就是"全部'
+    assert [t["title"] for t in feed_in_chunks(text)] == ["阅读文档", "写练习"]
+
+
+def test_text_after_closing_is_ignored():
+    parser = TaskStreamParser()
+    parser.feed('{"tasks": [{"title": "跑步"}]}')
+    assert parser.feed(' 另外 {"tasks": [{"title": "不应出现"}]}') == []
+    assert [t["title"] for t in parser.tasks] == ["跑步"]
+
+
+def test_nested_objects_are_not_tasks():
+    text = ('{"tasks": [{"title": "跑步", "rewards": {"VIT": 2}, '
+            '"recurrence": {"freq": "weekly", "start": "2026-01-05", "byweekday": [0, 3]}}]}')
+    tasks = feed_in_chunks(text, size=3)
+    assert len(tasks) == 1
+    assert tasks[0]["recurrence"]["byweekday"] == [0, 3]
+
+
+def test_invalid_task_is_dropped():
+    parser = TaskStreamParser()
+    parser.feed('{"tasks": [{"description": "没有标题"}, {"title": "有标题"}]}')
+    assert [t["title"] for t in parser.tasks] == ["有标题"]
+    assert parser.dropped[0]["field"] == "tasks[0]"
@@ -2,7 +2,7 @@
 模型配置文件
 """
 
-# 基座模型配置
+# 基座模型配置（本地分词计数等使用的开源权重；线上调用的模型见 ROUTER_CONFIG）
 MODEL_CONFIG = {
     "model_name": "qwen/Qwen2.5-7B-Instruct",  # 默认使用通义千问
     "max_tokens": 2048,
@@ -16,11 +16,95 @@ RAG_CONFIG = {
     "chunk_size": 500,
     "chunk_overlap": 50,
     "top_k": 3,
+    "ann_threshold": 20000,     # 单个用户的片段数达到该值后改用 IVF 近似检索
+    "nprobe": 16,               # IVF 检索访问的聚类数，越大召回越高、越慢
 }
 
 # API配置
 API_CONFIG = {
     "dashscope_api_key": "",  # 从环境变量读取
-    "timeout": 30,
+    "timeout": 30,              # 读超时（秒）
+    "connect_timeout": 5,       # 建连超时（秒）
     "retry_times": 3,
+    "max_connections": 100,     # 连接池总连接数上限
+    "max_keepalive": 20,        # 连接池保持的空闲长连接数
+    "max_concurrency": 50,      # 同时在途的上游请求数上限
+    "batch_workers": 5,         # 单个批量请求内并发生成的目标数
+    "batch_concurrency": 20,    # 所有批量请求合计的并发生成数上限，为单条请求留出余量
+}
+
+# 生成结果缓存配置
+CACHE_CONFIG = {
+    "max_entries": 2048,            # LRU 容量
+    "ttl": 6 * 3600,                # 过期时间（秒）
+    "similarity_threshold": 0.92,   # 语义层命中阈值（余弦相似度），仅在配置了 embedder 时生效
+}
+
+# 对话会话配置
+SESSION_CONFIG = {
+    "max_sessions": 10000,      # 同时保留的会话数上限，超出后淘汰最久未活跃的会话
+    "idle_ttl": 30 * 60,        # 会话空闲多久后过期（秒）
+    "token_budget": 4000,       # 每个会话历史消息（不含 system prompt）的 token 预算
+    "keep_recent": 6,           # 压缩时至少保留的最近消息条数
+}
+
+# Prompt 组装配置
+PROMPT_CONFIG = {
+    "task_prompt_budget": 3000,     # 任务生成 prompt 的 token 上限，超出时先按行裁剪 RAG 上下文
+    "min_cacheable_tokens": 256,    # 服务端 prompt 缓存生效的最短前缀，以所用服务商的文档为准
+}
+
+# 上游调用的重试与熔断配置（重试次数见 API_CONFIG["retry_times"]）
+RESILIENCE_CONFIG = {
+    "base_delay": 0.5,          # 首次重试的退避基数（秒），之后指数增长并加随机抖动
+    "max_delay": 8.0,           # 单次退避上限（秒）
+    "deadline": 45.0,           # 单次调用（含全部重试）的总时限（秒）
+    "parse_retries": 1,         # 响应解析失败（JSON 不合法等）时最多重新请求的次数
+    "budget_ratio": 0.2,        # 重试预算：重试次数最多占正常请求数的比例
+    "budget_min_per_sec": 1.0,  # 低流量时每秒保底的重试次数
+    "failure_threshold": 0.5,   # 熔断：滑动窗口内失败率达到该值即熔断
+    "window_size": 20,          # 熔断统计的滑动窗口（最近 N 次调用）
+    "min_calls": 5,             # 窗口内至少有这么多次调用才判断失败率
+    "reset_timeout": 30.0,      # 熔断后多久进入半开状态放行探测请求（秒）
+}
+
+# 多模型路由配置：每类请求路由到满足延迟 SLO 的最便宜模型，慢于 p95 时向第二个模型发出对冲请求
+ROUTER_CONFIG = {
+    # 候选模型与相对成本（按每千输入 token 的价格，只用于排序），以所用服务商的价目为准
+    "models": {
+        "qwen-turbo": {"cost": 0.3},
+        "qwen-plus": {"cost": 0.8},
+        "qwen3-max": {"cost": 6.0},
+    },
+    # 请求类别：slo 为估算 p95 延迟的目标（秒）
+    "classes": {
+        "chat": {"slo": 8.0, "models": ["qwen-turbo", "qwen-plus"]},            # 快速对话
+        "planning": {"slo": 30.0, "models": ["qwen-plus", "qwen3-max"]},        # 任务生成、多日规划
+    },
+    "alpha": 0.2,               # 延迟与错误率的指数加权系数
+    "min_samples": 5,           # 估算 p95 所需的最少样本数，不足时视为满足 SLO
+    "max_error_rate": 0.2,      # 错误率超过该值的模型不参与路由
+    "probe_interval": 60.0,     # 不满足 SLO 的模型多久没有样本后重新用真实请求探测（秒）
+    "hedge": True,              # 首选模型慢于其 p95 时是否向第二个模型发出对冲请求
+    "hedge_min_delay": 0.5,     # 对冲等待时间的下限（秒）
+    "hedge_ratio": 0.1,         # 对冲请求最多占请求数的比例
+}
+
+# AI 接口限流配置（单位：token，按 prompt 估算 + max_tokens 预占，结束后按实际用量结算）
+RATE_LIMIT_CONFIG = {
+    "user_tokens_per_min": 20000,       # 单个用户每分钟补充的额度
+    "user_burst": 40000,                # 单个用户的桶容量（允许的突发）
+    "global_tokens_per_min": 300000,    # 全局每分钟补充的额度，按上游配额设置
+    "global_burst": 400000,
+    # 各优先级额度不足时最多排队等待的时间（秒），以及全局桶中不允许该优先级动用的比例
+    "priorities": {
+        "interactive": {"max_wait": 2.0, "reserve": 0.0},
+        "batch": {"max_wait": 15.0, "reserve": 0.3},
+    },
+}
+
+# 日志配置
+LOG_CONFIG = {
+    "sample_rate": 0.05,        # 每次对话的结构化日志按该比例采样，错误始终记录
+    "preview_chars": 80,        # 日志中用户输入的预览长度，不记录完整对话
 }
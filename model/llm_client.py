@@ -1,14 +1,39 @@
 """ 封装 LLM Client. """
 import os
 import json
+import logging
+import random
+import time
+from http import HTTPStatus
 from typing import Dict, List, Optional
 from datetime import datetime, date
 
 import dashscope
 
+import resilience
+import router
+from config import LOG_CONFIG, PROMPT_CONFIG, SESSION_CONFIG
+from resilience import UpstreamError
+from prompts.assembly import PromptBuilder, Section
+from session_store import SessionStore
+from structured_output import parse_task_plan
+
+
+logger = logging.getLogger(__name__)
+
+
+def _sampled() -> bool:
+    """ 按 LOG_CONFIG["sample_rate"] 采样；未开启 INFO 日志时直接跳过，不构造日志内容 """
+    return logger.isEnabledFor(logging.INFO) and random.random() < LOG_CONFIG["sample_rate"]
+
+
+def _log(level: int, event: str, **fields):
+    """ 结构化日志：一行 JSON """
+    logger.log(level, json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
 
 SYSTEM_PROMPT = """
-你是一个善于日常泛用任务的规划小助手，能合理分析用户的输入，制定出具体的任务列表。注意，今天的日期（年-月-日）是：{today}，是 {weekday}。
+你是一个善于日常泛用任务的规划小助手，能合理分析用户的输入，制定出具体的任务列表。今天的日期会在用户每轮输入的开头给出，请以它为准安排任务日期。
 
 你设计出的每个任务需要有：
 
@@ -23,56 +48,99 @@ SYSTEM_PROMPT = """
 
 有时候用户描述的一个任务可能需要拆分为多个任务在不同的日期完成，比如”第一天完成子任务一，第二天完成子任务二，第三天完成子任务三，从而完成整个任务“，这时你设计的任务列表要具体到子任务这个粒度。
 
-有时候，用户描述的可能是一个周期性任务，比如“每周一完成一次，持续一个月”。对于这种周期性任务，每次都需要创建个任务实例，即对于未来一个月的每个周一都需要创建一个任务实例。
+有时候，用户描述的可能是一个周期性任务，比如“每周一完成一次，持续一个月”。对于这种周期性任务，只需创建一个任务，并为它加上重复规则（recurrence），不要为每次发生都创建一个任务实例，系统会按规则自动展开。重复规则包含：
+  - freq：重复频率，取值 "daily"（每天）、"weekly"（每周）、"monthly"（每月）
+  - start：第一次发生的日期，格式为 YYYY-MM-DD，与该任务的 datetime 相同
+  - interval：间隔，如每两周一次为 2，默认 1
+  - byweekday：仅 weekly 使用，星期几的列表，0 表示周一，6 表示周日，如 [0, 3] 表示每周一和周四
+  - bymonthday：仅 monthly 使用，每月的几号
+  - until：截止日期（含），格式为 YYYY-MM-DD；或者用 count 表示总共发生的次数，两者择一
+一次性任务不需要 recurrence 字段。
 
 注意，有时候，用户提供的任务描述偏笼统，信息可能不足。当你认为用户目前提供的信息不足以让制定出合适的任务列表时，你可以向用户发起提问，让用户提供更多的描述。比如：对于“我要锻炼身体”这样笼统的描述，你可以提问用户“想通过什么方式来锻炼身体？时长多少？安排在周几？”，让用户补充更多细节。当然，你还可以向用户提供一些合理的参考建议。。
 
 为方便后续处理与解析，你的输出应当以 JSON 给出。当你认为用户提供的信息不足，需要进一步沟通时，输出示例如下：
 
-{{  
+{  
     "is_finished": False,
     "response": "你的提问或者提示内容",
     "tasks": None
-}}
+}
 
 而当你认为用户提供的信息可以比较好地设计出任务列表，不再需要进一步沟通时，输出示例如下：
 
-{{ 
+{ 
     "is_finished": True,
     "response": "已基于您的描述，制定了相应的任务列表",
     "tasks": [
-        {{
+        {
             "title": "任务标题",
             "description": "具体的任务描述",
             "datetime": "2026-01-01",
             "estimated_time": 30,
             "difficulty": 1,
-            "rewards": {{
+            "rewards": {
                 "INT": 1,
                 "VIT": 4
-            }}
-        }}
+            }
+        },
+        {
+            "title": "周期任务标题",
+            "description": "具体的任务描述",
+            "datetime": "2026-01-05",
+            "estimated_time": 30,
+            "difficulty": 2,
+            "rewards": {
+                "INT": 0,
+                "VIT": 3
+            },
+            "recurrence": {
+                "freq": "weekly",
+                "start": "2026-01-05",
+                "byweekday": [0],
+                "until": "2026-02-02"
+            }
+        }
     ]
-}}
+}
 
 当你认为用户提供的信息可以指定出明确的任务列表后，你需要以 JSON 的格式给出
 
 """
 
+# 易变内容（日期）放在每轮用户输入的开头，而不是 SYSTEM_PROMPT 中，使所有会话的 system prompt 字节一致、可被服务端缓存
+DATE_PROMPT = "（今天是 {today}，{weekday}）"
+WEEKDAYS = ("星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日")
+
 
 class LLMClient:
     """ LLM 客户端 """
 
-    def __init__(self, model_name: str = "qwen3-max", max_retries: int = 3):
-        """ 初始化客户端 """
+    def __init__(self, model_name: Optional[str] = None, max_retries: int = 3):
+        """ 初始化客户端
+
+        Args:
+            model_name (str): 固定调用的模型；为 None 时由 router 按 planning 类别选择（见 ROUTER_CONFIG）
+            max_retries (int): 最大尝试次数
+        """
         # 通义千问模型列表：https://help.aliyun.com/zh/model-studio/models
         self.model_name = model_name    # 调用模型的名称
 
-        self.max_retries = max_retries  # 最大重试次数
+        self.max_retries = max_retries  # 最大尝试次数
+
+        # 重试退避与熔断策略；熔断器按模型在进程内共享
+        self.resilience = resilience.shared
 
-        # 存储用户的聊天记录；暂定每位用户只维护一个 session，当该 session 关闭时，聊天记录即被清空。
+        # 模型路由；延迟统计与 backend 的客户端在进程内共享。dashscope 的同步调用无法取消，不发出对冲请求
+        self.router = router.shared
+
+        # 存储用户的聊天记录；暂定每位用户只维护一个 session，当该 session 关闭或空闲过期时，聊天记录即被清空。
         # 典型的 messages 是：{"role": "system", "content": "..."}, {"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}
-        self.history_dict: Dict[str, List[Dict[str, str]]]= {}      # used_id -> messages: List[Dict]
+        # 历史超出 token 预算时，较早的轮次会被压缩为摘要
+        self.sessions = SessionStore(**SESSION_CONFIG)
+
+        # 按“静态 system prompt -> 历史 -> 日期与本轮输入”组装消息，并估算可缓存前缀
+        self.prompts = PromptBuilder(min_cacheable_tokens=PROMPT_CONFIG["min_cacheable_tokens"])
 
 
     def chat(self, user_id: str, user_input: str) -> Optional[str]:
@@ -83,51 +151,65 @@ class LLMClient:
             user_input (str): 该用户当前轮次的输入文本内容
         """
         today = datetime.now().strftime("%Y-%m-%d")
-        weekday = date.today().weekday()
-
-        # 读取该 session 的对话记录，并加入 user_input
-        if user_id not in self.history_dict:
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT.format(today=today, weekday=weekday)},
-                {"role": "user", "content": user_input}
-            ]
-        else:
-            messages = self.history_dict[user_id].copy()
-            messages.append({"role": "user", "content": user_input})
-
-        print("\n============= DEBUG ============")
-        print(messages)
-        print("============= DEBUG ============\n")
-        
-        # 发送请求
-        is_success = False
-        cnt = 0
-        while cnt < self.max_retries and not is_success:
-            try:
-                response = dashscope.Generation.call(
-                    api_key=os.getenv('DASHSCOPE_API_KEY'), model=self.model_name, messages=messages, result_format='message',
-                    response_format={"type": "json_object"}
-                )
-                resp_msg = response.output.choices[0].message.content
-                resp_json = json.loads(resp_msg)
-            except Exception as err:
-                print(f"Error to chat with LLM: {str(err)}")
-                cnt += 1
-            else:
-                is_success = True
-
-        if is_success:
-            messages.append({"role": "assistant", "content": resp_msg})
-            self.history_dict[user_id] = messages
-            
-        result = {"is_success": is_success, "err_msg": None if is_success else str(err), "response": resp_json}
+        weekday = WEEKDAYS[date.today().weekday()]
+
+        # 读取该 session 的对话记录，并在末尾加入带日期的 user_input（成功后才写入历史）
+        session = self.sessions.get_or_create(user_id, SYSTEM_PROMPT)
+        prompt = self.prompts.build([
+            Section("instructions", session.system, role="system", static=True),
+            Section("date", DATE_PROMPT.format(today=today, weekday=weekday)),
+            Section("input", user_input),
+        ], history=self.sessions.messages(session)[1:], history_tokens=session.history_tokens())
+        messages = prompt.messages
+        user_msg = messages[-1]
+        start = time.perf_counter()
+
+        # 发送请求；网络错误与 429/5xx 退避重试，4xx 与熔断直接失败
+        # 常见的格式缺陷（照抄的 False / None、字符串类型的数字等）在本地修复，只有无法修复时才立即重试一次
+        route = self.router.route("planning", model=self.model_name)
+        model = route.primary
+
+        def _call():
+            response = dashscope.Generation.call(
+                api_key=os.getenv('DASHSCOPE_API_KEY'), model=model, messages=messages, result_format='message',
+                response_format={"type": "json_object"}
+            )
+            if response.status_code != HTTPStatus.OK:
+                raise UpstreamError.from_status(response.status_code, f"{response.code}: {response.message}")
+            resp_msg = response.output.choices[0].message.content
+            return resp_msg, parse_task_plan(resp_msg).to_dict(), response.usage
+
+        try:
+            resp_msg, resp_json, usage = self.router.call(
+                route, lambda m: self.resilience.call(m, _call, max_attempts=self.max_retries))
+        except Exception as err:
+            _log(logging.WARNING, "llm_chat_error", user_id=user_id, model=model, error=str(err),
+                 latency_ms=round((time.perf_counter() - start) * 1000))
+            return {"is_success": False, "err_msg": str(err), "response": None}
+
+        if _sampled():
+            # 只记录摘要，不输出完整的对话内容
+            _log(logging.INFO, "llm_chat", user_id=user_id, model=model, messages=len(messages),
+                 prompt_tokens_est=prompt.tokens, cacheable_ratio=round(prompt.cacheable_ratio, 3),
+                 input_tokens=getattr(usage, "input_tokens", None), output_tokens=getattr(usage, "output_tokens", None),
+                 input_preview=user_input[:LOG_CONFIG["preview_chars"]], latency_ms=round((time.perf_counter() - start) * 1000),
+                 tasks=len(resp_json["tasks"]), repairs=resp_json["repairs"], coerced=len(resp_json["coerced"]))
+
+        self.sessions.append(session, user_msg, {"role": "assistant", "content": resp_msg})
+
+        result = {"is_success": True, "err_msg": None, "response": resp_json}
 
         return result
 
 
     def clear(self, user_id: str):
         """ 当用户关闭程序时，可调用 clear 来清除掉历史记录 """
-        self.history_dict.pop(user_id, None)
+        self.sessions.pop(user_id)
+
+
+    def session_stats(self, user_id: str) -> Optional[Dict[str, int]]:
+        """ 该用户会话压缩后节省的 token 与内存 """
+        return self.sessions.stats(user_id)
 
     
     def test_continuous_session(self, user_id: str, user_input: str):
@@ -156,6 +238,6 @@ class LLMClient:
 
 if __name__ == "__main__":
 
-    client = LLMClient(model_name="qwen-plus")
+    client = LLMClient()
     result = client.test_continuous_session(user_id="startshine", user_input="我想锻炼身体")
 
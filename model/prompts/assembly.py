@@ -0,0 +1,172 @@
+""" Prompt 组装：静态指令在前、易变内容（日期、用户历史、RAG 上下文）在后，使不同请求共享字节一致的前缀以命中服务端的 prompt 缓存；在本地计算 token，超出预算时按优先级裁剪。 """
+import hashlib
+from typing import Any, Callable, Dict, List, Optional
+
+from session_store import estimate_tokens
+
+
+class Section:
+    """ prompt 中的一段
+
+    Args:
+        name (str): 名称，用于报告裁剪情况
+        text (str): 内容
+        role (str): 所属消息的角色，相邻且角色相同的段落合并为一条消息
+        static (bool): 是否跨请求不变；静态段落总是排在所有易变内容之前
+        priority (int): 超出预算时按 priority 从小到大裁剪；None 表示必需，不裁剪
+        trim (str): "lines" 从末尾逐行裁剪（适用于按相关度排序的检索结果，第一行为标题，正文裁完时连同标题删除），"drop" 整段丢弃
+    """
+
+    __slots__ = ("name", "text", "role", "static", "priority", "trim")
+
+    def __init__(self, name: str, text: str, role: str = "user", static: bool = False,
+                 priority: Optional[int] = None, trim: str = "drop"):
+        self.name = name
+        self.text = text
+        self.role = role
+        self.static = static
+        self.priority = priority
+        self.trim = trim
+
+
+class AssembledPrompt:
+    """ 组装结果
+
+    Args:
+        messages (List[Dict]): 发送给 LLM 的消息列表
+        tokens (int): 本地估算的 prompt token 数
+        prefix_tokens (int): 跨请求字节一致的前缀 token 数（静态段落与已发送过的历史）
+        prefix_hash (str): 静态段落的摘要，相同即说明前缀字节一致
+        trimmed (List[Dict]): 被裁剪的段落，[{"section": "context", "tokens": 120}]
+        budget (int): 预算，None 表示不限
+        min_cacheable_tokens (int): 服务端缓存的最短前缀
+    """
+
+    __slots__ = ("messages", "tokens", "prefix_tokens", "prefix_hash", "trimmed", "budget", "min_cacheable_tokens")
+
+    def __init__(self, messages: List[Dict[str, str]], tokens: int, prefix_tokens: int, prefix_hash: str,
+                 trimmed: List[Dict[str, Any]], budget: Optional[int], min_cacheable_tokens: int = 0):
+        self.messages = messages
+        self.tokens = tokens
+        self.prefix_tokens = prefix_tokens
+        self.prefix_hash = prefix_hash
+        self.trimmed = trimmed
+        self.budget = budget
+        self.min_cacheable_tokens = min_cacheable_tokens
+
+    @property
+    def cacheable_tokens(self) -> int:
+        """ 估算可命中服务端缓存的 token 数：前缀短于服务端要求的最短长度时为 0 """
+        return self.prefix_tokens if self.prefix_tokens >= self.min_cacheable_tokens else 0
+
+    @property
+    def cacheable_ratio(self) -> float:
+        """ 估算的可缓存前缀占比 """
+        return self.cacheable_tokens / self.tokens if self.tokens else 0.0
+
+    @property
+    def over_budget(self) -> bool:
+        """ 裁剪完所有可裁剪段落后仍超出预算（必需段落本身过长） """
+        return self.budget is not None and self.tokens > self.budget
+
+    def text(self) -> str:
+        return "\n".join(m["content"] for m in self.messages)
+
+    def report(self) -> Dict[str, Any]:
+        return {"tokens": self.tokens, "prefix_tokens": self.prefix_tokens, "cacheable_tokens": self.cacheable_tokens,
+                "cacheable_ratio": round(self.cacheable_ratio, 3), "prefix_hash": self.prefix_hash,
+                "trimmed": self.trimmed, "over_budget": self.over_budget}
+
+
+class PromptBuilder:
+    """ 按“静态段落 -> 历史消息 -> 易变段落”的顺序组装消息，并在预算内裁剪 """
+
+    def __init__(self, counter: Callable[[str], int] = estimate_tokens, min_cacheable_tokens: int = 0):
+        """ 初始化
+
+        Args:
+            counter (Callable): token 计数函数，可替换为真实分词器（见 hf_token_counter）
+            min_cacheable_tokens (int): 服务端缓存的最短前缀；前缀短于该值时估算为不可缓存
+        """
+        self.counter = counter
+        self.min_cacheable_tokens = min_cacheable_tokens
+        self._static_tokens: Dict[str, int] = {}
+
+    def build(self, sections: List[Section], history: Optional[List[Dict[str, str]]] = None,
+              budget: Optional[int] = None, history_tokens: Optional[int] = None) -> AssembledPrompt:
+        """ 组装 prompt
+
+        Args:
+            sections (List[Section]): 段落，静态与易变段落各自保持给定的相对顺序
+            history (List[Dict]): 夹在静态与易变段落之间的历史消息（会话中已发送过的轮次），不参与裁剪
+            budget (int): prompt 的 token 上限
+            history_tokens (int): 调用方已知的历史 token 数（如 SessionStore 维护的计数），省去重新计数
+
+        Returns:
+            AssembledPrompt
+        """
+        static = [s for s in sections if s.static]
+        volatile = [s for s in sections if not s.static]
+        history = history or []
+
+        static_messages = _merge(static)
+        prefix_hash = hashlib.sha1("\x00".join(m["content"] for m in static_messages).encode()).hexdigest()[:12]
+        prefix_tokens = self._static_tokens.get(prefix_hash)
+        if prefix_tokens is None:
+            # 静态段落在进程内不变，只计数一次
+            prefix_tokens = self._static_tokens[prefix_hash] = sum(self.counter(m["content"]) for m in static_messages)
+        if history_tokens is None:
+            history_tokens = sum(self.counter(m["content"]) for m in history)
+        prefix_tokens += history_tokens
+
+        texts = {id(s): s.text for s in volatile}
+        tokens = {id(s): self.counter(s.text) for s in volatile}
+        total = prefix_tokens + sum(tokens.values())
+
+        trimmed = []
+        if budget is not None and total > budget:
+            for section in sorted((s for s in volatile if s.priority is not None), key=lambda s: s.priority):
+                if total <= budget:
+                    break
+                before = tokens[id(section)]
+                if section.trim == "lines":
+                    texts[id(section)] = self._trim_lines(texts[id(section)], before - (total - budget))
+                else:
+                    texts[id(section)] = ""
+                tokens[id(section)] = self.counter(texts[id(section)]) if texts[id(section)] else 0
+                total -= before - tokens[id(section)]
+                trimmed.append({"section": section.name, "tokens": before - tokens[id(section)]})
+
+        kept = [Section(s.name, texts[id(s)], s.role) for s in volatile if texts[id(s)]]
+        messages = static_messages + list(history) + _merge(kept)
+        return AssembledPrompt(messages, total, prefix_tokens, prefix_hash, trimmed, budget, self.min_cacheable_tokens)
+
+    def _trim_lines(self, text: str, allowed: int) -> str:
+        """ 从末尾逐行删除，直到不超过 allowed 个 token；只剩标题行时返回空串 """
+        lines = text.split("\n")
+        used = [self.counter(line) + 1 for line in lines]
+        total = sum(used)
+        while len(lines) > 1 and total > allowed:
+            total -= used.pop()
+            lines.pop()
+        return "\n".join(lines) if len(lines) > 1 else ""
+
+
+def _merge(sections: List[Section]) -> List[Dict[str, str]]:
+    """ 相邻且角色相同的段落合并为一条消息 """
+    messages = []
+    for section in sections:
+        if messages and messages[-1]["role"] == section.role:
+            messages[-1]["content"] += "\n" + section.text
+        else:
+            messages.append({"role": section.role, "content": section.text})
+    return messages
+
+
+def hf_token_counter(model_name: Optional[str] = None) -> Callable[[str], int]:
+    """ 使用 transformers 分词器精确计数（需安装 transformers），默认使用 MODEL_CONFIG 中的模型 """
+    from transformers import AutoTokenizer
+    from config import MODEL_CONFIG
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name or MODEL_CONFIG["model_name"])
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
@@ -1,31 +1,49 @@
 """
 任务生成 Prompt 模板
+静态指令放在 system 消息中且不含任何变量，各请求共享同一前缀；用户信息、今天的日期与检索到的历史放在其后的 user 消息中
 """
+from datetime import date
+from typing import List, Optional
+
+from prompts.assembly import AssembledPrompt, PromptBuilder, Section
 
 TASK_GENERATION_PROMPT = """
 你是一个任务规划助手，帮助用户将大目标拆解为具体可执行的小任务。
 
-用户信息：
-- 用户名：{username}
-- 目标：{goal}
-- 可用时间：{available_time}
-
-请根据以上信息，生成3-5个具体、可衡量、有时间限制的子任务。
+请根据用户提供的信息，生成3-5个具体、可衡量、有时间限制的子任务。
+需要周期性重复的任务只生成一个，并用 recurrence 给出重复规则，不要逐次列出。
 
 输出格式（JSON）：
-{{
+{
     "tasks": [
-        {{
+        {
             "title": "任务标题",
             "description": "任务描述",
             "estimated_time": "预计耗时（分钟）",
             "difficulty": "难度（1-5）",
-            "reward_exp": "完成可获得经验值"
-        }}
+            "reward_exp": "完成可获得经验值",
+            "recurrence": {"freq": "weekly", "start": "YYYY-MM-DD", "byweekday": [0], "until": "YYYY-MM-DD"} 或 null
+        }
     ]
-}}
+}
+recurrence 为对象（不是字符串），不需要重复的任务填 null；日期以用户信息中的“今天”为准。
+"""
+
+TASK_REQUEST_PROMPT = """
+用户信息：
+- 今天：{today}（{weekday}）
+- 用户名：{username}
+- 目标：{goal}
+- 可用时间：{available_time}
+"""
+
+RAG_CONTEXT_PROMPT = """
+以下是该用户过往的相关任务与笔记，可参考其习惯与进度来安排任务，避免与已完成的内容重复：
+{context}
 """
 
+WEEKDAYS = ("星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日")
+
 ENCOURAGEMENT_PROMPT = """
 你是一个温暖鼓励的成长伙伴。用户刚刚完成了一项任务：
 
@@ -37,13 +55,37 @@ ENCOURAGEMENT_PROMPT = """
 """
 
 
-def get_task_prompt(username: str, goal: str, available_time: str) -> str:
-    """获取任务生成Prompt"""
-    return TASK_GENERATION_PROMPT.format(
+_builder = PromptBuilder()
+
+
+def task_prompt_sections(username: str, goal: str, available_time: str, context: str = "",
+                         today: Optional[date] = None) -> List[Section]:
+    """任务生成 Prompt 的各段：静态指令 + RAG 上下文（超出预算时最先按行裁剪）+ 用户信息与今天的日期"""
+    today = today or date.today()
+    sections = [Section("instructions", TASK_GENERATION_PROMPT.strip(), role="system", static=True)]
+    if context:
+        sections.append(Section("context", RAG_CONTEXT_PROMPT.format(context=context).strip(), priority=1, trim="lines"))
+    sections.append(Section("request", TASK_REQUEST_PROMPT.format(
+        today=today.isoformat(),
+        weekday=WEEKDAYS[today.weekday()],
         username=username,
         goal=goal,
         available_time=available_time
-    )
+    ).strip()))
+    return sections
+
+
+def build_task_prompt(username: str, goal: str, available_time: str, context: str = "",
+                      budget: Optional[int] = None, builder: Optional[PromptBuilder] = None,
+                      today: Optional[date] = None) -> AssembledPrompt:
+    """组装任务生成的消息列表，budget 为 prompt 的 token 上限，today 默认为当天"""
+    return (builder or _builder).build(task_prompt_sections(username, goal, available_time, context, today),
+                                       budget=budget)
+
+
+def get_task_prompt(username: str, goal: str, available_time: str, context: str = "") -> str:
+    """获取任务生成Prompt（纯文本形式，context 为检索到的用户历史，可为空）"""
+    return build_task_prompt(username, goal, available_time, context).text()
 
 
 def get_encouragement_prompt(task_name: str, time_spent: str, exp_gained: int, tone: str = "活泼") -> str:
@@ -0,0 +1,6 @@
+""" 检索增强（RAG）：切块、向量化、向量存储与检索。 """
+from .chunker import chunk_text
+from .embedders import Embedder, HashingEmbedder, SentenceTransformerEmbedder
+from .ivf_index import IVFIndex
+from .retriever import Retriever
+from .vector_store import VectorStore
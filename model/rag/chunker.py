@@ -0,0 +1,41 @@
+""" 文本切块：按 RAG_CONFIG 中的 chunk_size / chunk_overlap 把长文本切成有重叠的片段。 """
+import re
+from typing import List
+
+# 优先在这些位置断开，避免把一句话切成两半
+_BOUNDARY = re.compile(r"[\n。！？!?；;]")
+
+
+def chunk_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50) -> List[str]:
+    """ 把文本切成不超过 chunk_size 个字符的片段，相邻片段重叠约 chunk_overlap 个字符
+
+    Args:
+        text (str): 原文
+        chunk_size (int): 每个片段的最大字符数
+        chunk_overlap (int): 相邻片段的重叠字符数
+
+    Returns:
+        List[str]: 片段列表；短于 chunk_size 的文本原样返回为单个片段
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # 在片段后半段里找最后一个句子边界
+            boundary = None
+            for match in _BOUNDARY.finditer(text, start + chunk_size // 2, end):
+                boundary = match.end()
+            if boundary:
+                end = boundary
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - chunk_overlap, start + 1)
+    return [c for c in chunks if c]
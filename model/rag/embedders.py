@@ -0,0 +1,63 @@
+""" 可替换的文本向量化实现。 """
+import hashlib
+from typing import List, Optional
+
+import numpy as np
+
+
+class Embedder:
+    """ 向量化接口：把一批文本转换为 L2 归一化后的 float32 矩阵 """
+
+    dim: int
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """ 返回形状为 (len(texts), dim) 的 float32 矩阵，每行 L2 范数为 1 """
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """ 基于字符 n-gram 特征哈希的确定性向量化，不依赖模型文件，适用于离线测试 """
+
+    def __init__(self, dim: int = 512, ngram: int = 2):
+        """ 初始化
+
+        Args:
+            dim (int): 向量维度
+            ngram (int): 使用 1..ngram 元的字符片段作为特征
+        """
+        self.dim = dim
+        self.ngram = ngram
+
+    def _bucket(self, feature: str) -> int:
+        # 不能用内置 hash：它在进程间随机化，持久化后的向量将无法复现
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = "".join(text.lower().split())
+            for n in range(1, self.ngram + 1):
+                for i in range(len(text) - n + 1):
+                    h = self._bucket(text[i:i + n])
+                    # 最高位决定符号，减少哈希冲突带来的偏差
+                    matrix[row, h % self.dim] += 1.0 if h >> 63 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """ 基于 sentence-transformers 的向量化，默认使用 RAG_CONFIG 中的 bge-small 模型 """
+
+    def __init__(self, model_name: Optional[str] = None, batch_size: int = 64):
+        from sentence_transformers import SentenceTransformer
+        from config import RAG_CONFIG
+
+        self.model = SentenceTransformer(model_name or RAG_CONFIG["embedding_model"])
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
@@ -0,0 +1,131 @@
+""" 用户个人知识检索：把用户过往的任务与笔记切块、向量化并检索，用作任务生成的参考上下文。 """
+import hashlib
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import RAG_CONFIG
+
+from .chunker import chunk_text
+from .embedders import Embedder, HashingEmbedder
+from .vector_store import VectorStore
+
+
+class Retriever:
+    """ 按用户隔离的检索器：每个用户一个 VectorStore，首次访问时才加载
+
+    每个用户一把锁：同一用户的读写串行，不同用户之间互不阻塞；向量化在锁外进行
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None, path: Optional[str] = None,
+                 chunk_size: int = RAG_CONFIG["chunk_size"], chunk_overlap: int = RAG_CONFIG["chunk_overlap"],
+                 top_k: int = RAG_CONFIG["top_k"], ann_threshold: int = RAG_CONFIG["ann_threshold"],
+                 nprobe: int = RAG_CONFIG["nprobe"]):
+        """ 初始化
+
+        Args:
+            embedder (Embedder): 向量化实现，默认使用离线的 HashingEmbedder
+            path (str): 持久化根目录，为 None 时仅保存在内存中
+            chunk_size (int): 切块大小（字符）
+            chunk_overlap (int): 切块重叠（字符）
+            top_k (int): 默认检索条数
+            ann_threshold (int): 单个用户片段数达到该值后改用 IVF 近似检索，0 表示始终精确检索
+            nprobe (int): IVF 检索访问的聚类数
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.top_k = top_k
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self._stores: Dict[str, VectorStore] = {}
+        self._locks: Dict[str, threading.Lock] = {}     # 用户 -> 该用户 VectorStore 的锁
+        self._lock = threading.Lock()     # 只保护上面两个字典的插入
+
+    def store(self, user_id: str) -> VectorStore:
+        """ 获取该用户的向量存储 """
+        store = self._stores.get(user_id)
+        if store is not None:
+            return store
+        with self._lock:
+            store = self._stores.get(user_id)
+            if store is not None:
+                return store
+            path = None
+            if self.path:
+                # 用户 ID 可能含有不能作为文件名的字符
+                path = os.path.join(self.path, hashlib.sha1(user_id.encode()).hexdigest())
+            self._locks[user_id] = threading.Lock()
+            store = self._stores[user_id] = VectorStore(self.embedder.dim, path, self.ann_threshold, self.nprobe)
+        return store
+
+    def _embed(self, text: str, meta: Optional[Dict[str, Any]]):
+        """ 切块并向量化（不访问存储，无需加锁） """
+        chunks = chunk_text(text, self.chunk_size, self.chunk_overlap)
+        if not chunks:
+            return None, []
+        return self.embedder.embed(chunks), [{**(meta or {}), "text": chunk} for chunk in chunks]
+
+    @staticmethod
+    def _task_text(task: Dict[str, Any]) -> str:
+        return "：".join(part for part in (task.get("title"), task.get("description")) if part)
+
+    @staticmethod
+    def _task_meta(task: Dict[str, Any]) -> Dict[str, Any]:
+        return {"type": "task", "task_id": task.get("id"), "status": task.get("status")}
+
+    def add_text(self, user_id: str, text: str, meta: Optional[Dict[str, Any]] = None) -> int:
+        """ 切块并写入一段文本（如笔记）
+
+        Returns:
+            int: 写入的片段数
+        """
+        vectors, metas = self._embed(text, meta)
+        if not metas:
+            return 0
+        store = self.store(user_id)
+        with self._locks[user_id]:
+            store.add(vectors, metas)
+        return len(metas)
+
+    def add_task(self, user_id: str, task: Dict[str, Any]) -> int:
+        """ 写入一条任务（标题 + 描述） """
+        return self.add_text(user_id, self._task_text(task), self._task_meta(task))
+
+    def remove_task(self, user_id: str, task_id: str) -> int:
+        """ 删除该任务的全部片段，返回删除的片段数 """
+        store = self.store(user_id)
+        with self._locks[user_id]:
+            rows = store.find("task_id", task_id)
+            store.delete(rows)
+        return len(rows)
+
+    def upsert_task(self, user_id: str, task: Dict[str, Any]) -> int:
+        """ 任务创建或状态变化时调用：在同一次加锁内替换该任务已有的片段，检索不会看到中间状态 """
+        vectors, metas = self._embed(self._task_text(task), self._task_meta(task))
+        store = self.store(user_id)
+        with self._locks[user_id]:
+            store.delete(store.find("task_id", task.get("id")))
+            if metas:
+                store.add(vectors, metas)
+        return len(metas)
+
+    def retrieve(self, user_id: str, query: str, top_k: Optional[int] = None,
+                 min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """ 检索与 query 最相关的片段；相似度不高于 min_score 的片段视为无关，不返回
+
+        Returns:
+            List[Dict]: 片段元数据（含 text 与 score），按相似度降序
+        """
+        store = self.store(user_id)
+        if not len(store) or not query.strip():
+            return []
+        query_vec = self.embedder.embed([query])[0]
+        with self._locks[user_id]:
+            hits = store.search(query_vec, top_k or self.top_k)
+        return [{**meta, "score": score} for score, meta in hits if score > min_score]
+
+    def build_context(self, user_id: str, query: str, top_k: Optional[int] = None) -> str:
+        """ 检索并拼接为可直接放入 Prompt 的参考文本 """
+        return "\n".join(f"- {hit['text']}" for hit in self.retrieve(user_id, query, top_k))
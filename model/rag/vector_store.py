@@ -0,0 +1,317 @@
+""" 基于连续 NumPy 矩阵的向量存储，支持内存映射持久化、删除与可选的 IVF 近似检索。 """
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .ivf_index import IVFIndex
+
+
+class VectorStore:
+    """ 向量存储
+
+    * 向量按行存放在一个连续的 float32 矩阵中，精确检索为一次矩阵乘法 + argpartition
+    * 指定 path 时，向量以原始二进制追加写入 vectors.f32，元数据逐行追加写入 meta.jsonl，
+      删除的行号逐行追加写入 deleted.txt；启动时通过 np.memmap 映射向量文件，无需重新计算向量
+    * 有效向量数达到 ann_threshold 后自动构建 IVF 索引并改用近似检索；索引保存在 ivf/ 目录，
+      启动时只需把保存之后新增 / 删除的行补到索引上
+    * 自动构建（及规模增长后的重新训练）在后台线程中对当时的快照进行，不阻塞写入与检索；
+      完成后由下一次 add / delete / search 补上构建期间的增量并换入新索引，在此之前沿用原来的检索方式
+    * 不持久化时向量写入按容量翻倍增长的缓冲区，追加为均摊 O(1)
+
+    本类不加锁，调用方（Retriever）负责同一存储的读写串行；后台构建只读取快照，结果通过一次属性赋值交回
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, ann_threshold: int = 0, nprobe: int = 16):
+        """ 初始化
+
+        Args:
+            dim (int): 向量维度
+            path (str): 持久化目录，为 None 时仅保存在内存中
+            ann_threshold (int): 有效向量数达到该值后启用 IVF 索引，0 表示始终精确检索
+            nprobe (int): IVF 检索访问的聚类数
+        """
+        self.dim = dim
+        self.path = path
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.meta: List[Dict[str, Any]] = []
+        self.deleted: set = set()
+        self._task_rows: Dict[Any, List[int]] = {}   # task_id -> 行号，find("task_id", ...) 不必扫描 meta
+        self.index: Optional[IVFIndex] = None
+        self._index_rows = 0                    # 已保存的索引覆盖到的行数
+        self._builder: Optional[threading.Thread] = None
+        self._built: Optional[Tuple[IVFIndex, int]] = None   # 后台构建完成、待换入的 (索引, 覆盖的行数)
+
+        # 持久化时为向量文件的 memmap（追加后按需重新映射）；否则为容量翻倍的缓冲区，前 len(meta) 行有效
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._stale = False                     # memmap 是否落后于向量文件
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def __len__(self) -> int:
+        """ 有效（未删除）向量数 """
+        return len(self.meta) - len(self.deleted)
+
+    @property
+    def _vector_file(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "meta.jsonl")
+
+    @property
+    def _deleted_file(self) -> str:
+        return os.path.join(self.path, "deleted.txt")
+
+    @property
+    def _index_dir(self) -> str:
+        return os.path.join(self.path, "ivf")
+
+    def _load(self):
+        """ 映射已有的向量文件；两个文件行数不一致时（写入中途崩溃）以较短者为准 """
+        if os.path.exists(self._meta_file):
+            with open(self._meta_file, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.meta.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+
+        rows = os.path.getsize(self._vector_file) // (self.dim * 4) if os.path.exists(self._vector_file) else 0
+        rows = min(rows, len(self.meta))
+        del self.meta[rows:]
+        if rows:
+            self._matrix = np.memmap(self._vector_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+        if os.path.exists(self._deleted_file):
+            with open(self._deleted_file, encoding="utf-8") as f:
+                self.deleted = {int(line) for line in f if line.strip() and int(line) < rows}
+        self._track(0, self.meta)
+
+        if os.path.exists(os.path.join(self._index_dir, "rows")):
+            with open(os.path.join(self._index_dir, "rows"), encoding="utf-8") as f:
+                self._index_rows = min(int(f.read()), rows)
+            self.index = IVFIndex.load(self._index_dir)
+            self.index.nprobe = self.nprobe
+            # 补上索引保存之后的增量
+            tail = [r for r in range(self._index_rows, rows) if r not in self.deleted]
+            if tail:
+                self.index.add(np.array(tail), self._matrix[tail])
+            self.index.remove([r for r in self.deleted if r in self.index])
+
+    def add(self, vectors: np.ndarray, metas: List[Dict[str, Any]]):
+        """ 追加向量
+
+        Args:
+            vectors (np.ndarray): 形状为 (n, dim) 的已归一化向量
+            metas (List[Dict]): 每个向量对应的元数据（需可 JSON 序列化）
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(metas):
+            raise ValueError("vectors 与 metas 数量不一致")
+        if not len(vectors):
+            return
+
+        if self.path:
+            # 先写向量再写元数据：崩溃时多出的向量会在加载时被截掉
+            with open(self._vector_file, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._meta_file, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(m, ensure_ascii=False) + "\n" for m in metas)
+
+        first = len(self.meta)
+        if self.path:
+            self._stale = True
+        else:
+            self._append(first, vectors)
+        self.meta.extend(metas)
+        self._track(first, metas)
+
+        self._install_built()
+        if self.index is not None:
+            self.index.add(np.arange(first, first + len(vectors)), vectors)
+            # 规模已远超训练时的规模，聚类不再均衡，重新训练
+            if len(self) > 4 * self.index.trained_size:
+                self.build_index(background=True)
+        elif self.ann_threshold and len(self) >= self.ann_threshold:
+            self.build_index(background=True)
+
+    def _append(self, first: int, vectors: np.ndarray):
+        """ 写入内存缓冲区，容量不足时翻倍 """
+        end = first + len(vectors)
+        if end > len(self._matrix):
+            grown = np.empty((max(end, 2 * len(self._matrix), 16), self.dim), dtype=np.float32)
+            grown[:first] = self._matrix[:first]
+            self._matrix = grown
+        self._matrix[first:end] = vectors
+
+    def delete(self, rows: List[int]):
+        """ 按行号删除（标记删除，向量文件不回收空间） """
+        rows = [r for r in rows if 0 <= r < len(self.meta) and r not in self.deleted]
+        if not rows:
+            return
+        if self.path:
+            with open(self._deleted_file, "a", encoding="utf-8") as f:
+                f.writelines(f"{r}\n" for r in rows)
+        self.deleted.update(rows)
+        self._install_built()
+        for row in rows:
+            task_rows = self._task_rows.get(self.meta[row].get("task_id"))
+            if task_rows is not None and row in task_rows:
+                task_rows.remove(row)
+                if not task_rows:
+                    del self._task_rows[self.meta[row]["task_id"]]
+        if self.index is not None:
+            self.index.remove(rows)
+
+    def _track(self, first: int, metas: List[Dict[str, Any]]):
+        """ 把从 first 行开始的元数据登记到 task_id -> 行号的映射（跳过已删除的行） """
+        for row, meta in enumerate(metas, first):
+            task_id = meta.get("task_id")
+            if task_id is not None and row not in self.deleted:
+                self._task_rows.setdefault(task_id, []).append(row)
+
+    def find(self, key: str, value: Any) -> List[int]:
+        """ 查找元数据中 key == value 的有效行号；按 task_id 查找为 O(该任务的片段数) """
+        if key == "task_id" and value is not None:
+            return list(self._task_rows.get(value, ()))
+        return [row for row, meta in enumerate(self.meta) if meta.get(key) == value and row not in self.deleted]
+
+    def build_index(self, background: bool = False):
+        """ 用全部有效向量训练并构建 IVF 索引，持久化时一并保存
+
+        Args:
+            background (bool): 为 True 时在后台线程中构建（已有构建在进行时不重复发起），完成后由之后的操作换入
+        """
+        if background and self._builder is not None and self._builder.is_alive():
+            return
+        rows = len(self.meta)
+        matrix = self.matrix()[:rows]
+        alive = np.array([r for r in range(rows) if r not in self.deleted], dtype=np.int64)
+        if not background:
+            if self._builder is not None:
+                self._builder.join()
+            self._built = None
+            self.index = self._train(alive, matrix, rows)
+            return
+        # 快照中的行不会再被修改：内存缓冲区扩容时旧数组仍被快照引用，向量文件只追加
+        self._builder = threading.Thread(target=self._build_in_background, args=(alive, matrix, rows),
+                                         name="ivf-builder", daemon=True)
+        self._builder.start()
+
+    def _train(self, alive: np.ndarray, matrix: np.ndarray, rows: int) -> IVFIndex:
+        index = IVFIndex(self.dim, nprobe=self.nprobe)
+        index.rebuild(alive, matrix[alive])
+        self._save(index, rows)
+        return index
+
+    def _build_in_background(self, alive: np.ndarray, matrix: np.ndarray, rows: int):
+        self._built = (self._train(alive, matrix, rows), rows)
+
+    def _install_built(self):
+        """ 换入后台构建完成的索引：补上构建期间新增的行，去掉期间删除的行 """
+        built, self._built = self._built, None
+        if built is None:
+            return
+        index, rows = built
+        tail = [r for r in range(rows, len(self.meta)) if r not in self.deleted]
+        if tail:
+            index.add(np.array(tail), self.matrix()[tail])
+        index.remove([r for r in self.deleted if r in index])
+        self.index = index
+
+    def wait_index(self):
+        """ 等待后台构建结束并换入索引（测试与基准中使用） """
+        if self._builder is not None:
+            self._builder.join()
+        self._install_built()
+
+    def save_index(self):
+        """ 保存 IVF 索引，记录其覆盖的行数 """
+        if self.index is not None:
+            self._save(self.index, len(self.meta))
+
+    def _save(self, index: IVFIndex, rows: int):
+        if not self.path:
+            return
+        index.save(self._index_dir)
+        with open(os.path.join(self._index_dir, "rows"), "w", encoding="utf-8") as f:
+            f.write(str(rows))
+        self._index_rows = rows
+
+    def matrix(self) -> np.ndarray:
+        """ 返回全部向量（含已删除的行）组成的矩阵（持久化时按需重新映射向量文件） """
+        if not self.path:
+            return self._matrix[:len(self.meta)]
+        if self._stale:
+            # 重新映射整个文件，新向量也由操作系统页缓存管理
+            self._matrix = np.memmap(self._vector_file, dtype=np.float32, mode="r",
+                                     shape=(len(self.meta), self.dim))
+            self._stale = False
+        return self._matrix
+
+    def search(self, query: np.ndarray, top_k: int = 3, exact: bool = False) -> List[Tuple[float, Dict[str, Any]]]:
+        """ 余弦相似度 top-k 检索
+
+        Args:
+            query (np.ndarray): 形状为 (dim,) 的已归一化查询向量
+            top_k (int): 返回条数
+            exact (bool): 为 True 时即使已建索引也做精确检索
+
+        Returns:
+            List[Tuple[float, Dict]]: 按相似度降序的 (分数, 元数据)
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        self._install_built()
+        k = min(top_k, len(self))
+        if k <= 0:
+            return []
+
+        if self.index is not None and not exact:
+            scores, rows = self.index.search(query, k)
+            return [(float(score), self.meta[row]) for score, row in zip(scores, rows)]
+
+        scores = self.matrix() @ query
+        if self.deleted:
+            scores[list(self.deleted)] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.meta[i]) for i in top]
+
+
+if __name__ == "__main__":
+    # 检索基准：python -m rag.vector_store [行数] [维度]
+    import sys
+    import tempfile
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = VectorStore(dim, tmp)
+        start = time.perf_counter()
+        for offset in range(0, n, 100_000):
+            batch = rng.standard_normal((min(100_000, n - offset), dim), dtype=np.float32)
+            batch /= np.linalg.norm(batch, axis=1, keepdims=True)
+            store.add(batch, [{"i": offset + i} for i in range(len(batch))])
+        print(f"写入 {n} 条 x {dim} 维: {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        reopened = VectorStore(dim, tmp)
+        print(f"重新加载（memmap）: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        queries = rng.standard_normal((20, dim), dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        reopened.search(queries[0])     # 预热页缓存
+        start = time.perf_counter()
+        for q in queries:
+            reopened.search(q, top_k=3)
+        print(f"top-3 检索: {(time.perf_counter() - start) / len(queries) * 1000:.1f} ms/次")
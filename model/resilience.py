@@ -0,0 +1,320 @@
+""" 上游调用的弹性策略：按错误类型区分的重试、指数退避 + 抖动、重试预算与按模型熔断。 """
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import API_CONFIG, RESILIENCE_CONFIG
+
+
+class UpstreamError(Exception):
+    """ 上游调用失败
+
+    Args:
+        message (str): 错误信息
+        status (int): HTTP 状态码（如有）
+        retryable (bool): 是否值得重试（超时、连接失败、429、5xx）
+        retry_after (float): 上游建议的重试等待时间（秒）
+    """
+
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_status(cls, status: int, message: str = "", retry_after: Optional[float] = None) -> "UpstreamError":
+        """ 按 HTTP 状态码构造：408 / 429 / 5xx 可重试，其余 4xx 不重试 """
+        retryable = status in (408, 429) or status >= 500
+        return cls(message or f"上游返回 HTTP {status}", status, retryable, retry_after)
+
+
+class ResponseParseError(UpstreamError):
+    """ 上游返回了内容，但无法解析（如 JSON 不合法）；上游本身是健康的，不计入熔断 """
+
+
+class CircuitOpenError(UpstreamError):
+    """ 该模型处于熔断状态，直接失败而不发起请求 """
+
+
+def classify(exc: BaseException) -> str:
+    """ 错误分类
+
+    Returns:
+        str: "transient"（网络 / 上游过载，退避后重试）、"parse"（解析失败，立即有限重试）、
+             "fatal"（请求本身有误或熔断中，不重试）
+    """
+    if isinstance(exc, CircuitOpenError):
+        return "fatal"
+    if isinstance(exc, ResponseParseError):
+        return "parse"
+    if isinstance(exc, UpstreamError):
+        return "transient" if exc.retryable else "fatal"
+    # requests / httpx 的超时与连接错误最终都继承自 OSError 或 TimeoutError
+    if isinstance(exc, (TimeoutError, ConnectionError, OSError, asyncio.TimeoutError)):
+        return "transient"
+    return "fatal"
+
+
+class RetryBudget:
+    """ 重试预算：每个正常请求存入 ratio 个令牌，每次重试取出 1 个，避免上游故障时重试流量放大 """
+
+    def __init__(self, ratio: float = 0.2, min_per_sec: float = 1.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.capacity = max(min_per_sec * window, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.min_per_sec)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """ 熔断器：closed -> (失败率过高) -> open -> (reset_timeout 后) -> half_open -> (探测成功) -> closed """
+
+    def __init__(self, failure_threshold: float = 0.5, window_size: int = 20, min_calls: int = 5,
+                 reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._results: deque = deque(maxlen=window_size)    # True 表示失败
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[str]:
+        """ 申请放行本次请求；半开状态下同一时刻只放行一个探测请求
+
+        Returns:
+            str: "call"（正常放行）、"probe"（半开状态下的探测请求，结束时须 release），拒绝时为 None
+        """
+        with self._lock:
+            if self.state == "closed":
+                return "call"
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return "probe"
+            return None
+
+    def allow(self) -> bool:
+        """ 是否放行本次请求（放行的探测请求须在结束时 record 或 release） """
+        return self.acquire() is not None
+
+    def available(self) -> bool:
+        """ 是否可以接收请求：未熔断，或熔断已超过 reset_timeout、下一个请求会作为探测放行（不改变状态） """
+        with self._lock:
+            return self.state != "open" or time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def release(self, ticket: Optional[str]):
+        """ 请求结束但没有给出结论（被取消、调用方提前退出）：归还探测名额，让下一个请求继续探测 """
+        if ticket != "probe":
+            return
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def record(self, failed: bool):
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = "closed"
+                    self._results.clear()
+                return
+
+            self._results.append(failed)
+            if (len(self._results) >= self.min_calls
+                    and sum(self._results) / len(self._results) >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._results.clear()
+
+
+class Resilience:
+    """ 重试 + 熔断的调用包装，供 backend 与 model 两个 LLM 客户端共用 """
+
+    def __init__(self, max_attempts: int = API_CONFIG["retry_times"], base_delay: float = 0.5,
+                 max_delay: float = 8.0, deadline: float = 45.0, parse_retries: int = 1,
+                 budget_ratio: float = 0.2, budget_min_per_sec: float = 1.0,
+                 failure_threshold: float = 0.5, window_size: int = 20, min_calls: int = 5,
+                 reset_timeout: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.parse_retries = parse_retries
+        self.budget = RetryBudget(budget_ratio, budget_min_per_sec)
+        self._breaker_args = (failure_threshold, window_size, min_calls, reset_timeout)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "short_circuited": 0, "budget_exhausted": 0}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """ 获取该模型的熔断器 """
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(model, CircuitBreaker(*self._breaker_args))
+        return breaker
+
+    def backoff(self, attempt: int, exc: BaseException) -> float:
+        """ 第 attempt 次失败后的等待时间：指数退避 + 全抖动，上游给出 Retry-After 时以其为下限 """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        retry_after = getattr(exc, "retry_after", None)
+        return max(delay, retry_after or 0.0)
+
+    def _count(self, name: str):
+        # 同步调用运行在线程池中，计数需要加锁
+        with self._lock:
+            self.counters[name] += 1
+
+    @contextmanager
+    def guard(self, model: str, transient: tuple = ()):
+        """ 只做熔断检查与结果记录、不重试的调用（如流式请求）
+
+        被取消或调用方提前关闭（CancelledError / GeneratorExit）时不给出结论，只归还探测名额
+
+        Args:
+            model (str): 模型名称
+            transient (tuple): 额外视为上游故障的异常类型（如 httpx.TransportError）
+        """
+        breaker = self.breaker(model)
+        ticket = breaker.acquire()
+        if ticket is None:
+            self._count("short_circuited")
+            raise CircuitOpenError(f"模型 {model} 熔断中，请稍后再试")
+        try:
+            yield
+        except Exception as e:
+            breaker.record(isinstance(e, transient) or classify(e) == "transient")
+            raise
+        else:
+            breaker.record(False)
+        finally:
+            breaker.release(ticket)
+
+    def _next_delay(self, model: str, attempt: int, max_attempts: int, parse_failures: int,
+                    exc: BaseException, started: float) -> Optional[float]:
+        """ 决定是否重试：返回等待秒数，不再重试时返回 None """
+        kind = classify(exc)
+        if kind == "transient":
+            self.breaker(model).record(True)
+        elif not isinstance(exc, CircuitOpenError):
+            # 解析失败与 400 / 401 等请求本身的错误说明上游有响应，对熔断器而言是成功
+            self.breaker(model).record(False)
+
+        if kind == "fatal" or attempt >= max_attempts:
+            return None
+        if kind == "parse" and parse_failures > self.parse_retries:
+            return None
+
+        delay = self.backoff(attempt, exc) if kind == "transient" else 0.0
+        if time.monotonic() - started + delay > self.deadline:
+            return None
+        if not self.budget.withdraw():
+            self._count("budget_exhausted")
+            return None
+        self._count("retries")
+        return delay
+
+    def call(self, model: str, fn: Callable[[], Any], max_attempts: Optional[int] = None) -> Any:
+        """ 同步调用 fn，按策略重试；最终失败时抛出最后一次的异常
+
+        Args:
+            model (str): 模型名称，决定使用哪个熔断器
+            fn (Callable): 发起一次请求的函数
+            max_attempts (int): 覆盖默认的最大尝试次数
+        """
+        self._count("calls")
+        self.budget.deposit()
+        started, attempt, parse_failures = time.monotonic(), 0, 0
+        max_attempts = max_attempts or self.max_attempts
+        breaker = self.breaker(model)
+        while True:
+            ticket = breaker.acquire()
+            if ticket is None:
+                self._count("short_circuited")
+                raise CircuitOpenError(f"模型 {model} 熔断中，请稍后再试")
+            attempt += 1
+            try:
+                result = fn()
+            except Exception as e:
+                parse_failures += classify(e) == "parse"
+                delay = self._next_delay(model, attempt, max_attempts, parse_failures, e, started)
+                if delay is None:
+                    self._count("failures")
+                    raise
+            else:
+                breaker.record(False)
+                return result
+            finally:
+                # 每条退出路径都归还探测名额（已记录结论时为空操作）
+                breaker.release(ticket)
+            time.sleep(delay)
+
+    async def acall(self, model: str, fn: Callable[[], Awaitable[Any]], max_attempts: Optional[int] = None) -> Any:
+        """ 异步版本的 call，退避期间不阻塞事件循环；被取消时归还探测名额 """
+        self._count("calls")
+        self.budget.deposit()
+        started, attempt, parse_failures = time.monotonic(), 0, 0
+        max_attempts = max_attempts or self.max_attempts
+        breaker = self.breaker(model)
+        while True:
+            ticket = breaker.acquire()
+            if ticket is None:
+                self._count("short_circuited")
+                raise CircuitOpenError(f"模型 {model} 熔断中，请稍后再试")
+            attempt += 1
+            try:
+                result = await fn()
+            except Exception as e:
+                parse_failures += classify(e) == "parse"
+                delay = self._next_delay(model, attempt, max_attempts, parse_failures, e, started)
+                if delay is None:
+                    self._count("failures")
+                    raise
+            else:
+                breaker.record(False)
+                return result
+            finally:
+                # 每条退出路径都归还探测名额（已记录结论时为空操作）
+                breaker.release(ticket)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "breakers": {model: b.state for model, b in self._breakers.items()}}
+
+
+# 进程内共享的实例：同一模型的熔断状态对所有客户端可见
+shared = Resilience(**RESILIENCE_CONFIG)
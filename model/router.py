@@ -0,0 +1,294 @@
+""" 多模型路由：按请求类别选择满足延迟 SLO 的最便宜模型，并在请求慢于 p95 时向第二个模型发出对冲请求，先返回者胜出。 """
+import asyncio
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import ROUTER_CONFIG
+from resilience import Resilience, RetryBudget, classify, shared as shared_resilience
+
+# 标准正态分布的 95 分位点
+Z95 = 1.645
+
+
+class ModelStats:
+    """ 某个模型在某类请求上的滚动统计
+
+    延迟取对数后做指数加权的均值与方差（LLM 延迟近似对数正态，长尾明显），p95 = exp(均值 + 1.645 × 标准差)；
+    错误率同样按指数加权，成功记 0、失败记 1。
+    """
+
+    __slots__ = ("mean", "var", "error_rate", "samples", "updated")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.updated = 0.0
+
+    def observe(self, latency: float, alpha: float):
+        self._update(math.log(max(latency, 1e-3)), alpha)
+
+    def observe_censored(self, elapsed: float, alpha: float):
+        """ 请求在 elapsed 秒时被取消，真实延迟只知道更长：按当前分布取 log 延迟在 elapsed 之上的条件期望 """
+        c = math.log(max(elapsed, 1e-3))
+        std = math.sqrt(self.var)
+        if self.samples == 0 or std == 0.0:
+            self._update(c, alpha)
+            return
+        a = (c - self.mean) / std
+        tail = 0.5 * math.erfc(a / math.sqrt(2))
+        density = math.exp(-a * a / 2) / math.sqrt(2 * math.pi)
+        # 远在尾部时 tail 下溢为 0，条件期望趋近于 c 本身
+        self._update(max(c, self.mean + std * density / tail) if tail > 1e-12 else c, alpha)
+
+    def _update(self, x: float, alpha: float):
+        if self.samples == 0:
+            self.mean = x
+        else:
+            diff = x - self.mean
+            incr = alpha * diff
+            self.mean += incr
+            self.var = (1 - alpha) * (self.var + diff * incr)
+        self.error_rate *= 1 - alpha
+        self.samples += 1
+        self.updated = time.monotonic()
+
+    def observe_error(self, alpha: float):
+        self.error_rate = (1 - alpha) * self.error_rate + alpha
+        self.updated = time.monotonic()
+
+    def p95(self) -> Optional[float]:
+        return math.exp(self.mean + Z95 * math.sqrt(self.var)) if self.samples else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {"p50": round(math.exp(self.mean), 3) if self.samples else None,
+                "p95": round(p95, 3) if p95 is not None else None,
+                "error_rate": round(self.error_rate, 3), "samples": self.samples}
+
+
+class Route:
+    """ 一次请求的路由结果
+
+    Args:
+        kind (str): 请求类别
+        primary (str): 首选模型
+        hedge (str): 对冲请求使用的模型，None 表示不对冲
+        hedge_delay (float): 首选模型多久没有返回就发出对冲请求（秒）
+    """
+
+    __slots__ = ("kind", "primary", "hedge", "hedge_delay")
+
+    def __init__(self, kind: str, primary: str, hedge: Optional[str], hedge_delay: float):
+        self.kind = kind
+        self.primary = primary
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+
+
+class ModelRouter:
+    """ 按请求类别路由到模型，供 backend 与 model 两个 LLM 客户端共用
+
+    每类请求（如 chat 快速对话、planning 多日任务规划）配置延迟 SLO 与候选模型。路由时按成本从低到高，
+    选第一个估算 p95 不超过 SLO、错误率不超过上限且未熔断的模型；都不满足时退而选 p95 最低的。
+    样本不足的模型视为满足 SLO；被判为不满足的模型在 probe_interval 秒内没有新样本时重新视为满足，
+    用真实请求探测它是否已恢复，避免一次变慢后永远拿不到流量。
+    """
+
+    def __init__(self, models: Dict[str, Dict[str, Any]], classes: Dict[str, Dict[str, Any]],
+                 alpha: float = 0.2, min_samples: int = 5, max_error_rate: float = 0.2,
+                 probe_interval: float = 60.0, hedge: bool = True, hedge_min_delay: float = 0.5,
+                 hedge_ratio: float = 0.1, resilience: Optional[Resilience] = None):
+        """ 初始化
+
+        Args:
+            models (Dict): 模型名 -> {"cost": 相对成本}
+            classes (Dict): 请求类别 -> {"slo": p95 延迟目标（秒）, "models": [候选模型]}
+            alpha (float): 指数加权系数，越大越偏重最近的样本
+            min_samples (int): 估算 p95 所需的最少样本数
+            max_error_rate (float): 错误率超过该值的模型不参与路由
+            probe_interval (float): 不满足条件的模型多久没有样本后重新探测（秒）
+            hedge (bool): 是否发出对冲请求
+            hedge_min_delay (float): 对冲等待时间的下限（秒），避免 p95 很低时几乎每个请求都对冲
+            hedge_ratio (float): 对冲请求最多占请求数的比例（与重试共用 RetryBudget 的实现）
+            resilience (Resilience): 用于查询各模型熔断状态
+        """
+        for kind, spec in classes.items():
+            unknown = [m for m in spec["models"] if m not in models]
+            if unknown:
+                raise ValueError(f"请求类别 {kind} 的候选模型未配置成本: {unknown}")
+        self.models = models
+        self.classes = classes
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.probe_interval = probe_interval
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.budget = RetryBudget(hedge_ratio)
+        self.resilience = resilience or shared_resilience
+        self._stats: Dict[tuple, ModelStats] = {}
+        self._lock = threading.Lock()
+        self.counters = {"routed": 0, "fallback": 0, "hedged": 0, "hedge_won": 0, "hedge_skipped": 0}
+        self.routes: Dict[tuple, int] = {}  # (类别, 模型) -> 路由次数
+
+    def default_model(self, kind: str) -> str:
+        """ 该类别成本最低的候选模型（不看统计，用于展示与缓存键等需要稳定名称的场合） """
+        return min(self.classes[kind]["models"], key=lambda m: self.models[m]["cost"])
+
+    def stats(self, model: str, kind: str) -> ModelStats:
+        key = (model, kind)
+        stats = self._stats.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(key, ModelStats())
+        return stats
+
+    def _meets_slo(self, model: str, kind: str, now: float) -> bool:
+        if not self.resilience.breaker(model).available():
+            return False
+        stats = self.stats(model, kind)
+        if stats.samples < self.min_samples or now - stats.updated > self.probe_interval:
+            return True
+        return stats.p95() <= self.classes[kind]["slo"] and stats.error_rate <= self.max_error_rate
+
+    def _fastest(self, models: List[str], kind: str) -> Optional[str]:
+        """ 不满足 SLO 时的退路：未熔断的模型中估算 p95 最低的（没有样本的视为 0） """
+        alive = [m for m in models if self.resilience.breaker(m).available()] or models
+        if not alive:
+            return None
+        return min(alive, key=lambda m: (self.stats(m, kind).p95() or 0.0, self.models[m]["cost"]))
+
+    def route(self, kind: str, model: Optional[str] = None) -> Route:
+        """ 为一次请求选择首选模型与对冲模型
+
+        Args:
+            kind (str): 请求类别
+            model (str): 调用方指定的模型；指定时不路由、不对冲，但调用结果仍计入该模型的统计
+        """
+        if kind not in self.classes:
+            raise ValueError(f"未知的请求类别: {kind}")
+        if model is not None:
+            return Route(kind, model, None, 0.0)
+        now = time.monotonic()
+        candidates = sorted(self.classes[kind]["models"], key=lambda m: self.models[m]["cost"])
+        eligible = [m for m in candidates if self._meets_slo(m, kind, now)]
+
+        if eligible:
+            primary = eligible[0]
+        else:
+            primary = self._fastest(candidates, kind)
+            self.counters["fallback"] += 1
+        rest = [m for m in candidates if m != primary]
+        hedge = next((m for m in eligible if m != primary), None) or self._fastest(rest, kind)
+
+        stats = self.stats(primary, kind)
+        p95 = stats.p95() if stats.samples >= self.min_samples else None
+        delay = max(self.hedge_min_delay, p95 if p95 is not None else self.classes[kind]["slo"])
+
+        self.counters["routed"] += 1
+        self.budget.deposit()
+        with self._lock:
+            self.routes[(kind, primary)] = self.routes.get((kind, primary), 0) + 1
+        return Route(kind, primary, hedge if self.hedge else None, delay)
+
+    def record(self, model: str, kind: str, latency: Optional[float] = None, error: Optional[BaseException] = None,
+               censored: bool = False):
+        """ 记录一次调用的结果：成功时记录延迟；上游故障（超时、连接失败、429 / 5xx）计入错误率，
+        请求本身有误或被熔断拒绝的不计入；censored 表示请求在 latency 秒时被取消，真实延迟更长 """
+        stats = self.stats(model, kind)
+        with self._lock:
+            if censored:
+                stats.observe_censored(latency, self.alpha)
+            elif error is None:
+                stats.observe(latency, self.alpha)
+            elif classify(error) == "transient":
+                stats.observe_error(self.alpha)
+
+    def call(self, route: Route, fn: Callable[[str], Any]) -> Any:
+        """ 同步调用首选模型并记录结果（同步调用无法取消，不对冲）
+
+        Args:
+            route (Route): route() 的结果
+            fn (Callable): 以模型名为参数发起一次调用（含重试）
+        """
+        start = time.perf_counter()
+        try:
+            result = fn(route.primary)
+        except Exception as e:
+            self.record(route.primary, route.kind, error=e)
+            raise
+        self.record(route.primary, route.kind, time.perf_counter() - start)
+        return result
+
+    async def acall(self, route: Route, fn: Callable[[str], Awaitable[Any]]) -> Any:
+        """ 异步调用：首选模型超过 hedge_delay 秒未返回时，向对冲模型发出相同的请求，先成功者胜出，另一个被取消
+
+        一方失败时继续等待另一方；都失败时抛出首选模型的异常。被取消的请求也记一个延迟样本（按已等待的时长
+        截尾估计，见 ModelStats.observe_censored），否则总被对冲掉的慢模型永远不会显得慢。
+
+        Args:
+            route (Route): route() 的结果
+            fn (Callable): 以模型名为参数发起一次调用（含重试）
+        """
+        async def attempt(model: str):
+            start = time.perf_counter()
+            try:
+                result = await fn(model)
+            except asyncio.CancelledError:
+                # 对冲落败被取消：只记截尾延迟；若它是半开探测，Resilience.acall 会归还探测名额、不给出结论
+                self.record(model, route.kind, time.perf_counter() - start, censored=True)
+                raise
+            except Exception as e:
+                self.record(model, route.kind, error=e)
+                raise
+            self.record(model, route.kind, time.perf_counter() - start)
+            return result
+
+        primary = asyncio.ensure_future(attempt(route.primary))
+        if route.hedge is None:
+            return await primary
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=route.hedge_delay)
+            if done:
+                return primary.result()
+            if not self.budget.withdraw():
+                self.counters["hedge_skipped"] += 1
+                return await primary
+
+            self.counters["hedged"] += 1
+            hedge = asyncio.ensure_future(attempt(route.hedge))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_won"] += 1
+                        return task.result()
+            raise primary.exception()
+        finally:
+            # 胜者已返回或调用方被取消：取消仍在进行的请求
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ 各类别各模型的统计与路由次数 """
+        classes = {}
+        for kind, spec in self.classes.items():
+            classes[kind] = {"slo": spec["slo"], "models": {
+                model: {**self.stats(model, kind).to_dict(), "cost": self.models[model]["cost"],
+                        "routed": self.routes.get((kind, model), 0),
+                        "circuit": self.resilience.breaker(model).state}
+                for model in spec["models"]
+            }}
+        return {**self.counters, "classes": classes}
+
+
+# 进程内共享的实例：两个客户端看到同一份延迟统计
+shared = ModelRouter(**ROUTER_CONFIG)
@@ -0,0 +1,185 @@
+""" 有界的对话历史存储：按会话限制 token 预算，超出时把较早的轮次压缩为摘要。 """
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """ 粗略估计 token 数：中日韩字符按 1 字 1 token，其余字符按 4 字符 1 token。 """
+    cjk = sum(1 for ch in text if "㐀" <= ch <= "鿿" or "豈" <= ch <= "﫿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def extractive_summary(previous: str, messages: List[Dict[str, str]], max_chars: int = 80) -> str:
+    """ 默认的本地摘要：每条消息截取前 max_chars 个字符，追加到已有摘要之后，不额外调用 LLM。 """
+    names = {"user": "用户", "assistant": "助手"}
+    lines = [previous] if previous else []
+    for msg in messages:
+        content = msg["content"].replace("\n", " ")
+        if len(content) > max_chars:
+            content = content[:max_chars] + "…"
+        lines.append(f"{names.get(msg['role'], msg['role'])}：{content}")
+    return "\n".join(lines)
+
+
+class Session:
+    """ 单个用户的会话 """
+
+    __slots__ = ("system", "summary", "turns", "tokens", "summary_tokens", "last_active",
+                 "raw_tokens", "raw_bytes", "tokens_saved", "compactions")
+
+    def __init__(self, system: str):
+        self.system = system                        # system prompt（不含日期等易变内容，所有会话共享同一个字符串对象）
+        self.summary = ""                           # 已压缩轮次的摘要
+        self.turns: List[Dict[str, str]] = []       # 尚未压缩的消息
+        self.tokens = 0                             # turns 的 token 数
+        self.summary_tokens = 0
+        self.last_active = time.monotonic()
+
+        self.raw_tokens = 0                         # 不压缩时历史的 token 数
+        self.raw_bytes = 0                          # 不压缩时历史占用的字符串内存
+        self.tokens_saved = 0                       # 历次请求累计少发送的 token 数
+        self.compactions = 0
+
+    def history_tokens(self) -> int:
+        return self.tokens + self.summary_tokens
+
+
+class SessionStore:
+    """
+    对话历史存储
+
+    * 每个会话只追加消息，不再整体复制消息列表
+    * 历史 token 超出预算时，把较早的消息压缩为一段摘要（summary），只保留最近 keep_recent 条原文
+    * 会话按最近活跃时间排序（LRU），超出 max_sessions 或空闲超过 idle_ttl 的会话被淘汰
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 1800, token_budget: int = 4000,
+                 keep_recent: int = 6, summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None,
+                 counter: Callable[[str], int] = estimate_tokens):
+        """ 初始化
+
+        Args:
+            max_sessions (int): 同时保留的会话数上限
+            idle_ttl (float): 会话空闲过期时间（秒）
+            token_budget (int): 每个会话历史（摘要 + 未压缩消息）的 token 预算
+            keep_recent (int): 压缩时至少保留的最近消息条数
+            summarizer (Callable): (已有摘要, 待压缩消息) -> 新摘要，默认使用本地截取摘要
+            counter (Callable): token 计数函数
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summarizer = summarizer or extractive_summary
+        self.counter = counter
+
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.evictions = 0
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: str) -> Optional[Session]:
+        """ 读取会话，已过期的会话视为不存在 """
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_active > self.idle_ttl:
+            self.pop(user_id)
+            self.evictions += 1
+            return None
+        return session
+
+    def get_or_create(self, user_id: str, system: str) -> Session:
+        """ 读取会话，不存在时以 system 为 system prompt 新建 """
+        session = self.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = Session(system)
+            self._evict()
+        session.last_active = time.monotonic()
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def pop(self, user_id: str) -> Optional[Session]:
+        return self._sessions.pop(user_id, None)
+
+    def messages(self, session: Session, pending: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
+        """ 组装发送给 LLM 的消息列表
+
+        Args:
+            session (Session): 会话
+            pending (Dict): 本轮尚未写入历史的用户消息
+
+        Returns:
+            [system, (摘要), *未压缩消息, (pending)]；列表中的消息对象与历史共享，不复制内容
+        """
+        messages = [{"role": "system", "content": session.system}]
+        if session.summary:
+            messages.append({"role": "system", "content": f"此前对话的摘要：\n{session.summary}"})
+        messages.extend(session.turns)
+        if pending is not None:
+            messages.append(pending)
+        session.tokens_saved += session.raw_tokens - session.history_tokens()
+        return messages
+
+    def append(self, session: Session, *messages: Dict[str, str]):
+        """ 在会话末尾追加消息，必要时压缩 """
+        for msg in messages:
+            tokens = self.counter(msg["content"])
+            session.turns.append(msg)
+            session.tokens += tokens
+            session.raw_tokens += tokens
+            session.raw_bytes += sys.getsizeof(msg["content"])
+        session.last_active = time.monotonic()
+
+        if session.history_tokens() > self.token_budget:
+            self._compact(session)
+
+    def _compact(self, session: Session):
+        """ 把最近 keep_recent 条之前的消息压缩进摘要 """
+        cut = len(session.turns) - self.keep_recent
+        if cut <= 0:
+            return
+        old, session.turns = session.turns[:cut], session.turns[cut:]
+        session.summary = self.summarizer(session.summary, old)
+        session.summary_tokens = self.counter(session.summary)
+
+        # 摘要本身最多占用一半预算，超出时丢弃最早的摘要行
+        lines = session.summary.split("\n")
+        while len(lines) > 1 and session.summary_tokens > self.token_budget // 2:
+            session.summary_tokens -= self.counter(lines.pop(0)) + 1
+        session.summary = "\n".join(lines)
+        session.summary_tokens = self.counter(session.summary)
+        session.tokens = sum(self.counter(msg["content"]) for msg in session.turns)
+        session.compactions += 1
+
+    def _evict(self):
+        """ 淘汰过期会话与超出容量的最久未活跃会话 """
+        now = time.monotonic()
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session.last_active <= self.idle_ttl:
+                break
+            del self._sessions[user_id]
+            self.evictions += 1
+
+    def stats(self, user_id: str) -> Optional[Dict[str, int]]:
+        """ 单个会话的节省情况：历史 token / 内存（不压缩 vs 当前），以及历次请求累计节省的 token """
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        current_bytes = sys.getsizeof(session.summary) + sum(sys.getsizeof(m["content"]) for m in session.turns)
+        return {
+            "history_tokens": session.history_tokens(),
+            "raw_history_tokens": session.raw_tokens,
+            "tokens_saved_total": session.tokens_saved,
+            "history_bytes": current_bytes,
+            "raw_history_bytes": session.raw_bytes,
+            "bytes_saved": max(session.raw_bytes - current_bytes, 0),
+            "compactions": session.compactions,
+        }
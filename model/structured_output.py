@@ -0,0 +1,295 @@
+""" LLM 结构化输出的容错解析：在本地修复常见的 JSON 缺陷，校验为带类型的任务模型，并报告被纠正的字段，减少整段重新请求。 """
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from resilience import ResponseParseError
+
+
+class Rewards(BaseModel):
+    """ 属性奖励 """
+    INT: int = 0
+    VIT: int = 0
+
+
+class PlannedTask(BaseModel):
+    """ 模型规划出的单个任务（兼容 SYSTEM_PROMPT 与 TASK_GENERATION_PROMPT 两种输出格式） """
+    title: str
+    description: str = ""
+    datetime: Optional[str] = None
+    estimated_time: int = 30
+    difficulty: int = 3
+    rewards: Optional[Rewards] = None
+    reward_exp: Optional[int] = None
+    recurrence: Optional[Dict[str, Any]] = None
+
+
+class TaskPlan(BaseModel):
+    """ 一次规划的输出 """
+    is_finished: bool = True
+    response: Optional[str] = None
+    tasks: List[PlannedTask] = []
+
+
+class ParsedPlan:
+    """ 解析结果
+
+    Args:
+        plan (TaskPlan): 校验后的规划
+        repairs (List[str]): 对原文做过的修复，如 "python_literal"、"trailing_comma"
+        coerced (List[Dict]): 被纠正的字段，[{"field": "tasks[0].estimated_time", "from": "30分钟", "to": 30}]
+        dropped (List[Dict]): 无法修复而丢弃的任务，[{"field": "tasks[2]", "error": "..."}]
+    """
+
+    __slots__ = ("plan", "repairs", "coerced", "dropped")
+
+    def __init__(self, plan: TaskPlan, repairs: List[str], coerced: List[Dict[str, Any]],
+                 dropped: List[Dict[str, Any]]):
+        self.plan = plan
+        self.repairs = repairs
+        self.coerced = coerced
+        self.dropped = dropped
+
+    @property
+    def clean(self) -> bool:
+        """ 原文无需任何修复即通过严格校验 """
+        return not (self.repairs or self.coerced or self.dropped)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.plan.model_dump(exclude_none=True), "repairs": self.repairs,
+                "coerced": self.coerced, "dropped": self.dropped}
+
+
+# 一次扫描即可识别的词法单元；字符串先于其它分支匹配，字符串内部的内容不会被误改
+_TOKEN = re.compile(r"""
+    "(?:\\.|[^"\\])*(?P<closed>")?   # 双引号字符串（允许在末尾被截断）
+  | '(?:\\.|[^'\\\n])*'             # 单引号字符串
+  | \b(?:True|False|None)\b         # Python 字面量（prompt 示例中的 False / None 常被照抄）
+  | ,(?=\s*[}\]])                   # 尾随逗号
+  | [{}\[\]]
+""", re.VERBOSE)
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_DANGLING_KEY = re.compile(r'(?:,|(?<=\{))\s*"(?:\\.|[^"\\])*"$')
+
+
+def repair_json(text: str) -> Tuple[str, List[str]]:
+    """ 修复常见的 JSON 缺陷：代码块标记与前后说明文字、Python 字面量、单引号、尾随逗号，以及输出被截断时未闭合的括号
+
+    Returns:
+        Tuple[str, List[str]]: 修复后的文本与所做修复的名称
+    """
+    repairs = []
+    stripped = _FENCE.sub("", text)
+    start = min((i for i in (stripped.find("{"), stripped.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return text, repairs
+    if len(stripped) != len(text) or stripped[:start].strip():
+        repairs.append("extracted")
+
+    out, stack, pos = [], [], start
+    for m in _TOKEN.finditer(stripped, start):
+        token = m.group()
+        out.append(stripped[pos:m.start()])
+        pos = m.end()
+        first = token[0]
+        if first == '"':
+            if m.group("closed") is None:
+                token = token.rstrip("\\") + '"'
+                repairs.append("unterminated_string")
+        elif first == "'":
+            token = '"' + token[1:-1].replace("\\'", "'").replace('"', '\\"') + '"'
+            repairs.append("single_quote")
+        elif first == ",":
+            token = ""
+            repairs.append("trailing_comma")
+        elif first in "{[":
+            stack.append(first)
+        elif first in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                # 顶层结构已闭合，之后的内容（说明文字等）全部丢弃
+                out.append(token)
+                if stripped[pos:].strip():
+                    repairs.append("extracted")
+                return "".join(out), _unique(repairs)
+        else:
+            token = _LITERALS[token]
+            repairs.append("python_literal")
+        out.append(token)
+    out.append(stripped[pos:])
+
+    if stack:
+        # 输出被 max_tokens 截断：去掉悬空的键、逗号，给悬空的冒号补 null，再补齐括号
+        body = "".join(out).rstrip()
+        if stack[-1] == "{":
+            body = _DANGLING_KEY.sub("", body)
+        if body.endswith(","):
+            body = body[:-1]
+        elif body.endswith(":"):
+            body += "null"
+        out = [body] + [_CLOSERS[ch] for ch in reversed(stack)]
+        repairs.append("truncated")
+    return "".join(out), _unique(repairs)
+
+
+def _unique(items: List[str]) -> List[str]:
+    return list(dict.fromkeys(items))
+
+
+def load_json(text: str) -> Tuple[Any, List[str]]:
+    """ 先按合法 JSON 直接解析，失败时再修复
+
+    Raises:
+        ResponseParseError: 修复后仍不是合法 JSON
+    """
+    try:
+        return json.loads(text), []
+    except json.JSONDecodeError:
+        pass
+    fixed, repairs = repair_json(text)
+    try:
+        return json.loads(fixed), repairs
+    except json.JSONDecodeError as e:
+        raise ResponseParseError(f"LLM 返回的不是合法 JSON: {e}") from e
+
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_HOURS = ("小时", "hour", "h")
+_BOOLS = {"true": True, "false": False, "是": True, "否": False}
+_INT_FIELDS = ("estimated_time", "difficulty", "reward_exp")
+
+
+def _to_int(value: Any, minutes: bool = False) -> Any:
+    """ 把 "30"、"30分钟"、"1.5小时"、30.0 之类的值转为整数；无法转换时原样返回
+
+    含多个数字的字符串（"1-5"、"难度（1-5）" 等照抄的范围或占位说明）不取其中某个数字，视为无法转换
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        return round(value)
+    if isinstance(value, str):
+        numbers = list(_NUMBER.finditer(value))
+        if len(numbers) == 1:
+            m = numbers[0]
+            number = float(m.group())
+            if minutes and any(unit in value[m.end():].strip().lower()[:4] for unit in _HOURS):
+                number *= 60
+            return round(number)
+    return value
+
+
+def coerce_task(task: Any, path: str = "task") -> Tuple[Optional[PlannedTask], List[Dict[str, Any]], Optional[str]]:
+    """ 校验单个任务；严格校验失败时逐字段纠正后再校验
+
+    Returns:
+        Tuple: (任务模型，无法修复时为 None；被纠正的字段；无法修复的原因)
+    """
+    try:
+        return PlannedTask.model_validate(task, strict=True), [], None
+    except ValidationError:
+        pass
+    if not isinstance(task, dict):
+        return None, [], f"任务不是对象: {type(task).__name__}"
+
+    task = dict(task)
+    coerced = []
+
+    def fix(container: Dict[str, Any], key: str, value: Any, field: str):
+        coerced.append({"field": field, "from": container[key], "to": value})
+        if value is None:
+            del container[key]
+        else:
+            container[key] = value
+
+    for key in _INT_FIELDS:
+        value = task.get(key)
+        if value is None or type(value) is int:
+            continue
+        value = _to_int(value, minutes=key == "estimated_time")
+        # 纠正不了的可选字段（如照抄的占位说明）退回默认值，而不是丢弃整个任务
+        fix(task, key, value if type(value) is int else None, f"{path}.{key}")
+
+    for key in ("title", "description", "datetime"):
+        value = task.get(key)
+        if value is not None and not isinstance(value, str):
+            fix(task, key, str(value), f"{path}.{key}")
+    if task.get("description", "") is None:
+        fix(task, "description", None, f"{path}.description")
+
+    rewards = task.get("rewards")
+    if isinstance(rewards, dict):
+        rewards = task["rewards"] = dict(rewards)
+        for key, value in list(rewards.items()):
+            if type(value) is not int:
+                value = _to_int(value)
+                fix(rewards, key, value if type(value) is int else None, f"{path}.rewards.{key}")
+    elif rewards is not None:
+        fix(task, "rewards", None, f"{path}.rewards")
+
+    if task.get("recurrence") is not None and not isinstance(task["recurrence"], dict):
+        fix(task, "recurrence", None, f"{path}.recurrence")
+
+    try:
+        return PlannedTask.model_validate(task), coerced, None
+    except ValidationError as e:
+        return None, coerced, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+def parse_task_plan(text: str) -> ParsedPlan:
+    """ 解析模型输出的任务规划
+
+    快速路径：合法 JSON 且严格校验通过时直接返回；否则修复原文、逐字段纠正，无法修复的单个任务被丢弃而不影响其它任务。
+
+    Raises:
+        ResponseParseError: 修复后仍不是合法 JSON，或顶层结构不是规划对象
+    """
+    data, repairs = load_json(text)
+    if isinstance(data, list):
+        data, repairs = {"tasks": data}, repairs + ["wrapped"]
+    if not isinstance(data, dict):
+        raise ResponseParseError(f"LLM 返回的 JSON 不是对象: {type(data).__name__}")
+
+    try:
+        return ParsedPlan(TaskPlan.model_validate(data, strict=True), repairs, [], [])
+    except ValidationError:
+        pass
+
+    coerced, dropped = [], []
+    data = dict(data)
+    finished = data.get("is_finished")
+    if isinstance(finished, str) and finished.strip().lower() in _BOOLS:
+        data["is_finished"] = _BOOLS[finished.strip().lower()]
+        coerced.append({"field": "is_finished", "from": finished, "to": data["is_finished"]})
+    elif finished is None:
+        data.pop("is_finished", None)
+    if data.get("response") is not None and not isinstance(data["response"], str):
+        data["response"] = json.dumps(data["response"], ensure_ascii=False)
+
+    tasks = data.pop("tasks", None)
+    if isinstance(tasks, dict):
+        tasks = [tasks]
+        coerced.append({"field": "tasks", "from": "object", "to": "array"})
+    elif tasks is not None and not isinstance(tasks, list):
+        raise ResponseParseError(f"tasks 不是数组: {type(tasks).__name__}")
+
+    valid = []
+    for i, task in enumerate(tasks or []):
+        model, fixes, error = coerce_task(task, f"tasks[{i}]")
+        coerced.extend(fixes)
+        if model is None:
+            dropped.append({"field": f"tasks[{i}]", "error": error})
+        else:
+            valid.append(model)
+
+    try:
+        plan = TaskPlan.model_validate(data)
+    except ValidationError as e:
+        raise ResponseParseError(f"LLM 返回的规划无法校验: {e}") from e
+    plan.tasks = valid
+    return ParsedPlan(plan, repairs, coerced, dropped)
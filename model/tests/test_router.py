@@ -0,0 +1,214 @@
+""" ModelRouter：按 SLO 路由、对冲请求，以及对冲与熔断器半开探测的交互 """
+import asyncio
+
+from resilience import ResponseParseError, Resilience, UpstreamError
+from router import ModelRouter
+
+
+def make_router(slo: float = 0.02, **options):
+    """ 两个模型；熔断后立即进入半开（reset_timeout=0）；首选模型样本不足时对冲等待 max(20ms, slo) """
+    resilience = Resilience(max_attempts=1, reset_timeout=0.0)
+    settings = dict(hedge_min_delay=0.02, resilience=resilience)
+    settings.update(options)
+    router = ModelRouter({"cheap": {"cost": 1.0}, "premium": {"cost": 4.0}},
+                         {"chat": {"slo": slo, "models": ["cheap", "premium"]}}, **settings)
+    return router, resilience
+
+
+def trip(resilience, model):
+    """ 连续失败使熔断器打开 """
+    breaker = resilience.breaker(model)
+    for _ in range(breaker.min_calls):
+        breaker.record(True)
+    assert breaker.state == "open"
+    return breaker
+
+
+def upstream(delays, cancelled=None):
+    """ 按模型延迟返回模型名的上游；被取消的模型记入 cancelled """
+    async def fn(model):
+        try:
+            await asyncio.sleep(delays[model])
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(model)
+            raise
+        return model
+    return fn
+
+
+def observe(router, model, latency, n=10):
+    for _ in range(n):
+        router.record(model, "chat", latency)
+
+
+# ---- 按 SLO 路由 ----
+
+def test_routes_to_cheapest_model_without_samples():
+    router, _ = make_router(slo=0.2)
+    assert router.route("chat").primary == "cheap"
+
+
+def test_slow_cheap_model_is_routed_around_and_comes_back():
+    router, _ = make_router(slo=0.2)
+    observe(router, "cheap", 0.5)
+    observe(router, "premium", 0.05)
+
+    route = router.route("chat")
+    assert (route.primary, route.hedge) == ("premium", "cheap")
+
+    # 指数加权：便宜模型恢复后若干个快样本即可把估算的 p95 拉回 SLO 以内
+    observe(router, "cheap", 0.05, n=30)
+    assert router.route("chat").primary == "cheap"
+
+
+def test_error_rate_excludes_model():
+    router, _ = make_router(slo=0.2)
+    observe(router, "cheap", 0.05)
+    for _ in range(5):
+        router.record("cheap", "chat", error=UpstreamError.from_status(503))
+    assert router.route("chat").primary == "premium"
+
+
+def test_request_errors_do_not_count_against_model():
+    router, _ = make_router(slo=0.2)
+    observe(router, "cheap", 0.05)
+    for _ in range(5):
+        router.record("cheap", "chat", error=UpstreamError.from_status(400))
+        router.record("cheap", "chat", error=ResponseParseError("bad json"))
+    assert router.route("chat").primary == "cheap"
+
+
+def test_falls_back_to_fastest_when_no_model_meets_slo():
+    router, _ = make_router(slo=0.01)
+    observe(router, "cheap", 0.5)
+    observe(router, "premium", 0.1)
+
+    assert router.route("chat").primary == "premium"
+    assert router.counters["fallback"] == 1
+
+
+def test_stale_stats_are_probed_again():
+    router, _ = make_router(slo=0.2, probe_interval=0.0)
+    observe(router, "cheap", 0.5)
+    # 超过 probe_interval 没有新样本：重新视为满足 SLO，用真实请求探测
+    assert router.route("chat").primary == "cheap"
+
+
+def test_hedge_delay_follows_primary_p95():
+    router, _ = make_router(slo=1.0, hedge_min_delay=0.01)
+    observe(router, "cheap", 0.1)
+    route = router.route("chat")
+    assert route.primary == "cheap"
+    assert abs(route.hedge_delay - 0.1) < 0.01
+
+
+def test_pinned_model_is_not_routed_or_hedged():
+    router, _ = make_router()
+    route = router.route("chat", model="premium")
+    assert (route.primary, route.hedge) == ("premium", None)
+
+
+# ---- 对冲 ----
+
+def test_slow_primary_triggers_hedge_and_loser_is_cancelled():
+    router, _ = make_router()
+    cancelled = []
+
+    result = asyncio.run(router.acall(router.route("chat"), upstream({"cheap": 1.0, "premium": 0.0}, cancelled)))
+
+    assert result == "premium"
+    assert (router.counters["hedged"], router.counters["hedge_won"]) == (1, 1)
+    assert cancelled == ["cheap"]
+    # 被取消的请求也记一个（截尾的）延迟样本
+    assert router.stats("cheap", "chat").samples == 1
+    assert router.stats("premium", "chat").samples == 1
+
+
+def test_fast_primary_is_not_hedged():
+    router, _ = make_router(slo=0.2)
+    calls = []
+
+    async def fn(model):
+        calls.append(model)
+        return model
+
+    assert asyncio.run(router.acall(router.route("chat"), fn)) == "cheap"
+    assert calls == ["cheap"]
+    assert router.counters["hedged"] == 0
+
+
+def test_failed_side_waits_for_the_other():
+    router, _ = make_router()
+
+    async def fn(model):
+        if model == "premium":
+            raise UpstreamError.from_status(503)
+        await asyncio.sleep(0.05)
+        return model
+
+    assert asyncio.run(router.acall(router.route("chat"), fn)) == "cheap"
+    assert router.counters["hedge_won"] == 0
+
+
+def test_hedge_is_skipped_when_budget_is_exhausted():
+    router, _ = make_router(hedge_ratio=0.0)
+    # 用完初始令牌；ratio=0 时请求不再补充，之后不再对冲
+    while router.budget.withdraw():
+        pass
+
+    result = asyncio.run(router.acall(router.route("chat"), upstream({"cheap": 0.05, "premium": 0.0})))
+
+    assert result == "cheap"
+    assert router.counters["hedge_skipped"] == 1
+
+
+# ---- 对冲与半开探测 ----
+
+def call_with_resilience(router, resilience, delays):
+    route = router.route("chat")
+    return asyncio.run(router.acall(route, lambda m: resilience.acall(m, lambda: upstream(delays)(m))))
+
+
+def test_cancelled_primary_probe_is_released():
+    router, resilience = make_router()
+    breaker = trip(resilience, "cheap")
+
+    result = call_with_resilience(router, resilience, {"cheap": 1.0, "premium": 0.0})
+
+    assert result == "premium"
+    assert router.counters["hedge_won"] == 1
+    # 被取消的探测请求没有给出结论：仍是半开，但探测名额已归还
+    assert breaker.state == "half_open"
+    assert breaker.acquire() == "probe"
+
+
+def test_cancelled_hedge_probe_is_released():
+    router, resilience = make_router()
+    breaker = trip(resilience, "premium")
+
+    result = call_with_resilience(router, resilience, {"cheap": 0.1, "premium": 1.0})
+
+    assert result == "cheap"
+    assert router.counters["hedged"] == 1
+    assert breaker.state == "half_open"
+    assert breaker.acquire() == "probe"
+
+
+def test_winning_probe_closes_breaker():
+    router, resilience = make_router()
+    breaker = trip(resilience, "cheap")
+
+    assert call_with_resilience(router, resilience, {"cheap": 0.0, "premium": 1.0}) == "cheap"
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_is_routed_around_until_reset_timeout():
+    resilience = Resilience(max_attempts=1, reset_timeout=60.0)
+    router = ModelRouter({"cheap": {"cost": 1.0}, "premium": {"cost": 4.0}},
+                         {"chat": {"slo": 0.2, "models": ["cheap", "premium"]}}, resilience=resilience)
+    breaker = trip(resilience, "cheap")
+    assert router.route("chat").primary == "premium"
+
+    breaker.reset_timeout = 0.0
+    assert router.route("chat").primary == "cheap"